@@ -1,4 +1,6 @@
 import abs_sys
 import fN
 import igm_utils
+import mock_forest
 import tau_eff
+import transmission
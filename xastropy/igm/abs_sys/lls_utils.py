@@ -26,6 +26,7 @@ from xastropy.igm.abs_sys.abs_survey import AbslineSurvey
 from xastropy.igm.abs_sys.abssys_utils import AbslineSystem, Abs_Sub_System
 from xastropy.igm.abs_sys.ionclms import Ionic_Clm_File, IonClms
 from xastropy.spec import abs_line, voigt
+from xastropy.spec import smooth as xsm
 from xastropy.atomic import ionization as xatomi
 from xastropy.xutils import xdebug as xdb
 
@@ -219,13 +220,15 @@ class LLSSystem(AbslineSystem):
         
 
     # Absorption model of the LLS (HI only)
-    def flux_model(self,spec,smooth=0):
+    def flux_model(self,spec,smooth=0,tau_min=None):
         """
         Generate a LLS model given an input spectrum
 
         Parameters:
           spec:  Barak Spectrum (will migrate to specutils.Spectrum1D)
           smooth : (0) Number of pixels to smooth by
+          tau_min : (None) Only evaluate each Lyman line where its optical
+            depth exceeds tau_min (see voigt.voigt_tau_window)
 
         Returns:
           Output model is passed back as a Spectrum 
@@ -249,7 +252,8 @@ class LLSSystem(AbslineSystem):
             self.fill_lls_lines()
 
         #xdb.set_trace()
-        tau_Lyman = voigt.voigt_model(spec.dispersion, self.lls_lines, flg_ret=2)
+        tau_Lyman = voigt.voigt_model(spec.dispersion, self.lls_lines, flg_ret=2,
+                                      tau_min=tau_min)
 
         # Combine
         tau_model = tau_LL + tau_Lyman
@@ -261,11 +265,12 @@ class LLSSystem(AbslineSystem):
         
         # Fill in flux
         model = copy.deepcopy(spec)
-        model.flux = np.exp(-1. * tau_model).value
+        flux = np.exp(-1. * tau_model).value
 
-        # Smooth?
+        # Smooth? (Gaussian FWHM in pixels)
         if smooth > 0:
-            model.gauss_smooth(npix=smooth)
+            flux = xsm.convolve_lsf(flux, smooth)
+        model.flux = flux
 
         # Return
         return model
@@ -13,7 +13,7 @@
 
 from __future__ import print_function, absolute_import, division, unicode_literals
 import numpy as np
-import os, pickle, imp
+import os, pickle, imp, warnings
 from scipy import interpolate as scii
 
 from xastropy.xutils import xdebug as xdb
@@ -90,6 +90,8 @@ class fN_Model(object):
         """ Update parameters (mainly used in the MCMC)
            Updates other things as needed
         """
+        # Cached factors of eval
+        self._cache = {}
         if self.fN_mtype == 'Hspline':
             self.param = parm
             # Need to update the model too
@@ -105,73 +107,76 @@ class fN_Model(object):
 
     ##
     # l(X)
-    def calc_lox(self, z, NHI_min, NHI_max=None, neval=10000, cumul=False):
+    def calc_lox(self, z, NHI_min, NHI_max=None, neval=10000, cumul=False,
+                 method='sum', tol=1e-6, nmax=128):
         """ Calculate l(X) over an N_HI interval
 
         Parameters:
-        z: float
-          Redshift for evaluation
+        z: float or array
+          Redshift(s) for evaluation
         NHI_min: float
           minimum NHI value
         NHI_max: float (Infinity)
           maximum NHI value for evaluation
+          If None, the model is integrated to NHI=23 and the tail
+          beyond is added analytically (power-law extrapolation)
         neval: int (10000)
-          Discretization parameter
+          Discretization parameter (method='sum')
         cumul: boolean (False)
-          Return a cumulative array?
+          Return a cumulative array? (method='sum' only)
+        method: str ('sum')
+          'sum'  -- Brute force sum on neval points (good to ~0.5%)
+          'quad' -- Gauss-Legendre quadrature in log NHI, refined
+                    until the relative error is below tol
+        tol: float (1e-6)
+          Relative accuracy for method='quad'
+        nmax: int (128)
+          Maximum number of nodes per panel for method='quad'
 
         Returns:
-        lX: float
-          l(X) value
+        lX: float or array
+          l(X) value(s)
 
         JXP 10 Nov 2014
         """
         # Initial
-        if NHI_max==None:
+        if NHI_max is None:
             NHI_max = 23.
             infinity=True
         else: infinity=False
 
         try:
             nz = len(z)
-        except:
+            z = np.array(z)
+        except TypeError:
             nz=1
             z = np.array([z])
 
-        # Brute force (should be good to ~0.5%)
-        lgNHI = NHI_min + (NHI_max-NHI_min)*np.arange(neval)/(neval-1.)
-        dlgN = lgNHI[1]-lgNHI[0]
-
-        # Evaluate f(N,X)
-        lgfNX = self.eval(lgNHI, z)
-        #xdb.set_trace()
-
-        # Sum
-        lX = np.zeros(nz)
-        for ii in range(nz): 
-            lX[ii] = np.sum(10.**(lgfNX[:,ii]+lgNHI)) * dlgN * np.log(10.)
-        if cumul==True: 
-            if nz > 1: #; Have not modified this yet
-                raise ValueError('fN.model: Not ready for this model type %s' % self.fN_mtype)
-            cum_sum = np.cumsum(10.**(lgfNX[:,ii]+lgNHI)) * dlgN * np.log(10.)
-        #xdb.set_trace()
+        if method == 'quad':
+            if cumul==True:
+                raise ValueError('fN.model.calc_lox: cumul not available for method=quad')
+            lX = self._lox_quad(z, NHI_min, NHI_max, tol=tol, nmax=nmax)
+        elif method == 'sum':
+            # Brute force (should be good to ~0.5%)
+            lgNHI = NHI_min + (NHI_max-NHI_min)*np.arange(neval)/(neval-1.)
+            dlgN = lgNHI[1]-lgNHI[0]
+
+            # Evaluate f(N,X)
+            lgfNX = np.reshape(self.eval(lgNHI, z), (neval, nz))
+
+            # Sum
+            fNX = 10.**(lgfNX+lgNHI[:,None])
+            lX = np.sum(fNX, 0) * dlgN * np.log(10.)
+            if cumul==True: 
+                if nz > 1: #; Have not modified this yet
+                    raise ValueError('fN.model: Not ready for this model type %s' % self.fN_mtype)
+                cum_sum = np.cumsum(fNX[:,0]) * dlgN * np.log(10.)
+        else:
+            raise ValueError('fN.model.calc_lox: Not ready for method {:s}'.format(method))
 
         # Infinity?
         if infinity is True:
-            # This is risky...
-            # Best to cut it off
-            xdb.set_trace()
-            neval2 = 1000L
-            lgNHI2 = NHI_max + (99.-NHI_max)*np.arange(neval2)/(neval2-1.)
-            dlgN = lgNHI2[1]-lgNHI2[0]
-            lgfNX = np.zeros((neval2,nz))
-            lX2 = np.zeros(nz)
-            for ii in range(nz):
-                lgfNX[:,ii] = self.eval(lgNHI2, z[ii]).flatten()
-                lX2[ii] = np.sum(10.**(lgfNX[:,ii]+lgNHI2)) * dlgN * np.log(10.)
-                xdb.set_trace()
-            # 
-            lX = lX + lX2
+            lX = lX + self._lox_tail(z, NHI_max)
 
         # Return
         if nz==1:
@@ -180,6 +185,55 @@ class fN_Model(object):
             return lX, cum_sum, lgNHI
         else:
             return lX
+
+    def _lox_quad(self, z, NHI_min, NHI_max, tol=1e-6, nmax=128):
+        """ l(X) from Gauss-Legendre quadrature in log NHI
+        Panels break at the spline pivots (or every dex); the number of
+        nodes per panel doubles until successive estimates agree to tol
+        at all z.  One model evaluation per refinement.
+        """
+        nz = len(z)
+        # Panels
+        if self.fN_mtype == 'Hspline':
+            edges = np.array(self.pivots, dtype=np.float64)
+        else:
+            edges = np.arange(np.ceil(NHI_min), NHI_max)
+        edges = edges[(edges > NHI_min) & (edges < NHI_max)]
+        edges = np.concatenate([[NHI_min], edges, [NHI_max]])
+        cen = 0.5*(edges[1:]+edges[:-1])
+        half = 0.5*(edges[1:]-edges[:-1])
+
+        npt = 4
+        lX_prev = None
+        while True:
+            xg, wg = np.polynomial.legendre.leggauss(npt)
+            lgNHI = (cen[:,None] + half[:,None]*xg[None,:]).flatten()
+            wts = (half[:,None]*wg[None,:]).flatten() * np.log(10.)
+            lgfNX = np.reshape(self.eval(lgNHI, z), (len(lgNHI), nz))
+            lX = np.dot(wts, 10.**(lgfNX+lgNHI[:,None]))
+            if lX_prev is not None:
+                err = np.abs(lX-lX_prev)
+                if np.all(err <= tol*np.abs(lX)):
+                    break
+                if 2*npt > nmax:
+                    print('fN.model.calc_lox: Not converged to tol={:g} (rel. err={:g})'.format(
+                        tol, np.max(err/np.abs(lX))))
+                    break
+            lX_prev = lX
+            npt *= 2
+        return lX
+
+    def _lox_tail(self, z, NHI_max, dlgN=1e-3):
+        """ l(X) from NHI_max to infinity
+        f(N,X) is extrapolated as a power-law with its local slope at NHI_max
+        """
+        lgfNX = np.reshape(self.eval(np.array([NHI_max-dlgN, NHI_max]), z), (2, len(z)))
+        slope = (lgfNX[1,:]-lgfNX[0,:]) / dlgN  # dlog f / dlog N
+        if np.any(slope >= -1.):
+            raise ValueError('fN.model.calc_lox: f(N,X) tail does not converge beyond NHI={:g}'.format(NHI_max))
+        # int_N0^inf f(N) dN = f(N0) N0 / -(slope+1)
+        return 10.**(lgfNX[1,:]+NHI_max) / (-1.*(slope+1.))
+
     ##
     # Evaluate
     def eval(self, NHI, z, vel_array=None, cosmo=None):
@@ -227,7 +281,6 @@ class fN_Model(object):
         else: z_val = np.array([z_val])
         lenz = len(z_val)
 
-    
         # Check on zmnx
         bad = np.where( (z_val < self.zmnx[0]) | (z_val > self.zmnx[1]))[0]
         if len(bad) > 0:
@@ -235,80 +288,29 @@ class fN_Model(object):
                 'fN.model.eval: z={:g} not within self.zmnx={:g},{:g}'.format(z_val[bad[0]],*(self.zmnx)))
 
         if self.fN_mtype == 'Hspline': 
-            # Evaluate without z dependence
-            log_fNX = self.model.__call__(NHI)
-
-
-            # Evaluate
-            #xdb.set_trace()
-            if (not isiterable(z_val)) | (flg_1D == 1):  # scalar or 1D array wanted
-                log_fNX += self.gamma * np.log10((1+z_val)/(1+self.zpivot))
+            # Evaluate without z dependence (cached)
+            log_fNX = self._cached('N', NHI, None, lambda: self.model.__call__(NHI))
+            # (1+z)^gamma
+            log_fz = self.gamma * np.log10((1+z_val)/(1+self.zpivot))
+            if flg_1D == 1:  # 1D array wanted
+                log_fNX = log_fNX + log_fz
             else:
-                # Matrix algebra to speed things up
-                lgNHI_grid = np.outer(log_fNX, np.ones(len(z_val)))
-                lenfX = len(log_fNX)
-                #xdb.set_trace()
-                # 
-                z_grid1 = 10**( np.outer(np.ones(lenfX)*self.gamma,
-                                        np.log10(1+z_val)) )  #; (1+z)^gamma
-                z_grid2 = np.outer( np.ones(lenfX)*((1./(1+self.zpivot))**self.gamma), 
-                            np.ones(len(z_val))  )
-                log_fNX = lgNHI_grid + np.log10(z_grid1*z_grid2) 
+                log_fNX = log_fNX[:,None] + log_fz[None,:]
 
         # Gamma function (e.g. Inoue+14)
         elif self.fN_mtype == 'Gamma': 
-            # Setup the parameters
-            Nl, Nu, Nc, bval = self.param[0]
-
-            # gNHI
-            Bi = self.param[1]
-            ncomp = len(Bi)
-            log_gN = np.zeros((lenNHI,ncomp))
-            beta = [item[1] for item in self.param[2:]] 
-            for kk in range(ncomp):
-                #xdb.set_trace()
-                log_gN[:,kk] += (np.log10(Bi[kk]) + NHI*(-1 * beta[kk])
-                                + (-1. * 10.**(NHI-Nc) / np.log(10) ) ) # log10 [ exp(-NHI/Nc) ]
-            # f(z)
-            fz = np.zeros((lenz,2))
-            # Loop on NHI
-            for kk in range(ncomp):
-                if kk == 0: # LyaF
-                    zcuts = self.param[2][2:4]
-                    gamma = self.param[2][4:]
-                else:       # DLA
-                    zcuts = [self.param[3][2]]
-                    gamma = self.param[3][3:]
-                zcuts = [0] + list(zcuts) + [999.]
-                Aval = self.param[2+kk][0]
-                # Cut on z
-                for ii in range(1,len(zcuts)):
-                    izcut = np.where( (z_val < zcuts[ii]) & (z_val > zcuts[ii-1]) )[0]
-                    liz = len(izcut)
-                    # Evaluate (at last!)
-                    #xdb.set_trace()
-                    if (ii <=2) & (liz > 0):
-                        fz[izcut,kk] = Aval * ( (1+z_val[izcut]) / (1+zcuts[1]) )**gamma[ii-1]
-                    elif (ii == 3) & (liz > 0):
-                        fz[izcut,kk] = Aval * ( ( (1+zcuts[2]) / (1+zcuts[1]) )**gamma[ii-2] * 
-                                                    ((1+z_val[izcut]) / (1+zcuts[2]) )**gamma[ii-1] )
-#                            else: 
-#                                raise ValueError('fN.model.eval: Should not get here')
-            # dX/dz
-            dXdz = igmu.cosm_xz(z_val, cosmo=cosmo, flg=1) 
+            # g(NHI) [lenNHI, ncomp] and f(z), dX/dz [lenz, ncomp] (cached)
+            gN = self._cached('N', NHI, None, lambda: 10.**self._gamma_log_gN(NHI))
+            fz, dXdz = self._cached('z', z_val, cosmo, lambda: self._gamma_fz(z_val, cosmo))
 
             # Final steps
             if flg_1D == 1: # 
-                #xdb.set_trace()
-                fnX = np.sum(fz * 10.**log_gN, 1) / dXdz
+                fnX = np.sum(fz * gN, 1) / dXdz
                 log_fNX = np.log10(fnX)
             else: 
-                # Generate the matrix
-                fnz = np.zeros((lenNHI,lenz))
-                for kk in range(ncomp):
-                    fnz += np.outer(10.**log_gN[:,kk],fz[:,kk])
-                # Finish up
-                log_fNX = np.log10(fnz) - np.log10( np.outer(np.ones(lenNHI), dXdz) )
+                # Sum over the components
+                fnz = np.dot(gN, fz.T)
+                log_fNX = np.log10(fnz) - np.log10(dXdz)[None,:]
         else: 
             raise ValueError('fN.model: Not ready for this model type {:%s}'.format(self.fN_mtype))
 
@@ -316,58 +318,179 @@ class fN_Model(object):
         if (lenNHI + lenz) == 2:
             return log_fNX.flatten()[0] # scalar
         else: return log_fNX
+
+    def _cached(self, kind, vals, cosmo, func):
+        """ Factors of eval cached by the input array (and cosmology)
+        Cleared by upd_param; fN_Model objects read from a pickle
+        start without a cache
+        """
+        import hashlib
+        cache = getattr(self, '_cache', None)
+        if cache is None:
+            cache = self._cache = {}
+        ckey = None if cosmo is None else igmu.cosmo_key(cosmo)
+        key = (kind, len(vals), hashlib.md5(np.ascontiguousarray(vals, dtype=np.float64)).hexdigest(), ckey)
+        if key not in cache:
+            if len(cache) >= 64:
+                cache.clear()
+            cache[key] = func()
+        return cache[key]
+
+    def _gamma_log_gN(self, NHI):
+        """ log10 g(NHI) of each component [lenNHI, ncomp] (Gamma model)
+        """
+        Nl, Nu, Nc, bval = self.param[0]
+        Bi = np.asarray(self.param[1], dtype=np.float64)
+        beta = np.array([item[1] for item in self.param[2:]], dtype=np.float64)
+        return (np.log10(Bi)[None,:] - NHI[:,None]*beta[None,:]
+                - (10.**(NHI-Nc) / np.log(10))[:,None])  # log10 [ exp(-NHI/Nc) ]
+
+    def _gamma_fz(self, z_val, cosmo):
+        """ f(z) of each component [lenz, ncomp] and dX/dz (Gamma model)
+        Broken power laws in (1+z), continuous at the cuts
+        """
+        # Cuts and exponents padded to three segments per component
+        cut1 = np.array([self.param[2][2], self.param[3][2]])
+        cut2 = np.array([self.param[2][3], 999.])
+        gam = np.array([list(self.param[2][4:7]), list(self.param[3][3:5])+[0.]])
+        Aval = np.array([self.param[2][0], self.param[3][0]])
+        zz = z_val[:,None]
+        seg = (zz > cut1[None,:]).astype(int) + (zz > cut2[None,:]).astype(int)
+        ncomp = len(Aval)
+        gseg = gam[np.arange(ncomp)[None,:], seg]
+        fz = np.where(seg < 2, ((1+zz) / (1+cut1[None,:]))**gseg,
+                      ((1+cut2) / (1+cut1))[None,:]**gam[:,1][None,:] *
+                      ((1+zz) / (1+cut2[None,:]))**gseg)
+        fz = Aval[None,:] * fz
+        # dX/dz
+        dXdz = np.atleast_1d(igmu.cosm_xz(z_val, cosmo=cosmo, flg=1))
+        return fz, dXdz
     ##
     # Mean Free Path
-    def mfp(self, zem, neval=5000, cosmo=None, zmin=0.6):
-        """ Calculate teff_LL 
-        Effective opacity from LL absorption at z912 from zem
+    def mfp(self, zem, neval=5000, cosmo=None, zmin=0.6, nchunk=256, nsig=400):
+        """ Calculate the mean free path to LL photons
+        Distance from zem to the redshift where teff_LL = 1
+
+        All sources share one table of the NHI integral of teff_ll
+        vs. (cross-section, z); teff_LL(z) of each source is then a
+        cumulative integral in z, and the tau=1 crossing is
+        interpolated between grid points.
 
         Parameters:
-        zem: float
-          Redshift of source
+        zem: float or array
+          Redshift(s) of source
         cosmo: astropy.cosmology (None)
           Cosmological model to adopt (as needed)
         neval: int (5000)
-          Discretization parameter
-        zmin: float (0.5)
+          Discretization parameter (NHI and z)
+        zmin: float (0.6)
           Minimum redshift in the calculation
+        nchunk: int (256)
+          Redshifts per block of the NHI integral
+        nsig: int (400)
+          Number of cross-sections of the NHI-integral table
 
         Returns:
-        mfp : float
+        mfp : Quantity (float or array)
           Mean free path from zem (physical Mpc)
+          NaN (with a warning) where zem <= zmin or teff_LL does
+          not reach unity above zmin
 
         JXP 11 Nov 2014
         """
         # Imports
         from astropy import constants as const
-        from astropy import cosmology 
+        from astropy.cosmology import FlatLambdaCDM
 
         # Cosmology
-        if cosmo == None:
-            cosmo = cosmology.core.FlatLambdaCDM(70., 0.3)
-
-        # Calculate teff
-        zval, teff_LL = self.teff_ll(zmin, zem, N_eval=neval, cosmo=cosmo)
+        if cosmo is None:
+            cosmo = FlatLambdaCDM(70., 0.3)
+
+        flg_scalar = not isiterable(zem)
+        zall = np.atleast_1d(np.array(zem, dtype=np.float64))
+        # Sources at or below zmin are masked (NaN)
+        z1 = np.zeros(len(zall)) + np.nan
+        gdz = np.where(zall > zmin)[0]
+        zem = zall[gdz]
+        nzem = len(zem)
+
+        # NHI and z arrays
+        lgNval = 11.5 + 10.5*np.arange(neval)/(neval-1.) #; This is base 10 [Max at 22]
+        dlgN = lgNval[1]-lgNval[0]
+        Nval = 10.**lgNval
+        zmax = np.max(zem) if nzem > 0 else zmin+1.
+        zval = zmin + (zmax-zmin)*np.arange(neval)/(neval-1.)
+        dz = zval[1]-zval[0]
+        dXdz = igmu.cosm_xz(zval, cosmo=cosmo, flg=1) 
 
-        # Find tau=1
-        imn = np.argmin( np.fabs(teff_LL-1.) )
-        if np.fabs(teff_LL[imn]-1.) > 0.02:
-            raise ValueError('fN.model.mfp: teff_LL too far from unity')
+        # Photon energy Ryd (1+zem)/(1+z) -> cross-section vs. log of the ratio
+        logr = np.linspace(0., np.log((1+zmax)/(1+zmin)), nsig)
+        energy = const.Ryd.to(u.eV,equivalencies=u.spectral()) * np.exp(logr)
+        sigma = xai.photo_cross(1,1,energy).to(u.cm**2).value
+        sigma = np.where(sigma > 0., sigma, sigma[np.argmax(sigma > 0.)])
+
+        # NHI integral vs. (sigma, z) [nsig, neval], a block of z at a time
+        wgt = -1.*np.expm1(-1.*np.outer(sigma, Nval)) * Nval[None,:] * dlgN * np.log(10.)
+        hval = np.zeros((nsig, neval))
+        for i0 in range(0, neval, nchunk):
+            blk = slice(i0, min(i0+nchunk, neval))
+            fnz = 10.**np.reshape(self.eval(lgNval, zval[blk]), (neval, -1)) * dXdz[blk]
+            hval[:,blk] = np.dot(wgt, fnz)
+        log_h = np.log(np.maximum(hval, 1e-300))
+
+        # Integrand of each source [nzem, neval]; log-log interpolation in sigma
+        fidx = np.log(np.maximum((1+zem[:,None])/(1+zval[None,:]), 1.)) / (logr[1]-logr[0])
+        kk = np.minimum(fidx.astype(int), nsig-2)
+        frac = np.minimum(fidx-kk, 1.)
+        jz = np.arange(neval)[None,:]
+        gval = np.exp(log_h[kk,jz]*(1-frac) + log_h[kk+1,jz]*frac)
+
+        # teff_LL(z) = int_z^zem (cumulative trapezoidal sum from zmin)
+        cum = np.zeros((nzem, neval))
+        cum[:,1:] = np.cumsum(0.5*(gval[:,1:]+gval[:,:-1]), axis=1) * dz
+        iw = np.arange(nzem)
+        fz = (zem-zmin)/dz
+        iz = np.minimum(fz.astype(int), neval-2)
+        cum_em = cum[iw,iz]*(1-(fz-iz)) + cum[iw,iz+1]*(fz-iz)
+        teff_LL = np.where(zval[None,:] < zem[:,None], cum_em[:,None]-cum, 0.)
+
+        # Find tau=1 (teff_LL decreases with z); masked if not reached above zmin
+        above = teff_LL >= 1.
+        ilast = neval-1 - np.argmax(above[:,::-1], axis=1)
+        inext = np.minimum(ilast+1, neval-1)
+        t0, t1 = teff_LL[iw,ilast], teff_LL[iw,inext]
+        z0, zval1 = zval[ilast], np.minimum(zval[inext], zem)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frac = np.where(t0 > t1, (t0-1.)/(t0-t1), 0.)
+        z1[gdz] = np.where(above[:,0], z0 + frac*(zval1-z0), np.nan)
+        bad = ~np.isfinite(z1)
+        if np.any(bad):
+            warnings.warn('fN.model.mfp: zem <= zmin or teff_LL < 1 at zmin={:g} for zem={:s}; MFP set to NaN'.format(
+                zmin, str(zall[bad])))
 
         # MFP
-        mfp = np.fabs( cosmo.lookback_distance(zval[imn]) -
-                        cosmo.lookback_distance(zem) ) # Mpc
-        #xdb.set_trace()
+        mfp = np.zeros(len(zall)) + np.nan
+        gd = np.where(~bad)[0]
+        if len(gd) > 0:
+            mfp[gd] = np.fabs( cosmo.lookback_distance(z1[gd]) -
+                               cosmo.lookback_distance(zall[gd]) ).to(u.Mpc).value
+        mfp = mfp * u.Mpc
         # Return
-        return mfp
+        if flg_scalar:
+            return mfp[0]
+        else:
+            return mfp
         
 
     ##
     # teff_LL
-    def teff_ll(self, z912, zem, N_eval=5000, cosmo=None):
+    def teff_ll(self, z912, zem, N_eval=5000, cosmo=None, nchunk=256):
         """ Calculate teff_LL 
         Effective opacity from LL absorption at z912 from zem
 
+        The NHI integral is done for blocks of nchunk redshifts, so
+        memory scales as N_eval*nchunk instead of N_eval^2.
+
         Parameters:
         z912: float
           Redshift for evaluation
@@ -377,6 +500,8 @@ class fN_Model(object):
           Cosmological model to adopt (as needed)
         N_eval: int (5000)
           Discretization parameter
+        nchunk: int (256)
+          Redshifts per block
 
         Returns:
         zval, teff_LL: array
@@ -396,48 +521,29 @@ class fN_Model(object):
         zval = z912 + (zem-z912)*np.arange(N_eval)/(N_eval-1.)
         dz = np.fabs(zval[1]-zval[0])
 
-        teff_LL = np.zeros(N_eval)
-
         # dXdz
         dXdz = igmu.cosm_xz(zval, cosmo=cosmo, flg=1) 
         #if keyword_set(FNZ) then dXdz = replicate(1.,N_eval)
 
-        # Evaluate f(N,X)
-        velo = (zval-zem)/(1+zem) * (const.c.cgs.value/1e5) # Kludge for eval [km/s]
-
-        log_fnX = self.eval(lgNval, zem, vel_array=velo)  
-        log_fnz = log_fnX + np.outer(np.ones(N_eval), np.log10(dXdz))
-
-        # Evaluate tau(z,N)
+        # Photon energy at each z
         teff_engy = (const.Ryd.to(u.eV,equivalencies=u.spectral()) /
                      ((1+zval)/(1+zem)) )
-        sigma_z = xai.photo_cross(1,1,teff_engy)
-        #xdb.set_trace()
+        sigma_z = xai.photo_cross(1,1,teff_engy).to(u.cm**2).value
         #sigma_z = teff_cross * ((1+zval)/(1+zem))**(2.75)  # Not exact but close
-        tau_zN = np.outer(Nval, sigma_z)
 
-        # Integrand
-        intg = 10.**(log_fnz) * (1. - np.exp(-1.*tau_zN))
+        # Sum in N first, a block of z at a time
+        N_summed = np.zeros(N_eval)
+        for i0 in range(0, N_eval, nchunk):
+            blk = slice(i0, min(i0+nchunk, N_eval))
+            # f(N,z) [N_eval, nblk]
+            log_fnz = np.reshape(self.eval(lgNval, zval[blk]), (N_eval, -1)) + np.log10(dXdz[blk])
+            # Integrand, with tau(z,N) = N sigma
+            intg = 10.**(log_fnz + lgNval[:,None]) * (-1.*np.expm1(-1.*np.outer(Nval, sigma_z[blk])))
+            N_summed[blk] = np.sum(intg, 0) * dlgN * np.log(10.)
 
-        # Sum
-        sumz_first = False
-        if sumz_first == False:
-            #; Sum in N first
-            N_summed = np.sum(intg * np.outer(Nval, np.ones(N_eval)),  0) * dlgN * np.log(10.)
-            #xdb.set_trace()
-            # Sum in z
-            teff_LL = (np.cumsum(N_summed[::-1]))[::-1] * dz 
-        #xdb.set_trace()
+        # Sum in z
+        teff_LL = (np.cumsum(N_summed[::-1]))[::-1] * dz 
 
-        # Debug
-        debug=False
-        if debug == True:
-            #        x_splot, lgNval, alog10(10.d^(log_fnX) * dxdz * dz * Nval), /bloc
-            #        x_splot, lgNval, total(10.d^(log_fnX) * dxdz * dz * Nval,/cumul) * dlgN * alog(10.) / teff_lyman[qq], /bloc
-            #     printcol, lgnval, log_fnx, dz,  alog10(10.d^(log_fnX) * dxdz * dz * Nval)
-            #     writecol, 'debug_file'+strtrim(qq,2)+'.dat', $
-            #               lgNval, restEW, log_fnX
-            xdb.set_trace()
         # Return
         return zval, teff_LL
 
@@ -22,10 +22,119 @@ from astropy.utils.misc import isiterable
 from xastropy.xutils import xdebug as xdb
 
 # cosm_xz -- Calculates X(z), the absorption path length
+# XzTable -- Spline tables of X(z) and dX/dz for one cosmology
+# xz_table -- Cached XzTable for a cosmology
 # X_Cosmo -- Class that inherits astropy.cosmology FlatLambdaCDM class
 
+# Default cosmology and X(z) tables (keyed by cosmology)
+_default_cosmo = None
+_xz_tables = {}
+nmax_tables = 16
+
+def default_cosmo():
+    """ Default cosmology of the IGM routines, built once
+    Returns:
+      FlatLambdaCDM(H0=70, Om0=0.3)
+    """
+    global _default_cosmo
+    if _default_cosmo is None:
+        _default_cosmo = FlatLambdaCDM(70., 0.3)
+    return _default_cosmo
+
+def cosmo_key(cosmo):
+    """ Hashable key of the parameters setting E(z)
+    """
+    return (cosmo.__class__.__name__, float(cosmo.H0.value), float(cosmo.Om0),
+            float(cosmo.Ode0), float(cosmo.Ok0), float(getattr(cosmo.Tcmb0, 'value', cosmo.Tcmb0)),
+            float(cosmo.Neff), repr(cosmo.m_nu))
+
+class XzTable(object):
+    """ Spline tables of the absorption path X(z) and dX/dz
+
+    dX/dln(1+z) = (1+z)^3 / E(z) is tabulated on a uniform grid in
+    ln(1+z) and fit with a cubic spline; X(z) is the exact integral of
+    that spline.  With the defaults (nz=2001, zmax=20) the relative
+    error of X(z) and dX/dz is below 1e-10 for 0 < z < zmax.
+    Redshifts beyond zmax grow the table; negative redshifts are
+    evaluated directly.
+
+    Parameters:
+      cosmo: astropy.cosmology
+      zmax: float (20.)
+        Maximum redshift of the table
+      nz: int (2001)
+        Number of grid points
+    """
+    def __init__(self, cosmo, zmax=20., nz=2001):
+        self.cosmo = cosmo
+        self.nz = nz
+        self._build(zmax)
+
+    def _build(self, zmax):
+        from scipy.interpolate import InterpolatedUnivariateSpline
+        self.zmax = zmax
+        ugrid = np.linspace(0., np.log1p(zmax), self.nz)
+        zgrid = np.expm1(ugrid)
+        self._dXdu = InterpolatedUnivariateSpline(ugrid, (1+zgrid)**3 * self.cosmo.inv_efunc(zgrid), k=3)
+        self._Xu = self._dXdu.antiderivative()
+
+    def _eval(self, z, flg):
+        zarr = np.asarray(z, dtype=np.float64)
+        if zarr.size > 0 and np.max(zarr) > self.zmax:
+            self._build(2*np.max(zarr))
+        uval = np.log1p(np.maximum(zarr, 0.)).ravel()
+        if flg == 0:
+            rslt = self._Xu(uval)
+        else:
+            rslt = self._dXdu(uval) / np.exp(uval)
+        rslt = rslt.reshape(zarr.shape)
+        # Negative redshifts
+        neg = zarr < 0.
+        if np.any(neg):
+            if flg == 0:
+                rslt[neg] = [self.cosmo.absorption_distance(zz) for zz in zarr[neg]]
+            else:
+                rslt[neg] = (1+zarr[neg])**2 * self.cosmo.inv_efunc(zarr[neg])
+        if rslt.ndim == 0:
+            return float(rslt)
+        return rslt
+
+    def X(self, z):
+        """ Absorption path X(z) from z=0 (any shape)
+        """
+        return self._eval(z, 0)
+
+    def dXdz(self, z):
+        """ dX/dz at z (any shape)
+        """
+        return self._eval(z, 1)
+
+    # Output
+    def __repr__(self):
+        return ('[{:s}: zmax={:g}, nz={:d}, cosmo={:s}]'.format(
+                self.__class__.__name__, self.zmax, self.nz, self.cosmo.__class__.__name__))
+
+def xz_table(cosmo=None, zmax=20., nz=2001):
+    """ Cached X(z) tables for a cosmology
+    Parameters:
+      cosmo: astropy.cosmology (None)
+        Default is default_cosmo()
+      zmax, nz: see XzTable
+
+    Returns:
+      XzTable
+    """
+    if cosmo is None:
+        cosmo = default_cosmo()
+    key = cosmo_key(cosmo) + (nz,)
+    if key not in _xz_tables:
+        if len(_xz_tables) >= nmax_tables:
+            _xz_tables.clear()
+        _xz_tables[key] = XzTable(cosmo, zmax=zmax, nz=nz)
+    return _xz_tables[key]
+
 # cosm_xz -- Calculates X(z), the absorption path length of dxdz
-def cosm_xz(z, cosmo=None, zmin=0., flg=0):
+def cosm_xz(z, cosmo=None, zmin=0., flg=0, exact=False):
     """ Calculates X(z) -- absorption path length or dXdz
     Parameters:
       z: float or ndarray
@@ -38,6 +147,9 @@ def cosm_xz(z, cosmo=None, zmin=0., flg=0):
         Flag controlling the output
           0 = X(z)
           1 = dX/dz at z
+      exact: bool (False)
+        Integrate with astropy instead of using the
+        cached tables (see XzTable for their accuracy)
 
     Returns:
       Xz or dXdz: 
@@ -50,17 +162,24 @@ def cosm_xz(z, cosmo=None, zmin=0., flg=0):
 
     # Cosmology
     if cosmo == None:
-        from astropy.cosmology import core as acc
-        cosmo = acc.FlatLambdaCDM(70., 0.3)
+        cosmo = default_cosmo()
         #cosmo = Planck13
 
     # Flat?
     if cosmo.Ok(0.) == 0:
-        if flg == 0:  # X(z)
-            rslt = cosmo.absorption_distance(z)
-        elif flg == 1:  # dX/dz
-            rslt = cosmo._xfunc(z)
-        else: raise ValueError('igm_utils.cosm_xz: Bad flg %d' % flg)
+        if flg not in [0,1]:
+            raise ValueError('igm_utils.cosm_xz: Bad flg %d' % flg)
+        if exact:
+            if flg == 0:  # X(z)
+                rslt = cosmo.absorption_distance(z)
+            else:  # dX/dz
+                rslt = (1+np.asarray(z))**2 * cosmo.inv_efunc(z)
+        else:
+            xztab = xz_table(cosmo)
+            if flg == 0:  # X(z)
+                rslt = xztab.X(z)
+            else:  # dX/dz
+                rslt = xztab.dXdz(z)
     else:
         raise ValueError('igm_utils.cosm_xz: Not prepared for non-flat cosmology')
 
@@ -77,29 +196,78 @@ class X_Cosmo(FlatLambdaCDM):
         # Generate 
         FlatLambdaCDM.__init__(self,H0,Om0)
     #
-    def physical_distance(self,z):
+    def physical_distance(self,z, precision=1e-8):
         """ Physical line-of-sight distance in Mpc at a given redshift.
+        Evaluated from a cached spline table of the lookback time
 
         Parameters
         ----------
         z : array_like
-          Input redshifts.  Must be 1D or scalar.
+          Input redshifts (any shape)
+        precision : float, optional
+          Target relative precision of the table (1e-8).
+          None integrates the lookback time directly.
 
         Returns
         -------
-        d : ndarray, or float if input scalar
+        d : Quantity
           Physical distance in Mpc to each input redshift.
         """
 
         from astropy import units as u
         from astropy import constants as const
 
-        if not isiterable(z):
-            return self.lookback_time(z) * const.c.to(u.Mpc/u.Gyr)
+        if precision is None:
+            if not isiterable(z):
+                return self.lookback_time(z) * const.c.to(u.Mpc/u.Gyr)
+            return (self.lookback_time(np.asarray(z)) * const.c.to(u.Mpc/u.Gyr)).to(u.Mpc)
+
+        zarr = np.asarray(z, dtype=np.float64)
+        zmax = max(np.max(zarr), 0.) if zarr.size > 0 else 0.
+        dtab = self._distance_table(precision, zmax)
+        dist = dtab['spline'](np.log1p(np.maximum(zarr, 0.)).ravel()).reshape(zarr.shape)
+        dist = dist * dtab['DH']
+        # Negative redshifts
+        neg = zarr < 0.
+        if np.any(neg):
+            dist[neg] = (self.lookback_time(zarr[neg]) * const.c.to(u.Mpc/u.Gyr)).to(u.Mpc).value
+        if dist.ndim == 0:
+            dist = float(dist)
+        return dist * u.Mpc
+
+    def _distance_table(self, precision, zmax):
+        # Spline of c * lookback time / D_H = int_0^ln(1+z) du / E(z)
+        # The grid is doubled until two successive tables agree to precision
+        from scipy.interpolate import InterpolatedUnivariateSpline
+        from astropy import units as u
+        from astropy import constants as const
+
+        if not hasattr(self, '_dist_tables'):
+            self._dist_tables = {}
+        dtab = self._dist_tables.get(precision)
+        if (dtab is not None) and (zmax <= dtab['zmax']):
+            return dtab
+        zmax = max(20., 2*zmax)
+        umax = np.log1p(zmax)
+
+        def mk_spline(nz):
+            ugrid = np.linspace(0., umax, nz)
+            return InterpolatedUnivariateSpline(ugrid, self.inv_efunc(np.expm1(ugrid)), k=3).antiderivative()
 
-        out = ( [(self.lookback_time(redshift)*const.c.to(u.Mpc/u.Gyr))
-                 for redshift in z] )
-        return u.Mpc * np.array( [tmp.value for tmp in out] )
+        nz = 129
+        spl = mk_spline(nz)
+        while True:
+            nfine = 2*nz-1
+            spl_fine = mk_spline(nfine)
+            umid = np.linspace(0., umax, 2*nfine-1)[1:]
+            err = np.max(np.abs(spl(umid)/spl_fine(umid) - 1.))
+            nz, spl = nfine, spl_fine
+            if (err < precision) or (nz > 2**20):
+                break
+        dtab = dict(spline=spl, zmax=zmax, nz=nz, err=err,
+                    DH=(const.c / self.H0).to(u.Mpc).value)
+        self._dist_tables[precision] = dtab
+        return dtab
 
 
 
@@ -113,12 +281,20 @@ if __name__ == '__main__':
     # dXdz
     z=3
     print('dX/dz at z=%g is %g' % (z, cosm_xz(z, flg=1)) )
+    zarr = np.linspace(0.1, 6., 100000)
+    print('X(z) at z=(0.1..6) has max rel. error %g' %
+          np.max(np.abs(cosm_xz(zarr[::1000]) / cosm_xz(zarr[::1000], exact=True) - 1)))
 
     # Physical distance
     cosmo = X_Cosmo(H0=75.) # Vanilla
     dist = cosmo.physical_distance(z)
     print('dist to z=%g is %g Mpc' % (z, dist.value))
     dist = cosmo.physical_distance([2., 3])
+    import time
+    zarr = np.random.uniform(0., 6., 1000000)
+    tstart = time.time()
+    dist = cosmo.physical_distance(zarr)
+    print('physical_distance for 10^6 redshifts in {:g}s'.format(time.time()-tstart))
     #xdb.set_trace()
     #print('dist to z=(%g,%g) is (%g,%g) Mpc' %
     #      (z, [item.value for item in dist]) )
@@ -0,0 +1,270 @@
+"""
+#;+
+#; NAME:
+#; igm.mock_forest
+#;    Version 1.0
+#;
+#; PURPOSE:
+#;    Module for Monte Carlo sightlines through the Lya forest
+#;      Absorbers are drawn from an fN_Model and rendered with
+#;      the Lyman series and the Lyman limit
+#;-
+#;------------------------------------------------------------------------------
+"""
+from __future__ import print_function, absolute_import, division, unicode_literals
+
+import numpy as np
+
+from astropy import units as u
+
+from xastropy.igm import igm_utils as igmu
+from xastropy.xutils import xdebug as xdb
+
+# def draw_bval -- Doppler parameters from the Hui & Rutledge (1999) distribution
+# class MockForest -- Draw and render absorbers along a sightline
+# def mock_sightlines -- Many sightlines (optionally in parallel)
+
+def draw_bval(nval, rstate, bsig=24., bmnx=(5., 100.)):
+    """ Doppler parameters from the Hui & Rutledge (1999) distribution
+    dN/db ~ bsig^4/b^5 exp(-bsig^4/b^4), i.e. b = bsig (-ln U)^(-1/4)
+
+    Parameters:
+      nval: int
+      rstate: numpy RandomState
+      bsig: float (24.)
+        bsig (km/s)
+      bmnx: tuple (5., 100.)
+        Range of b (km/s); the distribution is truncated
+
+    Returns:
+      bval: float array (km/s)
+    """
+    # Cumulative distribution F(b) = exp(-(bsig/b)^4)
+    fmin, fmax = [np.exp(-(bsig/bb)**4) for bb in bmnx]
+    uval = rstate.uniform(fmin, fmax, size=nval)
+    return bsig * (-np.log(uval))**(-0.25)
+
+class MockForest(object):
+    """ Monte Carlo sightlines through the Lya forest
+
+    The expected number of absorbers f(N,X) dX/dz dN dz is tabulated
+    once on a (log NHI, z) grid.  Each sightline draws a Poisson number
+    of absorbers from that table (uniform within a cell), Doppler
+    parameters from draw_bval, and is rendered with the Lyman series
+    (spec.voigt.voigt_tau, windowed) and the Lyman limit
+    (atomic.ionization.photo_cross).
+
+    Parameters:
+      fN_model: fN_Model
+      wave: Quantity or float array
+        Wavelength grid of the sightlines (Angstroms for floats)
+      zem: float
+        Emission redshift
+      NHI_MIN, NHI_MAX: float (12., 22.)
+        log NHI range of the absorbers
+      bsig, bmnx: see draw_bval
+      nNHI, nz: int (300, 200)
+        Size of the (log NHI, z) table
+      cosmo: astropy.cosmology (None)
+      tau_min: float (1e-4)
+        Optical depth threshold for the line windows and the Lyman limit
+      method: str ('king')
+        Voigt-function backend (see spec.voigt.voigt_function)
+      lsf: float, tuple or array (None)
+        LSF for smoothing the flux (see spec.smooth.convolve_lsf)
+      lyman_limit: bool (True)
+        Include the Lyman-limit continuum opacity
+
+    Absorbers are only drawn within fN_model.zmnx.
+    """
+    def __init__(self, fN_model, wave, zem, NHI_MIN=12., NHI_MAX=22., bsig=24.,
+                 bmnx=(5., 100.), nNHI=300, nz=200, cosmo=None, tau_min=1e-4,
+                 method='king', lsf=None, lyman_limit=True):
+        from xastropy.spec import abs_line as xsab
+        from xastropy.igm import tau_eff as xit
+
+        self.wave = u.Quantity(wave, u.AA).to(u.AA).value
+        self.zem = zem
+        self.bsig = bsig
+        self.bmnx = bmnx
+        self.tau_min = tau_min
+        self.method = method
+        self.lsf = lsf
+        self.lyman_limit = lyman_limit
+
+        # Lyman series
+        self.wrest = xit.tau_eff_llist().value
+        adata = xsab.abs_line_data(self.wrest, ret_flg=2)
+        self.fval = np.asarray(adata['fval'], dtype=np.float64)
+        self.gamma = np.asarray(adata['gamma'], dtype=np.float64)
+
+        # Redshift range (Lya reaches the blue end of the grid)
+        zmin = max(fN_model.zmnx[0], np.min(self.wave)/np.max(self.wrest) - 1.)
+        zmax = min(fN_model.zmnx[1], zem)
+        self.zmnx = (zmin, zmax)
+
+        # Expected number of absorbers per (log NHI, z) cell
+        self.NHI_edges = np.linspace(NHI_MIN, NHI_MAX, nNHI+1)
+        self.z_edges = np.linspace(zmin, zmax, nz+1)
+        if zmax > zmin:
+            lgN = 0.5*(self.NHI_edges[1:]+self.NHI_edges[:-1])
+            zval = 0.5*(self.z_edges[1:]+self.z_edges[:-1])
+            dlgN = self.NHI_edges[1]-self.NHI_edges[0]
+            dz = self.z_edges[1]-self.z_edges[0]
+            log_fNX = np.asarray(fN_model.eval(lgN, zval, cosmo=cosmo)).reshape(nNHI, nz)
+            dXdz = igmu.cosm_xz(zval, cosmo=cosmo, flg=1)
+            rate = 10.**(log_fNX + lgN[:,None]) * np.log(10.) * dlgN * dXdz[None,:] * dz
+        else:
+            rate = np.zeros((nNHI, nz))
+        self.nexp = np.sum(rate)
+        self._cdf = np.cumsum(rate.ravel()) / max(self.nexp, 1e-30)
+
+        # Lyman-limit cross-section vs. rest wavelength
+        if lyman_limit:
+            from xastropy.atomic import ionization as xai
+            wv_rest = np.linspace(np.min(self.wave)/(1+zmax), 912., 2000)
+            energy = (wv_rest*u.AA).to(u.eV, equivalencies=u.spectral())
+            self._ll_wave = wv_rest
+            self._ll_sigma = np.asarray(xai.photo_cross(1, 1, energy, silent=True).to(u.cm**2).value)
+            self._ll_sigmax = np.max(self._ll_sigma)
+
+    def draw_absorbers(self, rstate):
+        """ Poisson-sample the absorbers of one sightline
+
+        Parameters:
+          rstate: numpy RandomState
+
+        Returns:
+          absorbers: dict
+            NHI (log), z and b (km/s) arrays
+        """
+        nabs = rstate.poisson(self.nexp)
+        icell = np.searchsorted(self._cdf, rstate.uniform(size=nabs))
+        icell = np.minimum(icell, len(self._cdf)-1)
+        nz = len(self.z_edges)-1
+        iN, iz = icell // nz, icell % nz
+        dlgN = self.NHI_edges[1]-self.NHI_edges[0]
+        dz = self.z_edges[1]-self.z_edges[0]
+        NHI = self.NHI_edges[iN] + dlgN*rstate.uniform(size=nabs)
+        zabs = self.z_edges[iz] + dz*rstate.uniform(size=nabs)
+        bval = draw_bval(nabs, rstate, bsig=self.bsig, bmnx=self.bmnx)
+        return dict(NHI=NHI, z=zabs, b=bval)
+
+    def tau(self, absorbers):
+        """ Optical depth of a set of absorbers on the wavelength grid
+        """
+        from xastropy.spec import voigt as xsv
+
+        nabs = len(absorbers['NHI'])
+        tau = np.zeros(len(self.wave))
+        if nabs == 0:
+            return tau
+        nline = len(self.wrest)
+        # Lyman series (absorber x line)
+        tau += xsv.voigt_tau(self.wave, np.repeat(absorbers['NHI'], nline),
+                             np.repeat(absorbers['z'], nline), np.repeat(absorbers['b'], nline),
+                             np.tile(self.wrest, nabs), np.tile(self.fval, nabs),
+                             np.tile(self.gamma, nabs), method=self.method,
+                             tau_min=self.tau_min)
+        # Lyman limit (only absorbers reaching tau_min)
+        if self.lyman_limit:
+            NHI = 10.**absorbers['NHI']
+            gdll = np.where(NHI*self._ll_sigmax > self.tau_min)[0]
+            for jj in gdll:
+                sigma = np.interp(self.wave/(1+absorbers['z'][jj]), self._ll_wave,
+                                  self._ll_sigma, left=0., right=0.)
+                tau += NHI[jj] * sigma
+        return tau
+
+    def sightline(self, rstate):
+        """ Draw and render one sightline
+
+        Parameters:
+          rstate: numpy RandomState
+
+        Returns:
+          flux: float array
+          absorbers: dict (see draw_absorbers)
+        """
+        absorbers = self.draw_absorbers(rstate)
+        flux = np.exp(-1*self.tau(absorbers))
+        if self.lsf is not None:
+            from xastropy.spec import smooth as xsm
+            flux = xsm.convolve_lsf(flux, self.lsf)
+        return flux, absorbers
+
+    # Output
+    def __repr__(self):
+        return ('[{:s}: zem={:g}, z=({:g},{:g}), nexp={:g}, npix={:d}]'.format(
+                self.__class__.__name__, self.zem, self.zmnx[0], self.zmnx[1],
+                self.nexp, len(self.wave)))
+
+
+# MockForest of each worker process
+_worker_forest = None
+
+def _init_worker(forest):
+    global _worker_forest
+    _worker_forest = forest
+
+def _mock_one(seed):
+    """ One sightline for mock_sightlines
+    """
+    return _worker_forest.sightline(np.random.RandomState(seed))
+
+def mock_sightlines(forest, nsight, seed=None, nproc=1, chunksize=16):
+    """ Many Monte Carlo sightlines
+
+    Each sightline has its own RandomState, seeded from one master
+    seed, so the output does not depend on nproc.
+
+    Parameters:
+      forest: MockForest
+      nsight: int
+      seed: int (None)
+        Master seed
+      nproc: int (1)
+        Number of worker processes; 1 runs serially
+      chunksize: int (16)
+        Sightlines per task sent to a worker
+
+    Returns:
+      flux: 2D float array [nsight, npix]
+      absorbers: list of dict
+    """
+    seeds = np.random.RandomState(seed).randint(0, 2**31-1, size=nsight)
+    if nproc == 1:
+        _init_worker(forest)
+        results = [_mock_one(iseed) for iseed in seeds]
+    else:
+        from multiprocessing import Pool
+        pool = Pool(nproc, initializer=_init_worker, initargs=(forest,))
+        try:
+            results = pool.map(_mock_one, seeds, chunksize=chunksize)
+        finally:
+            pool.close()
+            pool.join()
+    flux = np.array([item[0] for item in results])
+    return flux, [item[1] for item in results]
+
+
+## #################################
+## #################################
+## TESTING
+## #################################
+if __name__ == '__main__':
+
+    from xastropy.igm.fN import model as xifm
+
+    flg_test = 0
+    flg_test += 2**0  # Mock sightlines
+
+    if (flg_test % 2**1) >= 2**0:
+        import time
+        fN_model = xifm.default_model()
+        wave = np.arange(3500., 4300., 0.05)
+        forest = MockForest(fN_model, wave, 2.5, lsf=('gauss', 3.))
+        print(forest)
+        tstart = time.time()
+        flux, absorbers = mock_sightlines(forest, 100, seed=1234, nproc=4)
+        print('100 sightlines in {:g}s; <F>={:g}'.format(time.time()-tstart, np.mean(flux)))
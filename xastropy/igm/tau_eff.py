@@ -13,6 +13,7 @@
 from __future__ import print_function
 
 import os, imp, pickle
+from collections import OrderedDict
 
 import numpy as np
 from scipy import interpolate
@@ -23,15 +24,95 @@ from astropy.cosmology import FlatLambdaCDM
 from astropy import units as u
 
 from xastropy.xutils import xdebug as xdb
+from xastropy.xutils import files as xxf
 
 # Path for xastropy
 xa_path = imp.find_module('xastropy')[1]
 
 
 # def ew_teff_lyman -- Calcualte tau_effective for the HI Lyman series
+# def ew_teff_lyman_grid -- tau_effective on a grid of wavelengths and zem
+# def load_ew_spline -- Cached EW spline (pickle)
+# def ew_table -- EW of the Lyman lines on an NHI grid
+# def cog_ew -- Curve of growth of the Lyman lines for one b-value
+# def ew_cog_table -- Cached (disk + memory) curve-of-growth table
+# class EWGrid -- EW interpolated over (log NHI, b)
 # def mk_ew_lyman_spline -- Generates a Pickle file for EW splines
 # def teff_obs(z)
 
+# EW splines and tables (loaded once)
+_ew_spline_cache = {}
+_ew_table_cache = {}
+
+def load_ew_spline(bval=24.):
+    """ EW spline of the Lyman series, read once
+
+    Parameters:
+      bval: float (24.)
+        Doppler parameter (km/s).  Only 24 km/s has a spline file;
+        other values return the default EWGrid
+
+    Returns:
+      EW_spline: dict or EWGrid
+        dict of wrest and splrep tck of each line
+    """
+    key = int(bval)
+    if key not in _ew_spline_cache:
+        if key == 24: EW_FIL = xa_path+'/igm/EW_SPLINE_b24.p'
+        else: 
+            # Curve-of-growth tables for any other b
+            return default_ew_grid()
+        _ew_spline_cache[key] = pickle.load(open(EW_FIL,"rb"))
+    return _ew_spline_cache[key]
+
+def ew_table(EW_spline, lgNval, wrest=None, bval=24.):
+    """ Rest EW of the Lyman lines on an NHI grid
+
+    Parameters:
+      EW_spline: dict
+        From load_ew_spline (or an EWGrid)
+      lgNval: float array
+        log NHI grid
+      wrest: Quantity array (None)
+        Lines; default is tau_eff_llist()
+      bval: float (24.)
+        Doppler parameter (km/s); only used with an EWGrid
+
+    Returns:
+      restEW: 2D float array [nline, nNHI]
+        Rest EW (Ang)
+
+    Only tables of the splines and grids held by load_ew_spline and
+    default_ew_grid are cached (they live as long as the module)
+    """
+    import hashlib
+    if wrest is None:
+        wrest = tau_eff_llist()
+    wrest = u.Quantity(wrest, u.AA).value
+    lgNval = np.asarray(lgNval, dtype=np.float64)
+    owned = any([EW_spline is item for item in
+                 list(_ew_spline_cache.values()) + [_ew_grid]])
+    key = None
+    if owned:
+        key = (id(EW_spline), hashlib.md5(np.ascontiguousarray(lgNval)).hexdigest(),
+               tuple(wrest), float(bval))
+        if key in _ew_table_cache:
+            return _ew_table_cache[key]
+    if isinstance(EW_spline, EWGrid):
+        restEW = EW_spline(lgNval, bval, wrest=wrest)
+    else:
+        spl_wrest = u.Quantity(EW_spline['wrest'], u.AA).value
+        restEW = np.zeros((len(wrest), len(lgNval)))
+        for qq,line in enumerate(wrest):
+            idx = np.where(spl_wrest == line)[0]
+            if len(idx) != 1:
+                raise ValueError('tau_eff: Line %g not included or over included?!' % line)
+            restEW[qq,:] = interpolate.splev(lgNval, EW_spline['tck'][idx[0]], der=0)
+    if key is not None:
+        _ew_table_cache.clear()  # Keep only the latest table
+        _ew_table_cache[key] = restEW
+    return restEW
+
 #    Calculate tau_effective for the Lyman series using the EW
 #    approximation (e.g. Zuo 93)
 def ew_teff_lyman(ilambda, zem, fN_model, NHI_MIN=11.5, NHI_MAX=22.0, N_eval=5000,
@@ -47,7 +128,8 @@ def ew_teff_lyman(ilambda, zem, fN_model, NHI_MIN=11.5, NHI_MAX=22.0, N_eval=500
         Emission redshift of the source [sets which Lyman lines are included]
       bva: float
          -- Characteristics Doppler parameter for the Lya forest
-         -- [Options: 24, 35 km/s]
+         -- 24 km/s uses the EW_SPLINE_b24.p spline; other values
+            the curve-of-growth tables (see EWGrid)
       NHI_MIN: float
          -- Minimum log HI column for integration [default = 11.5]
       NHI_MAX: float
@@ -77,11 +159,7 @@ def ew_teff_lyman(ilambda, zem, fN_model, NHI_MIN=11.5, NHI_MAX=22.0, N_eval=500
 
     # Read in EW spline (if needed)
     if EW_spline == None:
-        if int(bval) == 24: EW_FIL = xa_path+'/igm/EW_SPLINE_b24.p'
-        elif int(bval) == 35: EW_FIL = os.environ.get('XIDL_DIR')+'/IGM/EW_SPLINE_b35.fits'
-        else: 
-            raise ValueError('igm.tau_eff: Not ready for this bvalue %g' % bval)
-        EW_spline = pickle.load(open(EW_FIL,"rb"))
+        EW_spline = load_ew_spline(bval)
 
     # Lines
     wrest = tau_eff_llist()
@@ -99,6 +177,9 @@ def ew_teff_lyman(ilambda, zem, fN_model, NHI_MIN=11.5, NHI_MAX=22.0, N_eval=500
     Nval = 10.**lgNval
     teff_lyman = np.zeros(nlyman)
 
+    # EW of the lines [nlyman, nNHI]
+    restEW_all = ew_table(EW_spline, lgNval, gd_Lyman, bval=bval)
+
     # For cumulative
     if not cumul is None:
         cumul.append(lgNval)
@@ -109,8 +190,8 @@ def ew_teff_lyman(ilambda, zem, fN_model, NHI_MIN=11.5, NHI_MAX=22.0, N_eval=500
         # Redshift
         zeval = ((Lambda / line) - 1).value
         if fNz is False:
-            if cosmo not in locals():
-                cosmo = FlatLambdaCDM(H0=70, Om0=0.3) # Vanilla
+            if cosmo is None:
+                cosmo = xigmu.default_cosmo() # Vanilla
             #dxdz = (np.fabs(xigmu.cosm_xz(zeval-0.1, cosmo=cosmo)- 
             #            xigmu.cosm_xz(zeval+0.1,cosmo=cosmo)) / 0.2 )
             #xdb.set_trace()
@@ -118,11 +199,8 @@ def ew_teff_lyman(ilambda, zem, fN_model, NHI_MIN=11.5, NHI_MAX=22.0, N_eval=500
         else: dxdz = 1. # Code is using f(N,z)
         #print('dxdz = %g' % dxdz)
 
-        # Get EW values (could pack these all together)
-        idx = np.where(EW_spline['wrest'] == line)[0]
-        if len(idx) != 1:
-            raise ValueError('tau_eff: Line %g not included or over included?!' % line)
-        restEW = interpolate.splev(lgNval, EW_spline['tck'][idx], der=0)
+        # EW values
+        restEW = restEW_all[qq]
 
         # dz
         dz = ((restEW*u.AA) * (1+zeval) / line).value
@@ -148,13 +226,295 @@ def ew_teff_lyman(ilambda, zem, fN_model, NHI_MIN=11.5, NHI_MAX=22.0, N_eval=500
 
     #xdb.set_trace()
     return np.sum(teff_lyman)
-     
-    
+
+
+def ew_teff_lyman_grid(lambda_obs, zem, fN_model, NHI_MIN=11.5, NHI_MAX=22.0, N_eval=5000,
+                       EW_spline=None, bval=24., fNz=False, cosmo=None, nchunk=256,
+                       zmnx=None):
+    """ tau effective of the Lyman series on a grid of observed
+    wavelengths and emission redshifts (vectorized ew_teff_lyman)
+
+    The contribution of each (wavelength, line) pair does not depend
+    on zem; zem only sets which lines contribute (lambda < wrest*(1+zem)).
+    f(N,X) is evaluated once per unique absorber redshift, in chunks of
+    nchunk redshifts, and summed against the EW table of the lines.
+
+    Parameters:
+      lambda_obs: float or array (Ang or Quantity)
+        Observed wavelengths
+      zem: float or array
+        Emission redshifts
+      fN_model: fN_Model
+      NHI_MIN, NHI_MAX, N_eval, EW_spline, bval, fNz:
+        See ew_teff_lyman
+      cosmo: astropy.cosmology (None)
+        Default is igm_utils.default_cosmo()
+      nchunk: int (256)
+        Redshifts per f(N,X) evaluation (sets the memory)
+      zmnx: tuple (None)
+        Ignore absorbers outside this redshift range,
+        e.g. fN_model.zmnx
+
+    Returns:
+      teff: 2D float array [nlambda, nzem]
+        Zero where no Lyman line is covered
+    """
+    # Inputs
+    Lambda = u.Quantity(lambda_obs, u.AA).to(u.AA).value
+    Lambda = np.atleast_1d(Lambda).astype(np.float64)
+    zem = np.atleast_1d(np.asarray(zem, dtype=np.float64))
+    if EW_spline is None:
+        EW_spline = load_ew_spline(bval)
+    if cosmo is None:
+        cosmo = xigmu.default_cosmo()
+
+    # Lines and N_HI grid
+    wrest = tau_eff_llist()
+    wrest_val = wrest.value
+    lgNval = NHI_MIN + (NHI_MAX-NHI_MIN)*np.arange(N_eval)/(N_eval-1) # Base 10 
+    dlgN = lgNval[1]-lgNval[0]
+    Nval = 10.**lgNval
+    # EW * N  [nline, nNHI]
+    wEW = ew_table(EW_spline, lgNval, wrest, bval=bval) * Nval[None,:] * dlgN * np.log(10.)
+
+    # Absorber redshift of each (wavelength, line) pair [nlambda, nline]
+    zline = Lambda[:,None] / wrest_val[None,:] - 1.
+    # Only pairs covered by some zem
+    needed = zline < np.max(zem)
+    if zmnx is not None:
+        needed &= (zline >= zmnx[0]) & (zline <= zmnx[1])
+    tpair = np.zeros(zline.shape)
+    if np.any(needed):
+        uz, inv = np.unique(zline[needed], return_inverse=True)
+        iline = np.where(needed)[1]
+        # dX/dz and dz/dEW at the unique redshifts
+        if fNz is False:
+            dxdz = xigmu.cosm_xz(uz, cosmo=cosmo, flg=1)
+        else:
+            dxdz = np.ones(len(uz)) # Code is using f(N,z)
+        ucontrib = np.zeros(len(inv))
+        # Evaluate f(N,X) in chunks of unique redshifts
+        for i0 in range(0, len(uz), nchunk):
+            i1 = min(i0+nchunk, len(uz))
+            log_fnX = np.asarray(fN_model.eval(lgNval, uz[i0:i1])).reshape(N_eval, i1-i0)
+            fnX = 10.**log_fnX
+            pairs = np.where((inv >= i0) & (inv < i1))[0]
+            jz = inv[pairs] - i0
+            ucontrib[pairs] = np.einsum('ij,ji->i', wEW[iline[pairs]], fnX[:,jz])
+        ucontrib *= dxdz[inv] * (1+uz[inv]) / wrest_val[iline]
+        tpair[needed] = ucontrib
+
+    # Sum over the lines covered for each zem
+    teff = np.zeros((len(Lambda), len(zem)))
+    for jj, z in enumerate(zem):
+        teff[:,jj] = np.sum(np.where(zline < z, tpair, 0.), axis=1)
+    return teff
+
+
+# ###
+# Curve-of-growth tables of the Lyman series for any b-value
+_ew_lru = OrderedDict()  # In-memory LRU of ew_cog_table
+nmax_lru = 64
+_ew_grid = None
+
+def cog_ew(bval, log_NHI, wrest=None, nvel=4001, vmax=2e5):
+    """ Rest EW of the Lyman lines (curve of growth) for one b-value
+    The profile is integrated on a velocity grid uniform in
+    asinh(v/b), i.e. ~b/1000 steps in the core and logarithmic in the
+    damping wings out to vmax, plus the analytic optically-thin wing
+    beyond.  The relative error is < 1e-5 for log NHI <= 22
+
+    Parameters:
+      bval: float
+        Doppler parameter (km/s)
+      log_NHI: float array
+        log NHI values
+      wrest: Quantity array (None)
+        Lines; default is tau_eff_llist()
+      nvel: int (4001)
+        Number of velocity points (one side of the profile)
+      vmax: float (2e5)
+        Maximum velocity (km/s)
+
+    Returns:
+      EW: 2D float array [nline, nNHI]
+        Rest EW (Ang)
+    """
+    from astropy import constants as const
+    from xastropy.spec import abs_line as xsab
+    from xastropy.spec import voigt as xsv
+
+    if wrest is None:
+        wrest = tau_eff_llist()
+    wrest = u.Quantity(wrest, u.AA).value
+    bval = float(u.Quantity(bval, u.km/u.s).value)
+    log_NHI = np.atleast_1d(log_NHI)
+    clight = const.c.to(u.km/u.s).value
+
+    # Atomic data
+    adata = xsab.abs_line_data(wrest, ret_flg=2)
+
+    # Velocity grid and trapezoidal weights (dv = b cosh(x) dx)
+    xval = np.linspace(0., np.arcsinh(vmax/bval), nvel)
+    uval = np.sinh(xval)
+    wgt = bval * np.cosh(xval) * (xval[1]-xval[0])
+    wgt[[0,-1]] *= 0.5
+
+    EW = np.zeros((len(wrest), len(log_NHI)))
+    for qq, line in enumerate(wrest):
+        vd = bval*1e5 / (line*1e-8)  # Doppler frequency (Hz)
+        avoigt = adata['gamma'][qq] / (4*np.pi*vd)
+        tau = 0.014971475*adata['fval'][qq]*xsv.voigt_wofz(uval, avoigt)/vd  # N_HI = 1 cm^-2
+        # Two sides of the profile; beyond vmax the wing is optically
+        # thin with tau ~ v^-2, which integrates to tau(vmax)*vmax
+        tail = -np.expm1(-tau[-1]*10.**log_NHI) * vmax
+        EW[qq,:] = 2 * (np.dot(wgt, -np.expm1(-np.outer(tau, 10.**log_NHI))) + tail) * line / clight
+    return EW
+
+def ew_cog_table(bval, log_NHI=None, wrest=None, use_disk=True):
+    """ Curve-of-growth table for one b-value
+    Held in an in-memory LRU and cached on disk (.npz in $XASTROPY_CACHE/ew_tables)
+
+    Parameters:
+      bval: float
+        Doppler parameter (km/s)
+      log_NHI: float array (None)
+        Default is 11 to 22 in 0.05 dex steps
+      wrest: Quantity array (None)
+        Lines; default is tau_eff_llist()
+      use_disk: bool (True)
+        Read and write the disk cache
+
+    Returns:
+      ew_tab: dict
+        bval, log_NHI, wrest and EW [nline, nNHI] (Ang)
+    """
+    import hashlib
+    if log_NHI is None:
+        log_NHI = np.linspace(11., 22., 221)
+    if wrest is None:
+        wrest = tau_eff_llist()
+    log_NHI = np.ascontiguousarray(log_NHI, dtype=np.float64)
+    wrest = np.ascontiguousarray(u.Quantity(wrest, u.AA).value, dtype=np.float64)
+    bval = round(float(u.Quantity(bval, u.km/u.s).value), 4)
+
+    md5 = hashlib.md5(log_NHI)
+    md5.update(wrest)
+    key = 'ew_cog_b{:08.4f}_{:s}'.format(bval, md5.hexdigest()[0:12])
+
+    # Memory
+    if key in _ew_lru:
+        ew_tab = _ew_lru.pop(key)
+        _ew_lru[key] = ew_tab  # Most recent
+        return ew_tab
+
+    # Disk
+    cfil = os.path.join(xxf.cache_dir('ew_tables'), key+'.npz')
+    ew_tab = None
+    if use_disk and os.path.isfile(cfil):
+        try:
+            npz = np.load(cfil)
+            ew_tab = dict((item, npz[item]) for item in ['bval', 'log_NHI', 'wrest', 'EW'])
+        except (IOError, ValueError, KeyError):
+            ew_tab = None
+    if ew_tab is None:
+        ew_tab = dict(bval=np.array(bval), log_NHI=log_NHI, wrest=wrest,
+                      EW=cog_ew(bval, log_NHI, wrest=wrest))
+        if use_disk:
+            xxf.atomic_save(cfil, np.savez, **ew_tab)
+
+    if len(_ew_lru) >= nmax_lru:
+        _ew_lru.popitem(last=False)
+    _ew_lru[key] = ew_tab
+    return ew_tab
+
+class EWGrid(object):
+    """ Rest EW of the Lyman lines interpolated over (log NHI, b)
+
+    log10 EW of each line is fit with a bicubic spline in
+    (log b, log NHI) over a grid of curve-of-growth tables, so the
+    EW (and its derivative) vary smoothly with b, e.g. in a fit.
+
+    Parameters:
+      bgrid: float array (None)
+        b-values of the tables (km/s); default is 25 values
+        uniform in log b from 5 to 100 km/s
+      log_NHI: float array (None)
+        See ew_cog_table
+      wrest: Quantity array (None)
+        Lines; default is tau_eff_llist()
+    """
+    def __init__(self, bgrid=None, log_NHI=None, wrest=None):
+        from scipy.interpolate import RectBivariateSpline
+        if bgrid is None:
+            bgrid = 10.**np.linspace(np.log10(5.), np.log10(100.), 25)
+        self.bgrid = np.sort(np.asarray(bgrid, dtype=np.float64))
+        tabs = [ew_cog_table(bval, log_NHI=log_NHI, wrest=wrest) for bval in self.bgrid]
+        self.log_NHI = tabs[0]['log_NHI']
+        self.wrest = tabs[0]['wrest']
+        # log10 EW [nline, nb, nNHI]
+        log_EW = np.log10(np.array([tab['EW'] for tab in tabs])).transpose(1,0,2)
+        self._splines = [RectBivariateSpline(np.log10(self.bgrid), self.log_NHI, log_EW[qq])
+                         for qq in range(len(self.wrest))]
+
+    def __call__(self, lgNval, bval, wrest=None, der_b=False):
+        """ Rest EW (Ang) [nline, nNHI]
+
+        Parameters:
+          lgNval: float array
+            log NHI values (within the grid)
+          bval: float
+            Doppler parameter (km/s; within the grid)
+          wrest: Quantity array (None)
+            Subset of the lines
+          der_b: bool (False)
+            Also return dEW/db [nline, nNHI]
+        """
+        bval = float(u.Quantity(bval, u.km/u.s).value)
+        lgNval = np.atleast_1d(lgNval)
+        if (bval < self.bgrid[0]) or (bval > self.bgrid[-1]):
+            raise ValueError('EWGrid: b={:g} outside the grid {:g}-{:g} km/s'.format(
+                bval, self.bgrid[0], self.bgrid[-1]))
+        if (np.min(lgNval) < self.log_NHI[0]) or (np.max(lgNval) > self.log_NHI[-1]):
+            raise ValueError('EWGrid: log NHI outside the grid {:g}-{:g}'.format(
+                self.log_NHI[0], self.log_NHI[-1]))
+        if wrest is None:
+            ilines = range(len(self.wrest))
+        else:
+            ilines = [self._iline(line) for line in u.Quantity(wrest, u.AA).value]
+        logb = np.log10(bval) * np.ones(len(lgNval))
+        EW = np.array([10.**self._splines[qq].ev(logb, lgNval) for qq in ilines])
+        if der_b:
+            dlog = np.array([self._splines[qq].ev(logb, lgNval, dx=1) for qq in ilines])
+            return EW, EW * dlog / bval
+        return EW
+
+    def _iline(self, line):
+        idx = np.where(np.abs(self.wrest - line) < 1e-3)[0]
+        if len(idx) != 1:
+            raise ValueError('tau_eff: Line %g not included or over included?!' % line)
+        return idx[0]
+
+    # Output
+    def __repr__(self):
+        return ('[{:s}: nline={:d}, b={:g}-{:g} km/s, log NHI={:g}-{:g}]'.format(
+                self.__class__.__name__, len(self.wrest), self.bgrid[0], self.bgrid[-1],
+                self.log_NHI[0], self.log_NHI[-1]))
+
+def default_ew_grid():
+    """ EWGrid with the default grids, built once
+    """
+    global _ew_grid
+    if _ew_grid is None:
+        _ew_grid = EWGrid()
+    return _ew_grid
+
 
 # ###
 # Generate a pickle file of a Spline of EW vs NHI for the Lyman series
 def mk_ew_lyman_spline(bval,ew_fil=None):
     """ Generate a pickle file of a Spline of EW vs NHI for the Lyman series
+    See ew_cog_table and EWGrid for tables at any b-value
 
     Parameters:
       bval: float
@@ -306,5 +666,13 @@ if __name__ == '__main__':
     lamb = 1215.6701*(1+2.4)
     teff = ew_teff_lyman(lamb, 2.5, fN_model, NHI_MIN=12., NHI_MAX=17.)
     print('teff at z=2.4 :: %g' % teff)
+
+    # tau_eff grid
+    import time
+    tstart = time.time()
+    lamb = np.linspace(3300., 4400., 1000)
+    zem = np.linspace(2.6, 2.9, 10)
+    teff = ew_teff_lyman_grid(lamb, zem, fN_model, NHI_MIN=12., NHI_MAX=17.)
+    print('teff grid {} in {:g}s'.format(teff.shape, time.time()-tstart))
     #teff = ew_teff_lyman(3400., 2.4, fN_model)
     #print('teff at 3400A = %g' % teff)
@@ -0,0 +1,77 @@
+# Module to run tests on the f(N) model
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import os, pdb
+import pytest
+
+from xastropy.igm.fN import model as xifm
+
+
+def test_eval_gamma():
+    fN_model = xifm.fN_Model('Gamma')
+    NHI = np.linspace(12., 22., 11)
+    zval = np.array([0.5, 1.2, 2., 3.5, 4.7, 5.])
+    log_fNX = fN_model.eval(NHI, zval)
+    assert log_fNX.shape == (11, 6)
+    assert np.all(np.isfinite(log_fNX))  # Including z on the cuts
+    # 1D evaluation
+    lgN, zz = np.meshgrid(NHI, zval, indexing='ij')
+    log_1D = fN_model.eval((lgN.flatten(), zz.flatten()), None)
+    np.testing.assert_allclose(log_1D, log_fNX.flatten(), rtol=1e-12)
+    # Scalar
+    assert np.isclose(fN_model.eval(15., 2.), log_fNX[3,2], rtol=1e-12)
+
+def test_eval_upd_param():
+    fN_model = xifm.fN_Model('Gamma')
+    NHI = np.linspace(12., 22., 11)
+    zval = np.array([2., 3.])
+    log_fNX = fN_model.eval(NHI, zval)
+    # Same parameters, cached factors
+    np.testing.assert_allclose(fN_model.eval(NHI, zval), log_fNX)
+    # New parameters clear the cache
+    parm = [fN_model.param[2][0], fN_model.param[2][1],
+            fN_model.param[3][0]*10., fN_model.param[3][1]]
+    fN_model.upd_param(parm)
+    log_new = fN_model.eval(NHI, zval)
+    assert np.all(log_new > log_fNX)
+
+def test_calc_lox_quad():
+    fN_model = xifm.fN_Model('Gamma')
+    zval = np.linspace(1., 3., 5)
+    lX = fN_model.calc_lox(zval, 17.19, 22., method='quad')
+    assert lX.shape == (5,)
+    lX_sum = fN_model.calc_lox(zval, 17.19, 22., neval=100000)
+    np.testing.assert_allclose(lX, lX_sum, rtol=1e-4)
+    # To infinity (analytic tail)
+    lX_inf = fN_model.calc_lox(2., 17.19, method='quad')
+    assert lX_inf > lX[2]
+    np.testing.assert_allclose(lX_inf, fN_model.calc_lox(2., 17.19, 30., method='quad'), rtol=1e-6)
+
+def test_teff_ll_mfp():
+    fN_model = xifm.fN_Model('Gamma')
+    # Blocks in z do not change teff_LL
+    zval, teff_LL = fN_model.teff_ll(2., 3., N_eval=300)
+    zval2, teff_LL2 = fN_model.teff_ll(2., 3., N_eval=300, nchunk=7)
+    np.testing.assert_allclose(teff_LL, teff_LL2, rtol=1e-12)
+    assert np.all(np.diff(teff_LL) <= 0.)
+    # MFP for several sources
+    mfp = fN_model.mfp(np.array([2.5, 3.5]), neval=500, zmin=1.)
+    assert mfp.shape == (2,)
+    assert mfp[1] < mfp[0]
+    # Same as the tau=1 crossing of teff_ll
+    from astropy.cosmology import FlatLambdaCDM
+    cosmo = FlatLambdaCDM(70., 0.3)
+    zval, teff_LL = fN_model.teff_ll(1., 3.5, N_eval=20000, cosmo=cosmo)
+    z1 = np.interp(1., teff_LL[::-1], zval[::-1])
+    mfp_ll = cosmo.lookback_distance(3.5) - cosmo.lookback_distance(z1)
+    np.testing.assert_allclose(fN_model.mfp(3.5, neval=2000, zmin=1.).value, mfp_ll.value, rtol=3e-3)
+    assert np.isclose(fN_model.mfp(3.5, neval=500, zmin=1.).value, mfp[1].value)
+    # Sources that never reach unity (or start below zmin) are masked
+    with pytest.warns(UserWarning):
+        mfp = fN_model.mfp(np.array([3., 3.5, 1.5, 2.8]), neval=500, zmin=2.99)
+    assert np.all(np.isnan(mfp[[0,2,3]].value))
+    assert np.isfinite(mfp[1].value)
+    with pytest.warns(UserWarning):
+        assert np.isnan(fN_model.mfp(3., neval=500, zmin=2.99).value)
@@ -0,0 +1,40 @@
+# Module to run tests on the IGM utilities
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import os, pdb
+import pytest
+
+from astropy.cosmology import FlatLambdaCDM
+
+from xastropy.igm import igm_utils as igmu
+
+
+def test_xz_table():
+    cosmo = FlatLambdaCDM(H0=67.8, Om0=0.31)
+    zval = np.array([[0.01, 0.5], [2.5, 6.]])
+    Xz = igmu.cosm_xz(zval, cosmo=cosmo)
+    assert Xz.shape == zval.shape
+    Xexact = np.array([cosmo.absorption_distance(zz) for zz in zval.flat]).reshape(zval.shape)
+    np.testing.assert_allclose(Xz, Xexact, rtol=1e-9)
+    dXdz = igmu.cosm_xz(zval, cosmo=cosmo, flg=1)
+    np.testing.assert_allclose(dXdz, (1+zval)**2 * cosmo.inv_efunc(zval), rtol=1e-9)
+    # Scalar, cached table
+    assert isinstance(igmu.cosm_xz(3., flg=1), float)
+    assert igmu.xz_table(cosmo) is igmu.xz_table(FlatLambdaCDM(H0=67.8, Om0=0.31))
+
+def test_xz_beyond_table():
+    xztab = igmu.XzTable(igmu.default_cosmo(), zmax=3.)
+    Xz = xztab.X(8.)
+    assert xztab.zmax >= 8.
+    np.testing.assert_allclose(Xz, igmu.default_cosmo().absorption_distance(8.), rtol=1e-9)
+
+def test_physical_distance():
+    cosmo = igmu.X_Cosmo(H0=75.)
+    zval = np.array([0.1, 2., 3., 5.5])
+    dist = cosmo.physical_distance(zval)
+    exact = cosmo.physical_distance(zval, precision=None)
+    np.testing.assert_allclose(dist.value, exact.value, rtol=1e-8)
+    assert dist.unit == exact.unit
+    assert cosmo.physical_distance(np.ones((3,2))).shape == (3,2)
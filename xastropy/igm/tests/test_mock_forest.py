@@ -0,0 +1,30 @@
+# Module to run tests on the mock Lya forest
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import os, pdb
+import pytest
+
+from xastropy.igm import mock_forest as ximf
+from xastropy.igm.fN import model as xifm
+
+
+def test_draw_bval():
+    bval = ximf.draw_bval(100000, np.random.RandomState(1), bsig=24., bmnx=(1e-3, 1e6))
+    # Median of the Hui & Rutledge distribution
+    np.testing.assert_allclose(np.median(bval), 24.*np.log(2.)**(-0.25), rtol=0.01)
+
+def test_mock_sightlines():
+    fN_model = xifm.default_model()
+    wave = np.arange(3700., 4000., 0.1)
+    forest = ximf.MockForest(fN_model, wave, 2.5)
+    flux, absorbers = ximf.mock_sightlines(forest, 5, seed=1234)
+    assert flux.shape == (5, len(wave))
+    assert np.all((flux >= 0.) & (flux <= 1.))
+    # Reproducible
+    flux2, _ = ximf.mock_sightlines(forest, 5, seed=1234)
+    np.testing.assert_array_equal(flux, flux2)
+    # Poisson
+    nabs = np.mean([len(item['NHI']) for item in absorbers])
+    assert np.abs(nabs - forest.nexp) < 5*np.sqrt(forest.nexp/5.)
@@ -0,0 +1,43 @@
+# Module to run tests on tau_eff
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import os, pdb
+import pytest
+
+from xastropy.igm import tau_eff as xit
+from xastropy.igm.fN import model as xifm
+
+
+def test_teff_grid():
+    fN_model = xifm.default_model()
+    lamb = np.array([3400., 4133.])
+    zem = np.array([2.5, 2.8])
+    teff = xit.ew_teff_lyman_grid(lamb, zem, fN_model, NHI_MIN=12., NHI_MAX=17.)
+    assert teff.shape == (2,2)
+    for ii, ilambda in enumerate(lamb):
+        for jj, z in enumerate(zem):
+            teff1 = xit.ew_teff_lyman(ilambda, z, fN_model, NHI_MIN=12., NHI_MAX=17.)
+            np.testing.assert_allclose(teff[ii,jj], teff1, rtol=1e-10)
+
+def test_ew_grid(tmpdir, monkeypatch):
+    monkeypatch.setenv(str('XASTROPY_CACHE'), str(tmpdir))
+    lgN = np.linspace(12., 21., 10)
+    ew_grid = xit.EWGrid(bgrid=[15., 20., 25., 30., 35.])
+    ew = ew_grid(lgN, 27.5)
+    assert ew.shape == (31, 10)
+    np.testing.assert_allclose(ew, xit.cog_ew(27.5, lgN), rtol=1e-3)
+    # Disk cache
+    assert len(os.listdir(os.path.join(str(tmpdir), 'ew_tables'))) == 5
+
+def test_ew_table_cache():
+    EW_spline = xit.load_ew_spline(24.)
+    lgNval = np.linspace(12., 20., 50)
+    restEW = xit.ew_table(EW_spline, lgNval)
+    assert xit.ew_table(EW_spline, lgNval) is restEW
+    # Caller-owned splines are not cached (no stale tables)
+    spl = dict(wrest=EW_spline['wrest'], tck=list(EW_spline['tck']))
+    np.testing.assert_allclose(xit.ew_table(spl, lgNval), restEW)
+    spl['tck'] = [(tck[0], 2*np.asarray(tck[1]), tck[2]) for tck in EW_spline['tck']]
+    np.testing.assert_allclose(xit.ew_table(spl, lgNval), 2*restEW)
@@ -0,0 +1,29 @@
+# Module to run tests on the IGM transmission table
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import os, pdb
+import pytest
+
+from xastropy.igm import transmission as xitr
+from xastropy.igm import tau_eff as xit
+from xastropy.igm.fN import model as xifm
+
+
+def test_transmission_table():
+    fN_model = xifm.default_model()
+    wave = np.arange(3000., 4600., 1.)
+    zsrc = np.linspace(2., 3., 11)
+    igm_trans = xitr.IGMTransmission(fN_model, zsrc=zsrc, wave=wave, use_cache=False)
+    assert igm_trans.trans.shape == (len(wave), len(zsrc))
+    # Grid node
+    teff = (xit.ew_teff_lyman_grid(wave[::100], [2.5], fN_model, N_eval=1000, zmnx=fN_model.zmnx) +
+            xitr.teff_ll_grid(wave[::100], [2.5], fN_model))
+    np.testing.assert_allclose(igm_trans(wave[::100], 2.5), np.exp(-teff[:,0]), rtol=1e-3)
+    # Redward of Lya
+    assert igm_trans(4500., 2.5) == 1.
+    # Filter
+    ftrans = igm_trans.filter_transmission(wave, np.ones_like(wave), [2.2, 2.8])
+    assert ftrans.shape == (2,)
+    assert ftrans[1] < ftrans[0] < 1.
@@ -0,0 +1,307 @@
+"""
+#;+
+#; NAME:
+#; igm.transmission
+#;    Version 1.0
+#;
+#; PURPOSE:
+#;    Module for the mean IGM transmission exp(-tau_eff) of a source
+#;      Tabulated vs. observed wavelength and source redshift,
+#;      with lookups and filter-integrated attenuation
+#;-
+#;------------------------------------------------------------------------------
+"""
+from __future__ import print_function, absolute_import, division, unicode_literals
+
+import numpy as np
+import os
+
+from astropy import units as u
+
+from xastropy.igm import igm_utils as igmu
+from xastropy.igm import tau_eff as xit
+from xastropy.xutils import xdebug as xdb
+from xastropy.xutils import files as xxf
+
+# def teff_ll_grid -- Lyman-limit tau_eff on a grid of wavelengths and source redshifts
+# class IGMTransmission -- Cached table of exp(-tau_eff)
+
+# Lyman limit (Ang)
+wave_LL = 911.7633
+
+def teff_ll_grid(wave, zsrc, fN_model, NHI_MIN=11.5, NHI_MAX=22., N_eval=1000,
+                 nz=1000, nsig=400, cosmo=None):
+    """ Effective Lyman-limit opacity on a grid of observed wavelengths
+    and source redshifts
+
+    The opacity at wave (z912 = wave/911.76 - 1) from absorbers at
+    z912 < z < zsrc is  int dz int dN f(N,z) [1 - exp(-N sigma(E))]
+    with the photon energy in the absorber frame E = Ryd (1+z)/(1+z912).
+    (fN_Model.teff_ll instead follows the Lyman-limit photon of the
+    source, E = Ryd (1+zem)/(1+z), as needed for the mean free path.)
+    The N integral is tabulated vs. sigma at each absorber redshift and
+    the z integral is cumulative, so all source redshifts share it.
+    Absorbers outside fN_model.zmnx are ignored.
+
+    Parameters:
+      wave: float array
+        Observed wavelengths (Ang)
+      zsrc: float array
+        Source redshifts
+      fN_model: fN_Model
+      NHI_MIN, NHI_MAX: float (11.5, 22.)
+        log NHI range of the integral
+      N_eval: int (1000)
+        Number of log NHI values
+      nz: int (1000)
+        Number of absorber redshifts
+      nsig: int (400)
+        Number of cross-sections of the N-integral table
+      cosmo: astropy.cosmology (None)
+
+    Returns:
+      teff_LL: 2D float array [nwave, nzsrc]
+    """
+    from xastropy.atomic import ionization as xai
+
+    wave = np.atleast_1d(np.asarray(wave, dtype=np.float64))
+    zsrc = np.atleast_1d(np.asarray(zsrc, dtype=np.float64))
+    teff_LL = np.zeros((len(wave), len(zsrc)))
+
+    # Absorber redshifts
+    z912 = wave/wave_LL - 1.
+    zlo = max(fN_model.zmnx[0], np.min(z912))
+    zhi = min(fN_model.zmnx[1], np.max(zsrc))
+    if zhi <= zlo:
+        return teff_LL
+    zval = np.linspace(zlo, zhi, nz)
+    dz = zval[1]-zval[0]
+
+    # f(N,z) N dlogN [N_eval, nz]
+    lgNval = np.linspace(NHI_MIN, NHI_MAX, N_eval)
+    dlgN = lgNval[1]-lgNval[0]
+    Nval = 10.**lgNval
+    log_fNX = np.asarray(fN_model.eval(lgNval, zval, cosmo=cosmo)).reshape(N_eval, nz)
+    fNz = 10.**log_fNX * igmu.cosm_xz(zval, cosmo=cosmo, flg=1)[None,:]
+
+    # Cross-section vs. log (E/Ryd)
+    rmax = (1+zhi) / max(np.min(wave)/wave_LL, 1e-3)
+    logr = np.linspace(0., np.log(max(rmax, 1.+1e-6)), nsig)
+    energy = (wave_LL*u.AA).to(u.eV, equivalencies=u.spectral()) * np.exp(logr)
+    sigma = np.asarray(xai.photo_cross(1, 1, energy, silent=True).to(u.cm**2).value)
+    # The fit threshold (13.6 eV) is a hair above hc/911.76A; use its value there
+    sigma = np.where(sigma > 0., sigma, sigma[np.argmax(sigma > 0.)])
+
+    # N integral vs. (sigma, z) [nsig, nz]; log-log interpolation below
+    hval = np.dot(-np.expm1(-np.outer(sigma, Nval)) * Nval[None,:] * dlgN * np.log(10.), fNz)
+    log_h = np.log(np.maximum(hval, 1e-300))
+
+    # Integrand at (wave, z); continued below z912 at the threshold value
+    # so the trapezoidal cumulative sum can be cut at z912 exactly
+    rval = np.log(np.maximum((1+zval[None,:]) / (1+z912[:,None]), 1.))
+    fidx = rval / (logr[1]-logr[0])
+    kk = np.minimum(fidx.astype(int), nsig-2)
+    frac = np.minimum(fidx - kk, 1.)
+    jz = np.arange(nz)[None,:]
+    gval = np.exp(log_h[kk, jz]*(1-frac) + log_h[kk+1, jz]*frac)
+    cum = np.zeros(gval.shape)
+    cum[:,1:] = np.cumsum(0.5*(gval[:,1:]+gval[:,:-1]), axis=1) * dz
+
+    def cum_at(zq):
+        # Cumulative integral at redshifts zq [nwave]
+        fz = np.clip((zq - zlo) / dz, 0., nz-1.)
+        iz = np.minimum(fz.astype(int), nz-2)
+        fr = fz - iz
+        iw = np.arange(len(wave))
+        return cum[iw, iz]*(1-fr) + cum[iw, iz+1]*fr
+
+    cum_lo = cum_at(np.maximum(z912, zlo))
+    for jj, zem in enumerate(zsrc):
+        zq = np.minimum(zem, zhi) * np.ones(len(wave))
+        teff_LL[:,jj] = np.maximum(cum_at(zq) - cum_lo, 0.)
+    return teff_LL
+
+def _model_key(fN_model):
+    # String describing an fN_Model
+    param = fN_model.param
+    if isinstance(param, np.ndarray):
+        param = param.tolist()
+    return repr((fN_model.fN_mtype, list(fN_model.zmnx), np.asarray(fN_model.pivots).tolist(),
+                 param, fN_model.zpivot, fN_model.gamma))
+
+class IGMTransmission(object):
+    """ Table of the mean IGM transmission exp(-tau_eff)
+
+    tau_eff is the Lyman series (tau_eff.ew_teff_lyman_grid) plus the
+    Lyman limit (teff_ll_grid) on a grid of observed wavelengths and
+    source redshifts.  The table is cached on disk (.npz) keyed by
+    the model, cosmology and grids, so it is only built once.
+    Absorbers outside fN_model.zmnx are ignored.
+
+    Parameters:
+      fN_model: fN_Model
+      zsrc: float array (None)
+        Source redshifts; default is 51 values spanning fN_model.zmnx
+      wave: Quantity or float array (None)
+        Sorted observed wavelengths (Ang); default is uniform in
+        log wave (dlogw) from 700(1+zmin) to 1220(1+zmax) Ang
+      dlogw: float (2e-4)
+        log10 wavelength step of the default grid
+      NHI_MIN, NHI_MAX: float (11.5, 22.)
+      N_eval: int (1000)
+        Number of log NHI values of the integrals
+      bval: float (24.)
+        Doppler parameter of the Lyman series (km/s)
+      cosmo: astropy.cosmology (None)
+      lyman_limit: bool (True)
+        Include the Lyman-limit opacity
+      use_cache: bool (True)
+        Read and write the disk cache
+    """
+    def __init__(self, fN_model, zsrc=None, wave=None, dlogw=2e-4, NHI_MIN=11.5,
+                 NHI_MAX=22., N_eval=1000, bval=24., cosmo=None, lyman_limit=True,
+                 use_cache=True):
+        import hashlib
+        if zsrc is None:
+            zsrc = np.linspace(fN_model.zmnx[0], fN_model.zmnx[1], 51)
+        self.zsrc = np.asarray(zsrc, dtype=np.float64)
+        if wave is None:
+            lgw = np.arange(np.log10(700.*(1+np.min(self.zsrc))),
+                            np.log10(1220.*(1+np.max(self.zsrc))), dlogw)
+            wave = 10.**lgw
+        self.wave = np.asarray(u.Quantity(wave, u.AA).to(u.AA).value, dtype=np.float64)
+        if cosmo is None:
+            cosmo = igmu.default_cosmo()
+
+        # Cache file
+        key = repr((_model_key(fN_model), igmu.cosmo_key(cosmo), NHI_MIN, NHI_MAX, N_eval,
+                    float(bval), lyman_limit))
+        md5 = hashlib.md5(key.encode('utf-8'))
+        md5.update(np.ascontiguousarray(self.wave))
+        md5.update(np.ascontiguousarray(self.zsrc))
+        self.cache_file = os.path.join(xxf.cache_dir('igm_transmission'),
+                                       'igm_trans_{:s}.npz'.format(md5.hexdigest()[0:16]))
+
+        self.trans = None
+        if use_cache and os.path.isfile(self.cache_file):
+            try:
+                self.trans = np.load(self.cache_file)['trans']
+            except (IOError, ValueError, KeyError):
+                self.trans = None
+        if self.trans is None:
+            # Build
+            teff = xit.ew_teff_lyman_grid(self.wave, self.zsrc, fN_model, NHI_MIN=NHI_MIN,
+                                          NHI_MAX=NHI_MAX, N_eval=N_eval, bval=bval,
+                                          cosmo=cosmo, zmnx=fN_model.zmnx)
+            if lyman_limit:
+                teff += teff_ll_grid(self.wave, self.zsrc, fN_model, NHI_MIN=NHI_MIN,
+                                     NHI_MAX=NHI_MAX, N_eval=N_eval, cosmo=cosmo)
+            self.trans = np.exp(-1*teff)
+            if use_cache:
+                xxf.atomic_save(self.cache_file, np.savez, wave=self.wave,
+                                zsrc=self.zsrc, trans=self.trans)
+
+    def _column(self, wave, icol):
+        # Linear interpolation in wavelength within columns icol
+        nwv = len(self.wave)
+        iw = np.clip(np.searchsorted(self.wave, wave) - 1, 0, nwv-2)
+        frac = np.clip((wave - self.wave[iw]) / (self.wave[iw+1] - self.wave[iw]), 0., 1.)
+        tval = self.trans[iw, icol]*(1-frac) + self.trans[iw+1, icol]*frac
+        # Redward of the table
+        return np.where(wave > self.wave[-1], 1., tval)
+
+    def __call__(self, wave, zsrc):
+        """ Transmission at observed wavelengths and source redshifts
+
+        Interpolation is bilinear in (rest wavelength, zsrc), so the
+        Lyman-series and Lyman-limit edges stay sharp between the
+        tabulated redshifts.  Wavelengths bluer than the table take its
+        bluest value; redder ones have no absorption.
+
+        Parameters:
+          wave: Quantity or float array (Ang)
+          zsrc: float or array
+            Broadcast against wave
+
+        Returns:
+          trans: float array
+        """
+        wave = np.asarray(u.Quantity(wave, u.AA).to(u.AA).value, dtype=np.float64)
+        wave, zsrc = np.broadcast_arrays(wave, np.asarray(zsrc, dtype=np.float64))
+        shape = wave.shape
+        wave, zsrc = wave.ravel(), zsrc.ravel()
+        if (np.min(zsrc) < self.zsrc[0]) or (np.max(zsrc) > self.zsrc[-1]):
+            raise ValueError('IGMTransmission: zsrc outside the table {:g}-{:g}'.format(
+                self.zsrc[0], self.zsrc[-1]))
+        jz = np.clip(np.searchsorted(self.zsrc, zsrc) - 1, 0, len(self.zsrc)-2)
+        fz = (zsrc - self.zsrc[jz]) / (self.zsrc[jz+1] - self.zsrc[jz])
+        wrest = wave / (1+zsrc)
+        trans = (self._column(wrest*(1+self.zsrc[jz]), jz)*(1-fz) +
+                 self._column(wrest*(1+self.zsrc[jz+1]), jz+1)*fz)
+        return trans.reshape(shape)
+
+    def filter_transmission(self, filt_wave, filt_trans, zsrc, sed=None, photon=True):
+        """ Transmission integrated through a filter for many sources
+
+        Parameters:
+          filt_wave: Quantity or float array
+            Observed wavelengths of the filter curve (Ang)
+          filt_trans: float array
+            Filter throughput
+          zsrc: float or array
+            Source redshifts
+          sed: float array (None)
+            Observed-frame f_lambda on filt_wave [nfilt] or [nzsrc, nfilt];
+            default is flat in f_lambda
+          photon: bool (True)
+            Photon-counting (lambda-weighted) integral
+
+        Returns:
+          trans: float or array [nzsrc]
+            <exp(-tau_eff)> in the filter
+        """
+        filt_wave = np.asarray(u.Quantity(filt_wave, u.AA).to(u.AA).value, dtype=np.float64)
+        zarr = np.atleast_1d(np.asarray(zsrc, dtype=np.float64))
+        # Trapezoidal weights
+        dwv = np.zeros(len(filt_wave))
+        dwv[1:] += 0.5*np.diff(filt_wave)
+        dwv[:-1] += 0.5*np.diff(filt_wave)
+        wgt = np.asarray(filt_trans, dtype=np.float64) * dwv
+        if photon:
+            wgt = wgt * filt_wave
+        wgt = wgt[None,:] * (1. if sed is None else np.atleast_2d(sed))
+        tgrid = self(filt_wave[None,:], zarr[:,None])
+        trans = np.sum(tgrid*wgt, axis=1) / np.sum(wgt, axis=1)
+        if np.ndim(zsrc) == 0:
+            return float(trans[0])
+        return trans
+
+    # Output
+    def __repr__(self):
+        return ('[{:s}: nwave={:d} ({:g}-{:g} Ang), nzsrc={:d} ({:g}-{:g})]'.format(
+                self.__class__.__name__, len(self.wave), self.wave[0], self.wave[-1],
+                len(self.zsrc), self.zsrc[0], self.zsrc[-1]))
+
+
+## #################################
+## #################################
+## TESTING
+## #################################
+if __name__ == '__main__':
+
+    from xastropy.igm.fN import model as xifm
+
+    flg_test = 0
+    flg_test += 2**0  # Build and use the table
+
+    if (flg_test % 2**1) >= 2**0:
+        import time
+        fN_model = xifm.default_model()
+        tstart = time.time()
+        igm_trans = IGMTransmission(fN_model)
+        print(igm_trans, 'in {:g}s'.format(time.time()-tstart))
+        print('T(4000A, z=2.5) = {:g}'.format(igm_trans(4000., 2.5)))
+        # Top-hat filter
+        fwave = np.linspace(3500., 4500., 200)
+        zsrc = np.linspace(2., 3., 5)
+        print(igm_trans.filter_transmission(fwave, np.ones_like(fwave), zsrc))
@@ -16,11 +16,11 @@ import numpy as np
 import os, imp
 from astropy.io import fits, ascii
 from astropy import units as u 
-from astropy.convolution import convolve, Box1DKernel
 #from astropy import constants as const
 
 from xastropy.xutils import xdebug as xdb
 from xastropy import spec as xspec
+from xastropy.spec import smooth as xsm
 
 
 ########################## ##########################
@@ -102,21 +102,13 @@ class Kin_Abs(object):
             xdb.set_trace() # Should add sig too
 
         # Generate the tau array
-        tau = np.zeros(npix)
-        gd = np.where((spec.flux[pix] > spec.sig[pix]/2.) &
-                    (spec.sig[pix] > 0.) )
-        if len(gd) == 0:
+        if np.sum((spec.flux[pix] > spec.sig[pix]/2.) & (spec.sig[pix] > 0.)) == 0:
             raise ValueError('orig_kin: Profile too saturated.')
-
-        tau[gd] = np.log(1./spec.flux[pix[gd]])
-        sat = (pix == pix)
-        sat[gd] = False
-        tau[sat] = np.log(2./spec.sig[pix[sat]])
+        tau = tau_from_flux(spec.flux[pix], spec.sig[pix])
 
         # Smooth
         nbin = np.round(kbin/dv)
-        kernel = Box1DKernel(nbin, mode='center')
-        stau = convolve(tau, kernel, boundary='fill', fill_value=0.)
+        stau = xsm.convolve_lsf(tau, ('box', nbin), boundary='fill')
         if debug is True:
             xdb.xplot(spec.velo[pix], tau, stau)
 
@@ -148,23 +140,10 @@ class Kin_Abs(object):
         if (self.stau is None) | (get_stau is True):
             self.mk_pix_stau(spec, kbin=kbin)
 
-        # Dv (usually dv90)
-        tottau = np.sum( self.stau )
-        cumtau = np.cumsum(self.stau) / tottau
-        lft = (np.where(cumtau > per)[0])[0]
-        rgt = (np.where(cumtau > (1.-per))[0])[0] - 1
-        self.kin_data['Dv'] = np.round(np.abs(spec.velo[self.pix[rgt]]-spec.velo[self.pix[lft]]))
-        #xdb.set_trace()
-
-        # Mean/Median
-        vcen = (spec.velo[self.pix[rgt]]+spec.velo[self.pix[lft]])/2.
-        mean = self.kin_data['Dv']/2.
-        imn = np.argmin( np.fabs(cumtau-0.5) )
-        self.kin_data['fmm'] = np.abs( (spec.velo[self.pix[imn]]-vcen)/mean )
-    
-        # fedg
-        imx = np.argmax(self.stau)
-        self.kin_data['fedg'] = np.abs( (spec.velo[self.pix[imx]]-vcen) / mean )
+        # Dv (usually dv90), fmm, fedg
+        stats = orig_kin_stats(spec.velo[self.pix], self.stau, per=per)
+        for key in stats:
+            self.kin_data[key] = stats[key][0]
     
         # Two-peak :: Not ported..  Not even to XIDL!
 
@@ -200,53 +179,64 @@ class Kin_Abs(object):
         if do_orig_kin is True:
             self.orig_kin(spec)
 
-        # voff -- Velocity centroid of profile relative to zsys
-        self.kin_data['delta_v'] = np.sum(
-            spec.velo[self.pix] * self.stau ) / np.sum( self.stau )  
-
-        # ###
-        # X "Covering" test
-        tottau = np.sum( self.stau )
-        cumtau = np.cumsum(self.stau) / tottau
-        lft = (np.where(cumtau > per)[0])[0]
-        rgt = (np.where(cumtau > (1.-per))[0])[0] - 1
-
-        inpix = range(lft,rgt+1)
-        tau_covering = np.mean( self.stau[inpix] )
-        i_cover = np.where( self.stau[inpix] > cov_thresh*tau_covering)[0]
-
-        self.kin_data['X_fcover'] = float(len(i_cover)) / float(len(inpix))
-
-
-        # ###
-        # Peak -- Peak optical depth velocity
-        imx = np.argmax(self.stau)
-        self.kin_data['v_peak'] = spec.velo[self.pix[imx]]
-
-        # ###
-        # Zero peak -- Ratio of peak optical depth to that within 15 km/s of zero
-        tau_zero = self.stau[imx] 
-        if (self.vmnx[0] > 0.) | (self.vmnx[1] < 0.):
-            #; Not covered
-            #; Assuming zero value
-            self.kin_data['zero_pk'] = 0.
-        else:
-            zpix = np.where( np.abs(spec.velo[self.pix]) < dv_zeropk)[0]
-            if len(zpix) == 0:
-                raise ValueError('cgm_kin: Problem here..')
-            mx_ztau = np.max(self.stau[zpix]) 
-            self.kin_data['zero_pk'] = np.max([0. , np.min( [mx_ztau/tau_zero,1.])])
-
-        # ###
-        # Forbes "Covering"
-        dv = np.abs(spec.velo[self.pix[1]]-spec.velo[self.pix[0]])
-        forbes_fcover = dv * np.sum( self.stau ) / tau_zero
-        self.kin_data['JF_fcover'] = forbes_fcover
+        # delta_v, X_fcover, v_peak, zero_pk, JF_fcover
+        stats = cgm_kin_stats(spec.velo[self.pix], self.stau, per=per, cov_thresh=cov_thresh,
+                              dv_zeropk=dv_zeropk, vmnx=self.vmnx)
+        for key in stats:
+            self.kin_data[key] = stats[key][0]
 
         # Set flag
         if (self.kin_data['flg'] % 4) < 2:
             self.kin_data['flg'] += 2
 
+    ########################## ##########################
+    def mc_kin(self, spec, nmc=1000, kbin=22., per=0.05, cov_thresh=0.5,
+               dv_zeropk=15., seed=None, perc=(16., 50., 84.), **kwargs):
+        """ Monte Carlo distributions of the kinematic statistics
+        Draws nmc noise realizations of the flux in the window as one
+        (nmc x npix) array and evaluates orig_kin and cgm_kin on all of
+        them at once.
+
+        Parameters
+        ----------
+        spec: Spectrum1D class
+          Input spectrum
+          velo is expected to have been filled already
+        nmc: int (1000)
+          Number of realizations
+        seed: int (None)
+          Seed for the random numbers
+        perc: tuple (16, 50, 84)
+          Percentiles to report
+
+        Returns
+        -------
+        kin_mc : dict
+          Percentiles of each statistic (also stored as self.kin_mc)
+        """
+        # Pixels (and nbin) as in mk_pix_stau
+        if getattr(self, 'pix', None) is None:
+            self.mk_pix_stau(spec, kbin=kbin)
+        pix = self.pix
+        imn = np.argmin( np.fabs(spec.velo) )
+        dv = np.abs( spec.velo[imn] - spec.velo[imn+1] )
+        nbin = np.round(kbin/dv)
+
+        # Realizations
+        rstate = np.random.RandomState(seed)
+        fx = np.asarray(spec.flux[pix])
+        sig = np.asarray(spec.sig[pix])
+        fx_mc = fx[None,:] + sig[None,:] * rstate.normal(size=(nmc, len(pix)))
+        tau = tau_from_flux(fx_mc, sig[None,:]*np.ones((nmc,1)))
+        stau = xsm.convolve_lsf(tau, ('box', nbin), boundary='fill')
+
+        # Statistics
+        velo = np.asarray(getattr(spec.velo, 'value', spec.velo))[pix]
+        stats = kin_stats(velo, stau, per=per, cov_thresh=cov_thresh,
+                          dv_zeropk=dv_zeropk, vmnx=self.vmnx)
+        self.kin_mc = dict((key, np.percentile(stats[key], perc)) for key in stats)
+        return self.kin_mc
+
     # Perform all the measurements
     def fill_kin(self, spec, **kwargs):
 
@@ -264,6 +254,123 @@ class Kin_Abs(object):
 
 
     
+#### ###############################
+def tau_from_flux(fx, sig):
+    """ Optical depth for the kinematic tests, as in mk_pix_stau
+    Pixels with fx < sig/2 (or sig <= 0) are set to log(2/sig)
+
+    Parameters
+    ----------
+    fx, sig: float arrays
+      Flux and error; any shape (e.g. nmc x npix)
+
+    Returns
+    -------
+    tau: float array
+    """
+    fx = np.asarray(fx, dtype=np.float64)
+    sig = np.asarray(sig, dtype=np.float64)
+    tau = np.zeros(fx.shape)
+    gd = (fx > sig/2.) & (sig > 0.)
+    tau[gd] = np.log(1./fx[gd])
+    with np.errstate(divide='ignore'):
+        tau[~gd] = np.log(2./sig[~gd])
+    return tau
+
+def _tau_edges(stau, per):
+    # Total and cumulative tau, and the per, 1-per pixels of each row
+    tottau = np.sum(stau, axis=1)
+    cumtau = np.cumsum(stau, axis=1) / tottau[:,None]
+    lft = np.argmax(cumtau > per, axis=1)
+    rgt = np.argmax(cumtau > (1.-per), axis=1) - 1
+    return tottau, cumtau, lft, rgt
+
+def orig_kin_stats(velo, stau, per=0.05):
+    """ orig_kin statistics (Dv, fmm, fedg) for each row of stau
+
+    Parameters
+    ----------
+    velo: float array [npix]
+      Velocities (km/s)
+    stau: float array [npix] or [nmc, npix]
+      Smoothed optical depth, e.g. nmc x npix realizations
+
+    Returns
+    -------
+    stats: dict of float arrays
+    """
+    stau = np.atleast_2d(stau)
+    tottau, cumtau, lft, rgt = _tau_edges(stau, per)
+    stats = {}
+    stats['Dv'] = np.round(np.abs(velo[rgt]-velo[lft]))
+    # Mean/Median
+    vcen = (velo[rgt]+velo[lft])/2.
+    mean = stats['Dv']/2.
+    imn = np.argmin(np.fabs(cumtau-0.5), axis=1)
+    imx = np.argmax(stau, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats['fmm'] = np.abs((velo[imn]-vcen)/mean)
+        stats['fedg'] = np.abs((velo[imx]-vcen)/mean)
+    return stats
+
+def cgm_kin_stats(velo, stau, per=0.05, cov_thresh=0.5, dv_zeropk=15., vmnx=None):
+    """ cgm_kin statistics for each row of stau
+
+    Parameters
+    ----------
+    velo, stau: see orig_kin_stats
+    vmnx: tuple (None)
+      Velocity range of the analysis; zero_pk is 0 if it excludes v=0
+
+    Returns
+    -------
+    stats: dict of float arrays
+      delta_v, X_fcover, v_peak, zero_pk, JF_fcover
+    """
+    stau = np.atleast_2d(stau)
+    xpix = np.arange(stau.shape[-1])
+    tottau, cumtau, lft, rgt = _tau_edges(stau, per)
+    stats = {}
+    # voff -- Velocity centroid of profile relative to zsys
+    stats['delta_v'] = np.sum(velo*stau, axis=1) / tottau
+    # X "Covering" test
+    inpix = (xpix >= lft[:,None]) & (xpix <= rgt[:,None])
+    ninpix = np.sum(inpix, axis=1)
+    tau_covering = np.sum(stau*inpix, axis=1) / ninpix
+    i_cover = inpix & (stau > cov_thresh*tau_covering[:,None])
+    stats['X_fcover'] = np.sum(i_cover, axis=1) / ninpix
+    # Peak -- Peak optical depth velocity
+    imx = np.argmax(stau, axis=1)
+    stats['v_peak'] = velo[imx]
+    # Zero peak -- Ratio of peak optical depth to that within dv_zeropk of zero
+    tau_zero = stau[np.arange(stau.shape[0]), imx]
+    if (vmnx is not None) and ((vmnx[0] > 0.) | (vmnx[1] < 0.)):
+        stats['zero_pk'] = np.zeros(len(tau_zero))
+    else:
+        zpix = np.abs(velo) < dv_zeropk
+        if np.sum(zpix) == 0:
+            raise ValueError('cgm_kin: Problem here..')
+        mx_ztau = np.max(stau[:,zpix], axis=1)
+        stats['zero_pk'] = np.maximum(0., np.minimum(mx_ztau/tau_zero, 1.))
+    # Forbes "Covering"
+    dv = np.abs(velo[1]-velo[0])
+    stats['JF_fcover'] = dv * tottau / tau_zero
+    return stats
+
+def kin_stats(velo, stau, per=0.05, cov_thresh=0.5, dv_zeropk=15., vmnx=None):
+    """ orig_kin and cgm_kin statistics for each row of stau
+    See orig_kin_stats and cgm_kin_stats
+
+    Returns
+    -------
+    stats: dict of float arrays
+      Dv, fmm, fedg, delta_v, X_fcover, v_peak, zero_pk, JF_fcover
+    """
+    stats = orig_kin_stats(velo, stau, per=per)
+    stats.update(cgm_kin_stats(velo, stau, per=per, cov_thresh=cov_thresh,
+                               dv_zeropk=dv_zeropk, vmnx=vmnx))
+    return stats
+
 #### ###############################
 #### ###############################
 # Testing
@@ -0,0 +1,60 @@
+# Module to run tests on absorption-line kinematics
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import os, pdb
+import pytest
+
+from xastropy.kinematics import absline as xkab
+
+
+class FakeSpec(object):
+    # Velocity, flux and error arrays are all the kinematics need
+    def __init__(self, seed=3):
+        rstate = np.random.RandomState(seed)
+        self.velo = np.arange(-400., 400., 2.5)
+        tau = (1.5*np.exp(-0.5*((self.velo-30.)/25.)**2) +
+               0.6*np.exp(-0.5*((self.velo+80.)/15.)**2))
+        self.sig = 0.02*np.ones(len(self.velo))
+        self.flux = np.exp(-tau) + self.sig*rstate.normal(size=len(self.velo))
+
+def test_kin_stats():
+    spec = FakeSpec()
+    kin = xkab.Kin_Abs(1548.195, (-200., 200.))
+    kin.fill_kin(spec)
+    # One row of kin_stats = orig_kin + cgm_kin
+    stats = xkab.kin_stats(spec.velo[kin.pix], kin.stau, vmnx=kin.vmnx)
+    for key in stats:
+        assert np.isclose(stats[key][0], kin.kin_data[key], rtol=1e-12)
+    # Gaussian profile of sigma=20 km/s
+    velo = np.arange(-300., 300., 1.)
+    stats = xkab.kin_stats(velo, np.exp(-0.5*(velo/20.)**2))
+    assert np.abs(stats['Dv'][0] - 2*1.645*20.) <= 2.
+    assert np.abs(stats['delta_v'][0]) < 1e-10
+
+def test_tau_from_flux():
+    tau = xkab.tau_from_flux([0.5, 0.01, 0.3], [0.02, 0.04, 0.])
+    np.testing.assert_allclose(tau[:2], [np.log(2.), np.log(2./0.04)])
+    assert np.isinf(tau[2])
+    # Saturated profile
+    spec = FakeSpec()
+    spec.flux[:] = 0.
+    kin = xkab.Kin_Abs(1548.195, (-200., 200.))
+    with pytest.raises(ValueError):
+        kin.mk_pix_stau(spec)
+
+def test_mc_kin():
+    spec = FakeSpec()
+    kin = xkab.Kin_Abs(1548.195, (-200., 200.))
+    kin.fill_kin(spec)
+    kin_mc = kin.mc_kin(spec, nmc=500, seed=11)
+    # Reproducible
+    kin2 = xkab.Kin_Abs(1548.195, (-200., 200.))
+    kin2.fill_kin(spec)
+    kin_mc2 = kin2.mc_kin(spec, nmc=500, seed=11)
+    for key in kin_mc:
+        np.testing.assert_allclose(kin_mc[key], kin_mc2[key])
+    # Median near the single measurement
+    assert np.abs(kin_mc['Dv'][1] - kin.kin_data['Dv']) <= 0.05*kin.kin_data['Dv']
+    assert np.abs(kin_mc['delta_v'][1] - kin.kin_data['delta_v']) < 2.
@@ -1,6 +1,10 @@
 import abs_line
 import analysis
+import coadd
+import collection
 import lines_utils
 import readwrite
+import smooth
 import utils
 import voigt
+import voigt_fit
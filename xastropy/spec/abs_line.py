@@ -22,6 +22,7 @@ from astropy.table import Table
 from xastropy.outils import roman
 from xastropy.atomic.elements import ELEMENTS
 from xastropy.xutils import xdebug as xdb
+from xastropy.xutils import files as xxf
 
 # Path for xastropy
 xa_path = imp.find_module('xastropy')[1]
@@ -46,7 +47,7 @@ class Abs_Line_List(object):
         self.read_llist(linelist,silent=silent)
 
     # Read standard line list
-    def read_llist(self,llist, fmt=0, set_unit='AA', silent=False):
+    def read_llist(self,llist, fmt=0, set_unit='AA', silent=False, use_cache=True):
         '''
         fmt: int (0)
            Format of line list.  Follows XIDL formatting..
@@ -55,6 +56,8 @@ class Abs_Line_List(object):
            2: H2
         set_unit: string ('AA')
            Set units of wavelength. Use None to avoid 
+        use_cache: bool (True)
+           Load from the binary cache (see cached_llist)
         '''
 
         # Path + Format
@@ -62,17 +65,10 @@ class Abs_Line_List(object):
         if not silent:
             print('gdfil = {:s}, fmt={:d}'.format(gdfil,fmt))
 
-        if fmt == 0:
-            # Read Absorption Lines with Fixed Format (astropy Table)
-            self.data = ascii.read(gdfil, format='fixed_width_no_header',data_start=1,
-                            names=('wrest', 'name', 'fval'),
-                            col_starts=(0,9,22), col_ends=(8,20,32))
-        elif fmt == 1:
-            self.data = ascii.read(gdfil, format='fixed_width_no_header',data_start=1,
-                            names=('wrest', 'flg', 'name'),
-                            col_starts=(0,10,13), col_ends=(8,11,23))
-        elif fmt == 2:
-            self.data = ascii.read(gdfil, guess=False, comment=';')
+        if use_cache:
+            self.data = cached_llist(gdfil, fmt)
+        else:
+            self.data = parse_llist(gdfil, fmt)
         # Specify Units
         if not set_unit is None:
             self.data['wrest'].unit = u.Unit(set_unit)
@@ -84,9 +80,124 @@ class Abs_Line_List(object):
 
 
 
+## ##############
+# In-memory atomic database
+class AtomicDB(object):
+    """ Struct-of-arrays atomic line database sorted by rest wavelength
+
+    Parameters:
+      datfil: str (None)
+        FITS table; default is data/atomic/spec_atomic_lines.fits
+
+    Attributes:
+      data: dict of arrays (one per column, sorted by wrest)
+      table: Table (sorted by wrest)
+    """
+    def __init__(self, datfil=None):
+        if datfil is None:
+            datfil = xa_path+'/data/atomic/spec_atomic_lines.fits'
+        self.datfil = datfil
+        tab = Table.read(datfil)
+        srt = np.argsort(np.asarray(tab['wrest']), kind='mergesort')
+        self.table = tab[srt]
+        self.names = tab.colnames
+        self.data = {}
+        for key in self.names:
+            arr = np.asarray(self.table[key])
+            if arr.dtype.kind == 'S':  # Bytes from FITS
+                arr = np.char.decode(arr, 'ascii')
+            self.data[key] = arr
+        self.wrest = self.data['wrest'].astype(np.float64)
+        # (Z, ion) groups
+        self._zion = self.data['Z'].astype(np.int64)*1000 + self.data['ion']
+        self._zion_srt = np.argsort(self._zion, kind='mergesort')  # Stable: keeps wrest order
+
+    def __len__(self):
+        return len(self.wrest)
+
+    def index(self, wrest, tol=1e-3):
+        """ Rows matching the input wavelengths
+
+        Parameters:
+          wrest: float, array or Quantity (Ang)
+          tol: float or Quantity (1e-3 Ang)
+            Tolerance for a match
+
+        Returns:
+          idx: int array
+        """
+        wrest = np.atleast_1d(u.Quantity(wrest, u.AA).value)
+        tol = u.Quantity(tol, u.AA).value
+        ilow = np.searchsorted(self.wrest, wrest-tol, side='right')
+        ihi = np.searchsorted(self.wrest, wrest+tol, side='left')
+        nm = ihi - ilow
+        if np.any(nm == 0):
+            bad = wrest[np.where(nm == 0)[0][0]]
+            raise ValueError('abs_line_data: {:.3f} not in our table {:s}'.format(bad, self.datfil))
+        if np.any(nm > 1):
+            ibad = np.where(nm > 1)[0][0]
+            raise ValueError('abs_line_data: {:g} appears {:d} times in our table {:s}'.format(
+                wrest[ibad], nm[ibad], self.datfil))
+        return ilow
+
+    def lookup(self, wrest, tol=1e-3, columns=None):
+        """ Column arrays for the input wavelengths
+
+        Parameters:
+          wrest: float, array or Quantity (Ang)
+          tol: float or Quantity (1e-3 Ang)
+          columns: list (None)
+            Columns to return; default is all
+
+        Returns:
+          adict: dict of arrays
+        """
+        idx = self.index(wrest, tol=tol)
+        if columns is None:
+            columns = self.names
+        return dict((key, self.data[key][idx]) for key in columns)
+
+    def zion(self, Z, ion, columns=None):
+        """ Column arrays of all the transitions of an ion (sorted by wrest)
+
+        Parameters:
+          Z, ion: int
+          columns: list (None)
+
+        Returns:
+          adict: dict of arrays
+        """
+        key = Z*1000 + ion
+        skey = self._zion[self._zion_srt]
+        i0, i1 = np.searchsorted(skey, [key, key+1])
+        idx = self._zion_srt[i0:i1]
+        if columns is None:
+            columns = self.names
+        return dict((ckey, self.data[ckey][idx]) for ckey in columns)
+
+    def row_dict(self, idx):
+        """ Dictionary of one row
+        """
+        return dict((key, self.data[key][idx].item()) for key in self.names)
+
+    def __repr__(self):
+        return ('[{:s}: {:s}, nline={:d}]'.format(
+                self.__class__.__name__, self.datfil, len(self)))
+
+
 ## ##############
 # Grab atomic data
-abs_data = None
+abs_data = None  # AtomicDB (loaded on first use)
+def atomic_db(datfil=None):
+    """ Cached AtomicDB for a data file
+    """
+    global abs_data
+    if datfil is None:
+        datfil = xa_path+'/data/atomic/spec_atomic_lines.fits'
+    if (abs_data is None) or (datfil != abs_data.datfil):
+        abs_data = AtomicDB(datfil)
+    return abs_data
+
 def abs_line_data(wrest, datfil=None, ret_flg=0, tol=1e-3*u.AA):
     """
     wrest : float or array
@@ -96,52 +207,101 @@ def abs_line_data(wrest, datfil=None, ret_flg=0, tol=1e-3*u.AA):
     ret_flg : int (0)
       0: Return a dictionary
       1: Return an astropy Table
+      2: Return a dictionary of column arrays (fastest for many lines)
     """
-    # Data file
-    if datfil == None:
-        datfil = xa_path+'/data/atomic/spec_atomic_lines.fits'
-
-    # Read
-    global abs_data 
-    if abs_data is None:
-        abs_data = Table.read(datfil)
-
-    if not isiterable(wrest):
-        wrest = [wrest]
-
-    # Loop
-    all_row = []
-    for iwrest in wrest:
-        mt = np.where(np.fabs(abs_data['wrest']-iwrest) < tol)[0]
-        nm = len(mt)
-        # Found?
-        if nm == 0:
-            raise ValueError('abs_line_data: {:.3f} not in our table {:s}'.format(iwrest,datfil))
-        elif nm == 1:
-            # Grab
-            all_row.append(mt[0])
-        else:
-            raise ValueError('abs_line_data: {:g} appears {:d} times in our table {:s}'.format(
-                iwrest,nm,datfil))
-
-    tab = abs_data[all_row]
+    adb = atomic_db(datfil)
+    idx = adb.index(wrest, tol=tol)
 
     # Return
     if ret_flg == 0: # Dictionary(ies)
-        adict = []
-        for row in all_row:
-            adict.append(dict(zip(abs_data.dtype.names,abs_data[row])))
-        if len(wrest) == 1:
+        adict = [adb.row_dict(row) for row in idx]
+        if not isiterable(wrest):
+            return adict[0]
+        elif len(adict) == 1:
             return adict[0]
         else:
             return adict
     elif ret_flg == 1:
-        return tab
+        return adb.table[idx]
+    elif ret_flg == 2:
+        return dict((key, adb.data[key][idx]) for key in adb.names)
     else:
         raise Exception('abs_line_data: Not ready for this..')
     
 
 
+## ##############
+# Parse an ASCII line list
+def parse_llist(gdfil, fmt):
+    '''
+    gdfil: str
+      Line list file
+    fmt: int
+      Format (see Abs_Line_List.read_llist)
+    '''
+    if fmt == 0:
+        # Read Absorption Lines with Fixed Format (astropy Table)
+        data = ascii.read(gdfil, format='fixed_width_no_header',data_start=1,
+                        names=('wrest', 'name', 'fval'),
+                        col_starts=(0,9,22), col_ends=(8,20,32))
+    elif fmt == 1:
+        data = ascii.read(gdfil, format='fixed_width_no_header',data_start=1,
+                        names=('wrest', 'flg', 'name'),
+                        col_starts=(0,10,13), col_ends=(8,11,23))
+    elif fmt == 2:
+        data = ascii.read(gdfil, guess=False, comment=';')
+    else:
+        raise ValueError('parse_llist: Not ready for fmt={:d}'.format(fmt))
+    return data
+
+## ##############
+# Binary cache of the line lists
+def cached_llist(gdfil, fmt):
+    '''
+    Line list from a binary (.npy) cache, memory-mapped on load.
+    The cache file is keyed by the path, modification time, size and
+    format of the source, so it is rebuilt when the source changes.
+    Falls back to parse_llist if the cache cannot be written.
+
+    gdfil: str
+      Line list file
+    fmt: int
+      Format (see Abs_Line_List.read_llist)
+
+    Returns:
+      data: Table
+    '''
+    import hashlib, glob
+
+    stat = os.stat(gdfil)
+    key = '{:s}|{:.6f}|{:d}|{:d}'.format(os.path.abspath(gdfil), stat.st_mtime,
+                                         stat.st_size, fmt)
+    md5 = hashlib.md5(key.encode('utf-8')).hexdigest()[0:16]
+    cdir = xxf.cache_dir('spec_lines')
+    # Prefix unique to the source path (and format); shared by its stale versions
+    pkey = '{:s}|{:d}'.format(os.path.abspath(gdfil), fmt)
+    root = '{:s}_{:s}'.format(os.path.basename(gdfil),
+                              hashlib.md5(pkey.encode('utf-8')).hexdigest()[0:8])
+    cfil = os.path.join(cdir, '{:s}_{:s}.npy'.format(root, md5))
+
+    # Load (copy-on-write memory map)
+    if os.path.isfile(cfil):
+        try:
+            return Table(np.load(cfil, mmap_mode='c'), copy=False)
+        except (IOError, ValueError):
+            pass
+
+    # Build
+    data = parse_llist(gdfil, fmt)
+    # Remove stale versions, then write atomically
+    try:
+        for ofil in glob.glob(os.path.join(cdir, root+'_*.npy')):
+            os.remove(ofil)
+    except OSError:
+        pass
+    xxf.atomic_save(cfil, np.save, data.as_array())
+    return data
+
 ## ##############
 # Get line list path
 def llist_file(llist):
@@ -395,6 +555,9 @@ if __name__ == '__main__':
         print(lines)
         lines = abs_line_data([1215.6701,1206.500], ret_flg=1)
         print(lines)
+        lines = abs_line_data([1215.6701,1206.500], ret_flg=2)
+        print(lines['fval'])
+        print(atomic_db().zion(1, 1)['wrest'])  # Lyman series
 
     # Line list
     if (flg_test % 2**5) >= 2**4:
@@ -17,6 +17,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 import pdb
 from astropy import constants as const
+from astropy import units as u
 
 import xastropy.atomic as xatom
 from xastropy.xutils import xdebug as xdb
@@ -62,11 +63,20 @@ class Spectral_Line(object):
                 self.__class__.__name__, self.wrest))
 
 #### ###############################
-def pixminmax(*args):
+def pixminmax(spec, *args):
     ''' Soon to be deprecated..
     Use  Spectrum1D.pix_minmax()
+
+    Parameters:
+      spec: XSpectrum1D
+      args: passed to spec.pix_minmax()
+
+    Returns:
+      pix: int array
     '''
-    xdb.set_trace()
+    if len(args) == 3:  # zabs, wrest, vmnx (tuple allowed)
+        args = (args[0], args[1], u.Quantity(args[2], u.km/u.s))
+    return spec.pix_minmax(*args)[0]
 
 #### ###############################
 #  Calls plotvel (Crighton)
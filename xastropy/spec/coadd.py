@@ -0,0 +1,252 @@
+"""
+#;+
+#; NAME:
+#; coadd
+#;    Version 1.0
+#;
+#; PURPOSE:
+#;    Module for streaming coadds (stacks) of spectra
+#;-
+#;------------------------------------------------------------------------------
+"""
+from __future__ import print_function, absolute_import, division, unicode_literals
+
+import numpy as np
+
+from astropy import units as u
+
+from xastropy.xutils import xdebug as xdb
+
+# class SpecCoadd -- Streaming inverse-variance coadd on a fixed grid
+# def coadd_spectra -- Coadd an iterator of spectra
+
+class SpecCoadd(object):
+    """ Streaming inverse-variance weighted coadd on a fixed grid
+
+    Spectra are rebinned onto the grid as they arrive and only running
+    sums are kept, so the memory does not grow with the number of spectra.
+
+    Parameters:
+      new_wv: Quantity or float array
+        Wavelength grid of the coadd (Angstroms for floats)
+      clip: float (None)
+        Reject pixels deviating by more than clip sigma from the
+        running mean; sigma is the larger of the running scatter and
+        the pixel error.  Only applied once nmin_clip spectra have
+        contributed to a pixel.
+      nmin_clip: int (3)
+      median: bool (False)
+        Also accumulate per-pixel histograms for an approximate median
+      med_range: tuple (-0.5, 2.)
+        Flux range of the histograms; values outside fall in the end bins
+      nmed_bin: int (250)
+        Number of histogram bins; sets the median precision
+    """
+    def __init__(self, new_wv, clip=None, nmin_clip=3, median=False,
+                 med_range=(-0.5, 2.), nmed_bin=250):
+        self.wave = u.Quantity(new_wv, u.AA)
+        npix = len(self.wave)
+        self.clip = clip
+        self.nmin_clip = nmin_clip
+
+        # Inverse-variance sums
+        self.sum_w = np.zeros(npix)
+        self.sum_wf = np.zeros(npix)
+        # Welford statistics of the (unweighted) flux
+        self.nval = np.zeros(npix, dtype=np.int64)
+        self.mean = np.zeros(npix)
+        self.m2 = np.zeros(npix)
+        self.nclip = np.zeros(npix, dtype=np.int64)
+        self.nspec = 0
+
+        # Histograms for the median
+        self.median = median
+        if median:
+            self.med_edges = np.linspace(med_range[0], med_range[1], nmed_bin+1)
+            self.med_hist = np.zeros((nmed_bin, npix), dtype=np.int32)
+
+    def add(self, wave, flux, sig):
+        """ Add one spectrum or a stack of spectra on a common grid
+
+        Parameters:
+          wave: Quantity or float array
+            Wavelengths [npix] (Angstroms for floats)
+          flux: float array
+            [npix] or [nspec, npix]
+          sig: float array
+            Error with the shape of flux; pixels with sig <= 0 are ignored
+        """
+        from xastropy.spec.utils import rebin_arrays
+
+        wave = u.Quantity(wave, u.AA).to(self.wave.unit).value
+        flux = np.atleast_2d(np.asarray(flux, dtype=np.float64))
+        var = np.atleast_2d(np.asarray(sig, dtype=np.float64))**2
+        bad = np.atleast_2d(np.asarray(sig) <= 0.)
+        var[bad] = 0.
+
+        # Resample (skipped on the coadd grid)
+        if (len(wave) == len(self.wave)) and np.allclose(wave, self.wave.value):
+            new_fx, new_var = flux, var
+        else:
+            # Flag bad pixels with a huge variance so they carry no weight
+            var[bad] = 1e30
+            new_fx, new_var, cover = rebin_arrays(wave, flux, self.wave.value,
+                                                  var=var, coverage=True)
+            new_var[new_var > 1e20] = 0.
+            # Pixels only partly covered have diluted flux (and variance)
+            new_var[:, cover < 1.-1e-8] = 0.
+
+        for fx, vr in zip(new_fx, new_var):
+            self._accumulate(fx, vr)
+
+    def add_spectrum(self, spec):
+        """ Add an XSpectrum1D or a (wave, flux, sig) tuple
+        """
+        if isinstance(spec, tuple):
+            self.add(*spec)
+        else:
+            self.add(spec.dispersion, np.asarray(spec.flux), np.asarray(spec.sig))
+
+    def _accumulate(self, fx, vr):
+        # Good pixels (positive variance, within the coverage)
+        gdp = vr > 0.
+        if self.clip is not None:
+            # Running scatter (NaN-free for nval < 2)
+            std = np.sqrt(self.m2 / np.maximum(self.nval-1, 1))
+            dev = np.abs(fx - self.mean)
+            sclip = self.clip * np.maximum(std, np.sqrt(vr))
+            rej = gdp & (self.nval >= self.nmin_clip) & (dev > sclip)
+            self.nclip[rej] += 1
+            gdp &= ~rej
+        ivar = np.zeros_like(vr)
+        ivar[gdp] = 1. / vr[gdp]
+        self.sum_w += ivar
+        self.sum_wf += ivar * np.where(gdp, fx, 0.)
+        # Welford
+        self.nval[gdp] += 1
+        delta = fx[gdp] - self.mean[gdp]
+        self.mean[gdp] += delta / self.nval[gdp]
+        self.m2[gdp] += delta * (fx[gdp] - self.mean[gdp])
+        # Histograms
+        if self.median:
+            nbin = self.med_hist.shape[0]
+            ibin = np.searchsorted(self.med_edges, fx[gdp], side='right') - 1
+            ibin = np.minimum(np.maximum(ibin, 0), nbin-1)
+            self.med_hist[ibin, np.where(gdp)[0]] += 1
+        self.nspec += 1
+
+    def coadd(self, spectra):
+        """ Add all the spectra from an iterator
+        Each item is an XSpectrum1D or a (wave, flux, sig) tuple
+        """
+        for spec in spectra:
+            self.add_spectrum(spec)
+
+    def result(self, mode='mean'):
+        """ Coadded flux and error
+
+        Parameters:
+          mode: str ('mean')
+            'mean' -- inverse-variance weighted mean
+            'median' -- approximate median from the histograms.
+              The error is sqrt(pi/2) times the error of the mean.
+
+        Returns:
+          flux, sig: float arrays
+            Pixels without data have flux=0, sig=0
+        """
+        gdp = self.sum_w > 0.
+        sig = np.zeros(len(self.sum_w))
+        sig[gdp] = 1. / np.sqrt(self.sum_w[gdp])
+        if mode == 'mean':
+            flux = np.zeros(len(self.sum_w))
+            flux[gdp] = self.sum_wf[gdp] / self.sum_w[gdp]
+        elif mode == 'median':
+            if not self.median:
+                raise ValueError('SpecCoadd: Initialize with median=True')
+            flux = self._hist_median()
+            flux[~gdp] = 0.
+            sig = np.sqrt(np.pi/2) * sig
+        else:
+            raise ValueError('SpecCoadd: Not ready for mode={:s}'.format(mode))
+        return flux, sig
+
+    def _hist_median(self):
+        # Linear interpolation within the bin holding the half-way count
+        cum = np.cumsum(self.med_hist, axis=0)
+        half = 0.5 * cum[-1]
+        ibin = np.minimum(np.sum(cum < half[None,:], axis=0), cum.shape[0]-1)
+        ipix = np.arange(cum.shape[1])
+        nbelow = np.where(ibin > 0, cum[np.maximum(ibin-1, 0), ipix], 0)
+        nin = np.maximum(self.med_hist[ibin, ipix], 1)
+        frac = np.clip((half - nbelow) / nin, 0., 1.)
+        dbin = self.med_edges[1] - self.med_edges[0]
+        return self.med_edges[ibin] + frac * dbin
+
+    def to_xspectrum(self, mode='mean'):
+        """ XSpectrum1D of the coadd
+        """
+        from astropy.nddata import StdDevUncertainty
+        from xastropy.spec.utils import XSpectrum1D
+        flux, sig = self.result(mode=mode)
+        return XSpectrum1D.from_array(self.wave, u.Quantity(flux),
+                                      uncertainty=StdDevUncertainty(sig))
+
+    # Output
+    def __repr__(self):
+        return ('[{:s}: nspec={:d}, npix={:d}, clip={}, median={}]'.format(
+                self.__class__.__name__, self.nspec, len(self.wave),
+                self.clip, self.median))
+
+
+def coadd_spectra(spectra, new_wv, mode='mean', **kwargs):
+    """ Coadd an iterator of spectra onto a wavelength grid
+    Spectra are consumed one at a time (e.g. from a generator of files)
+
+    Parameters:
+      spectra: iterator
+        XSpectrum1D or (wave, flux, sig) tuples
+      new_wv: Quantity or float array
+        Wavelength grid
+      mode: str ('mean')
+        'mean' or 'median'
+      **kwargs: passed to SpecCoadd
+
+    Returns:
+      XSpectrum1D of the coadd
+    """
+    if mode == 'median':
+        kwargs['median'] = True
+    scoadd = SpecCoadd(new_wv, **kwargs)
+    scoadd.coadd(spectra)
+    return scoadd.to_xspectrum(mode=mode)
+
+
+## #################################
+## #################################
+## TESTING
+## #################################
+if __name__ == '__main__':
+
+    flg_test = 0
+    flg_test += 2**0  # Mean and median of fake spectra
+
+    if (flg_test % 2**1) >= 2**0:
+        rstate = np.random.RandomState(1234)
+        new_wv = np.linspace(4000., 5000., 2001)
+
+        def fake_spectra(nspec):
+            for ii in range(nspec):
+                wave = np.linspace(3990., 5010., 1800) + rstate.uniform(-0.2, 0.2)
+                sig = 0.1 * np.ones_like(wave)
+                flux = 1. + sig * rstate.normal(size=len(wave))
+                if ii % 50 == 0:  # Cosmic ray
+                    flux[900] += 30.
+                yield wave, flux, sig
+
+        scoadd = SpecCoadd(new_wv, clip=5., median=True)
+        scoadd.coadd(fake_spectra(500))
+        print(scoadd)
+        for mode in ['mean', 'median']:
+            flux, sig = scoadd.result(mode=mode)
+            print(mode, np.mean(flux[10:-10]), np.std(flux[10:-10]), np.median(sig))
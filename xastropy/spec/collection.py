@@ -0,0 +1,328 @@
+"""
+#;+
+#; NAME:
+#; collection
+#;    Version 1.0
+#;
+#; PURPOSE:
+#;    Module for collections of many spectra on disk
+#;      A directory of .npy (or compressed .npz) chunks plus a FITS index
+#;-
+#;------------------------------------------------------------------------------
+"""
+from __future__ import print_function, absolute_import, division, unicode_literals
+
+import numpy as np
+import os, glob
+from collections import OrderedDict
+
+from astropy import units as u
+from astropy.table import Table, Column
+from astropy.nddata import StdDevUncertainty
+
+from xastropy.xutils import xdebug as xdb
+
+# class SpecCollection -- Chunked collection of spectra
+# def write_collection -- Bulk write of spectra
+# def read_collection -- Bulk read to XSpectrum1D
+
+index_file = 'index.fits'
+arrays = ('wave', 'flux', 'sig')
+nmax_open = 8  # Chunks kept open (each .npy chunk holds 3 file handles)
+
+class SpecCollection(object):
+    """ Collection of spectra stored in chunks
+
+    Each chunk holds up to nchunk spectra as padded 2D arrays
+    (wave, flux, sig) with one row per spectrum.  Uncompressed chunks
+    are .npy files read with memory mapping, so one spectrum or one
+    wavelength range is read without the rest of the chunk.  Compressed
+    chunks (.npz) are read one chunk at a time.  The index (FITS table)
+    holds the chunk, row, number of pixels, wavelength range and
+    metadata of each spectrum.
+
+    Parameters:
+      path: str
+        Directory of the collection
+      mode: str ('r')
+        'r' -- read; 'w' -- new collection (removes the chunks and
+        index already in path); 'a' -- append to an existing collection
+      nchunk: int (1000)
+        Spectra per chunk (writing)
+      compress: bool (False)
+        Write compressed .npz chunks
+      dtype: str ('float32')
+        Data type of flux and sig on disk (wave is float64)
+    """
+    def __init__(self, path, mode='r', nchunk=1000, compress=False, dtype='float32'):
+        self.path = os.path.expanduser(path)
+        self.mode = mode
+        self.nchunk = nchunk
+        self.compress = compress
+        self.dtype = dtype
+        self._buffer = []
+        self._cache = OrderedDict()   # Open chunks (LRU)
+
+        if mode == 'w':
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            # Remove an old collection
+            for fil in (glob.glob(os.path.join(self.path, 'chunk_*.npy')) +
+                        glob.glob(os.path.join(self.path, 'chunk_*.npz')) +
+                        glob.glob(os.path.join(self.path, index_file))):
+                os.remove(fil)
+            self.index = None
+            self.wave_unit = u.AA
+        elif mode in ['r', 'a']:
+            self.index = Table.read(os.path.join(self.path, index_file))
+            self.wave_unit = u.Unit(self.index.meta.get('WUNIT', 'Angstrom'))
+        else:
+            raise ValueError('SpecCollection: Not ready for mode={:s}'.format(mode))
+        self._rows = []  # New index rows
+        self._meta_keys = None
+        if self.index is not None:
+            self._meta_keys = [key for key in self.index.colnames
+                               if key not in ['ID', 'CHUNK', 'ROW', 'NPIX', 'WVMIN', 'WVMAX']]
+            self._id_lookup = dict(zip(self.index['ID'], range(len(self.index))))
+            self._next_chunk = (np.max(self.index['CHUNK'])+1) if len(self.index) > 0 else 0
+        else:
+            self._id_lookup = {}
+            self._next_chunk = 0
+
+    def __len__(self):
+        nidx = 0 if self.index is None else len(self.index)
+        return nidx + len(self._rows) + len(self._buffer)
+
+    # Writing
+    def append(self, spec, ID=None, meta=None):
+        """ Add one spectrum
+
+        Parameters:
+          spec: XSpectrum1D or (wave, flux, sig) tuple
+            sig may be None
+          ID: str (None)
+            Unique name; default is 'spec{:d}'
+          meta: dict (None)
+            Scalar metadata; all spectra need the same keys
+        """
+        if self.mode == 'r':
+            raise IOError('SpecCollection: Opened read-only')
+        if isinstance(spec, tuple):
+            wave, flux, sig = spec
+        else:
+            wave, flux, sig = spec.dispersion, spec.flux, spec.sig
+        if isinstance(wave, u.Quantity):
+            wave = wave.to(self.wave_unit).value
+        flux = np.asarray(getattr(flux, 'value', flux))
+        sig = np.zeros(len(flux)) if sig is None else np.asarray(getattr(sig, 'value', sig))
+        if ID is None:
+            ID = 'spec{:d}'.format(len(self))
+        if ID in self._id_lookup:
+            raise ValueError('SpecCollection: Duplicate ID {:s}'.format(ID))
+        if meta is None:
+            meta = {}
+        if self._meta_keys is None:
+            self._meta_keys = sorted(meta.keys())
+        elif sorted(meta.keys()) != sorted(self._meta_keys):
+            raise ValueError('SpecCollection: Metadata keys differ from {}'.format(self._meta_keys))
+        self._id_lookup[ID] = len(self)
+        self._buffer.append((ID, np.asarray(wave, dtype=np.float64), flux, sig, meta))
+        if len(self._buffer) >= self.nchunk:
+            self._flush_chunk()
+
+    def extend(self, spectra, IDs=None, meta=None):
+        """ Add many spectra (any iterable, consumed one at a time)
+
+        Parameters:
+          spectra: iterable of XSpectrum1D or (wave, flux, sig) tuples
+          IDs: list of str (None)
+          meta: list of dict (None)
+        """
+        for ii, spec in enumerate(spectra):
+            self.append(spec, ID=(None if IDs is None else IDs[ii]),
+                        meta=(None if meta is None else meta[ii]))
+
+    def _flush_chunk(self):
+        # Write the buffered spectra as one chunk
+        if len(self._buffer) == 0:
+            return
+        nrow = len(self._buffer)
+        npix = np.array([len(item[1]) for item in self._buffer])
+        data = dict(wave=np.zeros((nrow, np.max(npix))),
+                    flux=np.zeros((nrow, np.max(npix)), dtype=self.dtype),
+                    sig=np.zeros((nrow, np.max(npix)), dtype=self.dtype))
+        for jj, (ID, wave, flux, sig, meta) in enumerate(self._buffer):
+            data['wave'][jj, :npix[jj]] = wave
+            data['flux'][jj, :npix[jj]] = flux
+            data['sig'][jj, :npix[jj]] = sig
+            row = dict(ID=ID, CHUNK=self._next_chunk, ROW=jj, NPIX=npix[jj],
+                       WVMIN=wave[0], WVMAX=wave[-1])
+            row.update(meta)
+            self._rows.append(row)
+        if self.compress:
+            np.savez_compressed(self._chunk_file(self._next_chunk), **data)
+        else:
+            for key in arrays:
+                np.save(self._chunk_file(self._next_chunk, key), data[key])
+        self._next_chunk += 1
+        self._buffer = []
+
+    def close(self):
+        """ Flush the last chunk and write the index
+        """
+        if self.mode == 'r':
+            self._cache = OrderedDict()
+            return
+        self._flush_chunk()
+        if len(self._rows) > 0:
+            cols = ['ID', 'CHUNK', 'ROW', 'NPIX', 'WVMIN', 'WVMAX'] + list(self._meta_keys)
+            new = Table([Column([row[key] for row in self._rows], name=str(key)) for key in cols])
+            if self.index is None:
+                self.index = new
+            else:
+                from astropy.table import vstack
+                self.index = vstack([self.index, new])
+            self._rows = []
+        if self.index is not None:
+            self.index.meta['WUNIT'] = self.wave_unit.to_string()
+            self.index.write(os.path.join(self.path, index_file), format='fits', overwrite=True)
+        self._cache = OrderedDict()
+
+    # Reading
+    def _chunk_file(self, ichunk, key=None):
+        if key is None:
+            return os.path.join(self.path, 'chunk_{:05d}.npz'.format(ichunk))
+        return os.path.join(self.path, 'chunk_{:05d}_{:s}.npy'.format(ichunk, key))
+
+    def _chunk(self, ichunk):
+        # Memory-mapped (or loaded) arrays of a chunk
+        # Only the last nmax_open chunks stay open (compressed: the last one)
+        if ichunk in self._cache:
+            chunk = self._cache.pop(ichunk)
+        elif os.path.exists(self._chunk_file(ichunk)):
+            npz = np.load(self._chunk_file(ichunk))
+            chunk = dict((key, npz[key]) for key in arrays)
+            npz.close()
+            self._cache = OrderedDict()
+        else:
+            chunk = dict((key, np.load(self._chunk_file(ichunk, key), mmap_mode='r'))
+                         for key in arrays)
+        self._cache[ichunk] = chunk
+        while len(self._cache) > nmax_open:
+            self._cache.popitem(last=False)
+        return chunk
+
+    def _irow(self, item):
+        if isinstance(item, (int, np.integer)):
+            return int(item)
+        return self._id_lookup[item]
+
+    def get_arrays(self, item, wvmin=None, wvmax=None):
+        """ Arrays of one spectrum, optionally in a wavelength range
+
+        Parameters:
+          item: int or str
+            Index or ID of the spectrum
+          wvmin, wvmax: Quantity or float (None)
+            Wavelength range (units of the collection for floats)
+
+        Returns:
+          wave, flux, sig: float arrays
+        """
+        idx = self.index[self._irow(item)]
+        chunk = self._chunk(idx['CHUNK'])
+        irow, npix = idx['ROW'], idx['NPIX']
+        i0, i1 = 0, npix
+        if (wvmin is not None) or (wvmax is not None):
+            wave = chunk['wave'][irow, :npix]
+            if wvmin is not None:
+                i0 = np.searchsorted(wave, u.Quantity(wvmin, self.wave_unit).value)
+            if wvmax is not None:
+                i1 = np.searchsorted(wave, u.Quantity(wvmax, self.wave_unit).value)
+        return tuple(np.array(chunk[key][irow, i0:i1], dtype=np.float64) for key in arrays)
+
+    def get(self, item, wvmin=None, wvmax=None):
+        """ XSpectrum1D of one spectrum (see get_arrays)
+        """
+        from xastropy.spec.utils import XSpectrum1D
+        wave, flux, sig = self.get_arrays(item, wvmin=wvmin, wvmax=wvmax)
+        return XSpectrum1D.from_array(wave*self.wave_unit, u.Quantity(flux),
+                                      uncertainty=StdDevUncertainty(sig))
+
+    def iter_chunks(self):
+        """ Iterate over the chunks for bulk reads
+
+        Returns:
+          Generator of (index rows, wave, flux, sig) with padded 2D arrays
+        """
+        for ichunk in np.unique(self.index['CHUNK']):
+            rows = self.index[self.index['CHUNK'] == ichunk]
+            chunk = self._chunk(ichunk)
+            yield (rows,) + tuple(np.array(chunk[key][rows['ROW']]) for key in arrays)
+
+    def __getitem__(self, item):
+        return self.get(item)
+
+    # Output
+    def __repr__(self):
+        return ('[{:s}: {:s}, nspec={:d}, nchunk={:d}]'.format(
+                self.__class__.__name__, self.path, len(self), self._next_chunk))
+
+
+def write_collection(path, spectra, IDs=None, meta=None, **kwargs):
+    """ Write many spectra to a new collection
+
+    Parameters:
+      path: str
+      spectra: iterable of XSpectrum1D or (wave, flux, sig) tuples
+      IDs, meta: see SpecCollection.extend
+      **kwargs: passed to SpecCollection
+
+    Returns:
+      SpecCollection (read mode)
+    """
+    scoll = SpecCollection(path, mode='w', **kwargs)
+    scoll.extend(spectra, IDs=IDs, meta=meta)
+    scoll.close()
+    return SpecCollection(path)
+
+def read_collection(path, IDs=None):
+    """ Read spectra from a collection
+
+    Parameters:
+      path: str
+      IDs: list (None)
+        Indices or IDs to read; default is all
+
+    Returns:
+      list of XSpectrum1D
+    """
+    scoll = SpecCollection(path)
+    if IDs is None:
+        IDs = range(len(scoll))
+    return [scoll.get(item) for item in IDs]
+
+
+## #################################
+## #################################
+## TESTING
+## #################################
+if __name__ == '__main__':
+
+    flg_test = 0
+    flg_test += 2**0  # Write + read fake spectra
+
+    if (flg_test % 2**1) >= 2**0:
+        import time
+        rstate = np.random.RandomState(1234)
+        spectra = []
+        for ii in range(5000):
+            wave = np.linspace(3800., 9200., 4000 + rstate.randint(100))
+            spectra.append((wave, rstate.normal(1., 0.1, len(wave)), 0.1*np.ones(len(wave))))
+        meta = [dict(zem=rstate.uniform(2., 4.)) for ii in range(len(spectra))]
+        tstart = time.time()
+        scoll = write_collection('tmp_coll', spectra, meta=meta, nchunk=500)
+        print(scoll, 'written in {:g}s'.format(time.time()-tstart))
+        tstart = time.time()
+        wave, flux, sig = scoll.get_arrays('spec4321', wvmin=5000., wvmax=5100.)
+        print('Read {:d} pixels in {:g}s'.format(len(wave), time.time()-tstart))
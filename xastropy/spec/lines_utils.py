@@ -27,6 +27,7 @@ from xastropy.xutils import xdebug as xdb
 
 # class SpectralLine(object):
 # class AbsLine(SpectralLine):
+# def batch_measure -- AODM and EW of many transitions
 
 # Class for Spectral line
 class SpectralLine(object):
@@ -125,24 +126,32 @@ class AbsLine(SpectralLine):
           1D spectrum.  Required but often read in through the Class (self.spec)
         conti : np.array (None)
           Continuum array 
+        nmc : int (0)
+          Number of Monte Carlo noise realizations of the flux
+        seed : int (None)
+          Seed for the realizations
+        perc : tuple (16, 50, 84)
+          Percentiles of the Monte Carlo distribution
 
         Returns:
           N, sigN : Column and error in linear space
+          N_mc : Percentiles of N from the realizations (only if nmc > 0);
+            also stored in attrib['N_mc']
         """
 
         # Grab Spectrum
         spec = self.set_spec(**kwargs)
 
-        # Velocity array
-        spec.velo = spec.relative_vel(self.wrest*(1+self.analy['z']))
-
         # Pixels for evaluation
         pix = spec.pix_minmax(self.analy['z'], self.wrest,
                         self.analy['VLIM'].to('km/s'))[0]
                         #self.analy['VLIM'].to('km/s').value)[0]
 
-        # For convenience + normalize
-        velo = spec.velo[pix]
+        # For convenience + normalize (velocities of the window only)
+        if hasattr(spec, 'pix_index'):
+            velo = spec.relative_vel(self.wrest*(1+self.analy['z']), pix=pix)
+        else:
+            velo = spec.relative_vel(self.wrest*(1+self.analy['z']))[pix]
         fx, sig = parse_spec(spec, **kwargs)
 
         # dv
@@ -151,36 +160,31 @@ class AbsLine(SpectralLine):
 
         # Atomic data
         cst = (10.**14.5761)/(self.atomic['fval']*self.wrest) / (u.km/u.s) / u.cm * (u.AA/u.cm)
+        cst = cst.to('s/(km cm2)').value
 
-        # Mask
-        mask = (pix == pix) # True = good
-        nndt = Quantity(np.zeros(len(pix)), unit='s/(km cm cm)')
-
-        # Saturated?
-        satp = np.where( (fx <= sig/5.) | (fx < 0.05) )[0]
-        if len(satp) > 0:
-            mask[satp] = False
-            lim = np.where(sig[satp] > 0.)[0]
-            if len(lim) > 0:
-                sub = np.maximum(0.05, sig[satp[lim]]/5.)
-                nndt[satp[lim]] = np.log(1./sub)*cst
-                flg_sat = len(lim)
-        # AODM
-        nndt[mask] = np.log(1./fx[mask])*cst
-
-        # Sum it
-        ntot = np.sum( nndt*delv )
-        tvar = np.sum( (delv*cst*sig/fx)**2 )
+        # AODM (saturated pixels set to the limit)
+        fx = np.asarray(getattr(fx, 'value', fx), dtype=np.float64)
+        sig = np.asarray(getattr(sig, 'value', sig), dtype=np.float64)
+        N, sigN, flg_sat = aodm_arrays(delv.to('km/s').value, fx, sig, cst)
+        ntot = N * u.cm**-2
+        sigN = sigN * u.cm**-2
 
         # Fill
         self.attrib['N'] = ntot
-        self.attrib['sigN'] = np.sqrt(tvar)
+        self.attrib['sigN'] = sigN
         logN, sig_logN = xsb.lin_to_log(self.attrib['N'].value, self.attrib['sigN'].value)
         self.attrib['logN'] = logN
         self.attrib['sig_logN'] = sig_logN
 
+        # Monte Carlo (all realizations at once)
+        if kwargs.get('nmc', 0) > 0:
+            fx_mc = mc_realizations(fx, sig, kwargs['nmc'], seed=kwargs.get('seed'))
+            N_mc = aodm_arrays(delv.to('km/s').value, fx_mc, sig, cst)[0]
+            self.attrib['N_mc'] = np.percentile(N_mc, kwargs.get('perc', (16., 50., 84.))) * ntot.unit
+            return ntot, sigN, self.attrib['N_mc']
+
         # Return
-        return ntot, np.sqrt(tvar)
+        return ntot, sigN
 
     # EW 
     def ew(self, **kwargs):
@@ -195,9 +199,13 @@ class AbsLine(SpectralLine):
           1D spectrum.  Required but often read in through the Class (self.spec)
         conti : np.array (None)
           Continuum array 
+        nmc, seed, perc :
+          Monte Carlo options (see aodm)
 
         Returns:
           EW, sigEW : EW and error in observer frame
+          EW_mc : Percentiles of EW from the realizations (only if nmc > 0);
+            also stored in attrib['EW_mc']
         """
 
         # Check on WVMNX
@@ -223,15 +231,24 @@ class AbsLine(SpectralLine):
             raise ValueError('Expecting a unit!')
 
         # Simple boxcar
-        EW = np.sum( dwv * (1. - fx) ) 
-        varEW = np.sum( dwv**2 * sig**2 )
-        sigEW = np.sqrt(varEW) 
+        fx = np.asarray(getattr(fx, 'value', fx), dtype=np.float64)
+        sig = np.asarray(getattr(sig, 'value', sig), dtype=np.float64)
+        EW, sigEW = ew_arrays(dwv.value, fx, sig)
+        EW = EW * dwv.unit
+        sigEW = sigEW * dwv.unit
 
 
         # Fill
         self.attrib['EW'] = EW 
         self.attrib['sigEW'] = sigEW 
 
+        # Monte Carlo (all realizations at once)
+        if kwargs.get('nmc', 0) > 0:
+            fx_mc = mc_realizations(fx, sig, kwargs['nmc'], seed=kwargs.get('seed'))
+            EW_mc = ew_arrays(dwv.value, fx_mc, 0.)[0]
+            self.attrib['EW_mc'] = np.percentile(EW_mc, kwargs.get('perc', (16., 50., 84.))) * dwv.unit
+            return EW, sigEW, self.attrib['EW_mc']
+
         # Return
         return EW, sigEW
             
@@ -241,10 +258,14 @@ class AbsLine(SpectralLine):
         Return rest-frame.  See "ew" above for details
         """
         # Standard call
-        EW,sigEW = self.ew(**kwargs)
+        out = self.ew(**kwargs)
+        EW, sigEW = out[0], out[1]
         # Push to rest-frame
         self.attrib['EW'] = EW / (self.analy['z']+1)
         self.attrib['sigEW'] = sigEW / (self.analy['z']+1)
+        if len(out) > 2:  # Monte Carlo
+            self.attrib['EW_mc'] = out[2] / (self.analy['z']+1)
+            return self.attrib['EW'], self.attrib['sigEW'], self.attrib['EW_mc']
 
         # Return
         return self.attrib['EW'], self.attrib['sigEW'] 
@@ -305,6 +326,230 @@ def parse_spec(spec, **kwargs):
 
     return fx, sig
 
+# ######
+# AODM and EW on float arrays
+def aodm_arrays(delv, fx, sig, cst):
+    """ AODM column density along the last axis (see AbsLine.aodm)
+
+    Parameters
+    ----------
+    delv : float array
+      Velocity width of the pixels (km/s)
+    fx, sig : float arrays
+      Normalized flux and error, e.g. [nmc, npix] realizations
+    cst : float or array
+      10**14.5761 / (fval * wrest[Ang])
+
+    Returns
+    -------
+    N, sigN : float arrays
+      Column density and error (cm^-2)
+    nsat : int array
+      Number of saturated pixels
+    """
+    fx = np.asarray(fx, dtype=np.float64)
+    sig = np.asarray(sig, dtype=np.float64) * np.ones(fx.shape)
+    # Saturated pixels are set to the limit
+    sat = (fx <= sig/5.) | (fx < 0.05)
+    lim = sat & (sig > 0.)
+    nndt = np.zeros(fx.shape)
+    nndt[~sat] = np.log(1./fx[~sat])
+    nndt[lim] = np.log(1./np.maximum(0.05, sig[lim]/5.))
+    N = np.sum(nndt*cst*delv, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tvar = np.sum(np.where(sig > 0., (delv*cst*sig/fx)**2, 0.), axis=-1)
+    return N, np.sqrt(tvar), np.sum(lim, axis=-1)
+
+def ew_arrays(dwv, fx, sig):
+    """ Boxcar EW along the last axis (see AbsLine.ew)
+
+    Returns
+    -------
+    EW, sigEW : float arrays
+    """
+    EW = np.sum(dwv*(1.-fx), axis=-1)
+    sigEW = np.sqrt(np.sum(dwv**2 * sig**2, axis=-1))
+    return EW, sigEW * np.ones(EW.shape)
+
+def mc_realizations(fx, sig, nmc, seed=None):
+    """ Noise realizations of a flux array
+
+    Parameters
+    ----------
+    fx, sig : float arrays [npix]
+    nmc : int
+      Number of realizations
+    seed : int (None)
+
+    Returns
+    -------
+    fx_mc : float array [nmc, npix]
+    """
+    rstate = np.random.RandomState(seed)
+    fx = np.asarray(getattr(fx, 'value', fx), dtype=np.float64)
+    sig = np.asarray(getattr(sig, 'value', sig), dtype=np.float64)
+    return fx[None,:] + sig[None,:] * rstate.normal(size=(nmc, len(fx)))
+
+# ######
+# Batch measurements
+def _parse_request(req):
+    # Request as a dict with keys spec, zabs, wrest and vlim and/or wvmnx
+    if isinstance(req, dict):
+        return req
+    keys = ['spec', 'zabs', 'wrest', 'vlim', 'wvmnx']
+    return dict(zip(keys, req))
+
+def _pix_index(spec):
+    # Cached index of XSpectrum1D; built here for other spectrum classes
+    if hasattr(spec, 'pix_index'):
+        return spec.pix_index()
+    wave = np.asarray(spec.dispersion.value, dtype=np.float64)
+    return dict(wave=wave, mid=0.5*(wave[1:]+wave[:-1]), unit=spec.dispersion.unit)
+
+def _window_arrays(wave, flux, sig, pixmnx):
+    # Padded [nwin, nmax] arrays of the pixels in each window
+    nwin = pixmnx[:,1] - pixmnx[:,0] + 1
+    xpix = np.arange(np.max(nwin))
+    valid = xpix[None,:] < nwin[:,None]
+    idx = np.minimum(pixmnx[:,0:1] + xpix[None,:], len(wave)-1)
+    wv = wave[idx]
+    # Pixel widths; first = second (as in AbsLine.aodm and ew)
+    dwv = np.zeros_like(wv)
+    dwv[:,1:] = wv[:,1:] - wv[:,:-1]
+    if dwv.shape[1] > 1:
+        dwv[:,0] = dwv[:,1]
+    # Padding contributes nothing (dwv=0, flux=1, sig=0)
+    dwv[~valid] = 0.
+    fx = np.where(valid, flux[idx], 1.)
+    sg = np.where(valid, sig[idx], 0.)
+    return wv, dwv, fx, sg
+
+def batch_measure(requests, rest=False):
+    """ AODM column densities and boxcar EWs for many transitions
+
+    Requests on the same spectrum are measured together on padded
+    float arrays.  The math follows AbsLine.aodm and AbsLine.ew.
+
+    Parameters
+    ----------
+    requests : list of dict or tuple
+      dict keys (or tuple order): spec, zabs, wrest, vlim, wvmnx
+        spec : XSpectrum1D
+        zabs : float
+        wrest : Quantity
+        vlim : Quantity (2) -- velocity window for the AODM (and EW)
+        wvmnx : Quantity (2) -- observed wavelength window for the EW
+          Default is the vlim window
+      optional keys:
+        fval : float -- oscillator strength (default from abs_line_data)
+        conti : array -- continuum of the spectrum
+    rest : bool (False)
+      Return rest-frame EWs
+
+    Returns
+    -------
+    tab : Table
+      One row per request: zabs, wrest, N, sigN, logN, sig_logN,
+      flg_sat (number of saturated pixels), EW, sigEW
+      N, sigN are in cm^-2; EW, sigEW in the units of the dispersion
+    """
+    from astropy.table import Table, Column
+    import xastropy.spec.abs_line as xspa
+
+    ckms = const.c.to('km/s').value
+    reqs = [_parse_request(req) for req in requests]
+    nreq = len(reqs)
+    out = dict((key, np.zeros(nreq)) for key in
+               ['zabs', 'wrest', 'N', 'sigN', 'EW', 'sigEW'])
+    out['flg_sat'] = np.zeros(nreq, dtype=int)
+    wv_unit = None
+
+    # Group by spectrum
+    groups = {}
+    for ii, req in enumerate(reqs):
+        groups.setdefault(id(req['spec']), []).append(ii)
+
+    for key, idx in groups.items():
+        spec = reqs[idx[0]]['spec']
+        pindex = _pix_index(spec)
+        wave = pindex['wave']
+        wv_unit = pindex['unit']
+        flux = np.asarray(getattr(spec.flux, 'value', spec.flux), dtype=np.float64)
+        sig = np.asarray(getattr(spec.sig, 'value', spec.sig), dtype=np.float64)
+        if 'conti' in reqs[idx[0]]:
+            conti = np.asarray(reqs[idx[0]]['conti'])
+            if len(conti) != len(flux):
+                raise ValueError('lines_utils.batch_measure: Continuum length must match input spectrum')
+            flux = flux / conti
+            sig = sig / conti
+
+        # Parameters of the group
+        zabs = np.array([reqs[ii]['zabs'] for ii in idx], dtype=np.float64)
+        wrest = np.array([Quantity(reqs[ii]['wrest'], u.AA).to(u.AA).value for ii in idx])
+        fval = np.array([reqs[ii].get('fval', np.nan) for ii in idx], dtype=np.float64)
+        nof = np.isnan(fval)
+        if np.any(nof):
+            fval[nof] = xspa.abs_line_data(wrest[nof], ret_flg=2)['fval']
+        out['zabs'][idx] = zabs
+        out['wrest'][idx] = wrest
+        wobs = (1+zabs) * wrest
+
+        # AODM
+        has_v = np.array([reqs[ii].get('vlim') is not None for ii in idx])
+        vlim = np.zeros((len(idx), 2))
+        for jj, ii in enumerate(idx):
+            if has_v[jj]:
+                vlim[jj] = Quantity(reqs[ii]['vlim'], u.km/u.s).value
+        if np.any(has_v):
+            sub = np.where(has_v)[0]
+            wvlim = wobs[sub,None] * (1 + vlim[sub]/ckms)
+            if wv_unit is not None:
+                wvlim = (wvlim*u.AA).to(wv_unit).value
+            pixmnx = np.searchsorted(pindex['mid'], wvlim)
+            wv, dwv, fx, sg = _window_arrays(wave, flux, sig, pixmnx)
+            delv = dwv / wobs[sub,None] * ckms   # Velocity differences
+            cst = (10.**14.5761)/(fval[sub]*wrest[sub])
+            isub = np.array(idx)[sub]
+            out['N'][isub], out['sigN'][isub], out['flg_sat'][isub] = aodm_arrays(
+                delv, fx, sg, cst[:,None])
+
+        # EW
+        wvmnx = np.zeros((len(idx), 2))
+        has_ew = np.zeros(len(idx), dtype=bool)
+        for jj, ii in enumerate(idx):
+            if reqs[ii].get('wvmnx') is not None:
+                wvmnx[jj] = Quantity(reqs[ii]['wvmnx'], wv_unit).value
+                has_ew[jj] = True
+            elif has_v[jj]:
+                wvmnx[jj] = wobs[jj] * (1 + vlim[jj]/ckms)
+                if wv_unit is not None:
+                    wvmnx[jj] = (wvmnx[jj]*u.AA).to(wv_unit).value
+                has_ew[jj] = True
+        if np.any(has_ew):
+            sub = np.where(has_ew)[0]
+            pixmnx = np.searchsorted(pindex['mid'], wvmnx[sub])
+            wv, dwv, fx, sg = _window_arrays(wave, flux, sig, pixmnx)
+            isub = np.array(idx)[sub]
+            out['EW'][isub], out['sigEW'][isub] = ew_arrays(dwv, fx, sg)
+            if rest:
+                out['EW'][isub] /= (1+zabs[sub])
+                out['sigEW'][isub] /= (1+zabs[sub])
+
+    # Table
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logN, sig_logN = xsb.lin_to_log(out['N'], out['sigN'])
+    tab = Table()
+    tab.add_column(Column(out['zabs'], name=str('zabs')))
+    tab.add_column(Column(out['wrest'], name=str('wrest'), unit=u.AA))
+    tab.add_column(Column(out['N'], name=str('N'), unit=u.cm**-2))
+    tab.add_column(Column(out['sigN'], name=str('sigN'), unit=u.cm**-2))
+    tab.add_column(Column(logN, name=str('logN')))
+    tab.add_column(Column(sig_logN, name=str('sig_logN')))
+    tab.add_column(Column(out['flg_sat'], name=str('flg_sat')))
+    tab.add_column(Column(out['EW'], name=str('EW'), unit=wv_unit))
+    tab.add_column(Column(out['sigEW'], name=str('sigEW'), unit=wv_unit))
+    return tab
+
 ## #################################    
 ## #################################    
 ## TESTING
@@ -315,6 +560,7 @@ if __name__ == '__main__':
     #flg_test += 2**0  # AbsLine
     flg_test += 2**1  # AODM
     #flg_test += 2**2  # EW
+    #flg_test += 2**3  # Batch AODM + EW
 
     # Test Absorption Line creation
     if (flg_test % 2**1) >= 2**0:
@@ -353,3 +599,13 @@ if __name__ == '__main__':
         # Evaluate
         EW,sigEW = aline.restew()
         print('Rest EW = {:g}, sig = {:g}'.format(EW, sigEW))
+
+    # Test batch
+    if (flg_test % 2**4) >= 2**3:
+        print('------------ Batch -------------')
+        fil = '~/PROGETTI/LLSZ3/data/normalize/UM669_nF.fits'
+        spec = lsio.readspec(fil)
+        vlim = [-100., 100.]*u.km/u.s
+        requests = [dict(spec=spec, zabs=2.92652, wrest=wrest*u.AA, vlim=vlim)
+                    for wrest in [1302.1685, 1304.3702, 1334.5323]]
+        print(batch_measure(requests, rest=True))
@@ -268,11 +268,462 @@ def get_table_column(tags, hdulist):
     else: 
         return dat, 'NONE'
 
+#### ###############################
+#### ###############################
+#  Default tags for Binary FITS Tables (as in readspec)
+flux_tags_default = ['SPEC', 'FLUX','FLAM','FX', 'FLUXSTIS', 'FLUX_OPT', 'fl']
+sig_tags_default = ['ERROR','ERR','SIGMA_FLUX','FLAM_SIG', 'SIGMA_UP', 'ERRSTIS', 'FLUXERR', 'er']
+ivar_tags_default = ['IVAR', 'IVAR_OPT']
+wave_tags_default = ['WAVE','WAVELENGTH','LAMBDA','LOGLAM', 'WAVESTIS', 'WAVE_OPT', 'wa']
+
+def find_table_tag(tags, hdulist):
+    """ Name of the first tag present in the Binary FITS Table
+    Same search as get_table_column but without reading the data
+
+    Parameters:
+      tags: list of str
+      hdulist: HDUList or list
+
+    Returns:
+      tag: str or None
+    """
+    if isinstance(hdulist[1], BinTableHDU):
+        names = hdulist[1].columns.names
+    else:
+        names = hdulist[1].dtype.names
+    for tag in tags:
+        if tag in names:
+            return tag
+    return None
+
+def detect_layout(hdulist, flux_tags=None, sig_tags=None, multi_ivar=False):
+    """ Detect where the flux, error and wavelengths live in a FITS file
+    Follows the logic of readspec but only parses the headers
+
+    Parameters:
+      hdulist: HDUList
+      flux_tags, sig_tags: list of str (None)
+        Tags to search for in a Binary FITS Table
+      multi_ivar: bool (False)
+        BOSS format of flux, ivar, log10(wave) in multi-extension FITS
+
+    Returns:
+      layout: dict
+        'type': 'table', 'image' or 'multi'
+        'flux', 'sig', 'wave': (extension, tag) with tag=None for images;
+          'sig' is None without error array, 'wave' is None for the WCS
+        'ivar': True if 'sig' is an inverse variance
+        'logwave': True if 'wave' is log10 wavelength
+    """
+    head0 = hdulist[0].header
+    layout = dict(ivar=False, logwave=False, sig=None, wave=None)
 
+    if head0['NAXIS'] == 0:  # Binary FITS Table
+        layout['type'] = 'table'
+        if flux_tags is None:
+            flux_tags = flux_tags_default
+        if sig_tags is None:
+            sig_tags = sig_tags_default
+        tag = find_table_tag(flux_tags, hdulist)
+        if tag is None:
+            raise ValueError('spec.readwrite: Binary FITS Table but no Flux tag')
+        layout['flux'] = (1, tag)
+        tag = find_table_tag(sig_tags, hdulist)
+        if tag is None:
+            tag = find_table_tag(ivar_tags_default, hdulist)
+            if tag is None:
+                raise ValueError('spec.readwrite: Binary FITS Table but no error tags')
+            layout['ivar'] = True
+        layout['sig'] = (1, tag)
+        tag = find_table_tag(wave_tags_default, hdulist)
+        if tag is None:
+            raise ValueError('spec.readwrite: Binary FITS Table but no wavelength tag')
+        layout['wave'] = (1, tag)
+        layout['logwave'] = (tag == 'LOGLAM')
+    elif head0['NAXIS'] == 1:  # Data in the zero extension
+        layout['flux'] = (0, None)
+        if len(hdulist) <= 2:  # Wavelengths from the header
+            layout['type'] = 'image'
+            if len(hdulist) == 2:
+                layout['sig'] = (1, None)
+        else:  # ASSUMING MULTI-EXTENSION
+            layout['type'] = 'multi'
+            layout['sig'] = (1, None)
+            layout['wave'] = (2, None)
+            try:
+                multi_ivar = head0['TELESCOP'][0:4] in ['SDSS']
+            except KeyError:
+                pass
+            layout['ivar'] = multi_ivar
+            layout['logwave'] = multi_ivar
+    else:
+        raise ValueError('spec.readwrite: Looks like an image')
+    return layout
 
+def wcs_param(hdr):
+    """ Parse the linear or log-linear WCS header cards
 
+    Parameters:
+      hdr: Header
 
+    Returns:
+      crval1, cdelt1, crpix1: float
+      flg_log: bool
+        True for log10 wavelengths
+    """
+    crpix1 = hdr['CRPIX1'] if 'CRPIX1' in hdr else 1.
+    crval1 = hdr['CRVAL1'] if 'CRVAL1' in hdr else 1.
+    if 'CDELT1' in hdr:
+        cdelt1 = hdr['CDELT1']
+    else:
+        cdelt1 = hdr['CD1_1'] if 'CD1_1' in hdr else 1.
+    dcflag = hdr['DC-FLAG'] if 'DC-FLAG' in hdr else None
+    # Log-linear as in setwave; CRVAL1 < 5 is also log10(Ang) (e.g. SDSS)
+    flg_log = (dcflag == 1) or (cdelt1 < 1e-4) or (crval1 < 5.)
+    return crval1, cdelt1, crpix1, flg_log
+
+def wcs_wave(hdr, pix):
+    """ Wavelengths from the WCS header cards
+
+    Parameters:
+      hdr: Header
+      pix: int array
+        Pixel indices (0-based)
+
+    Returns:
+      wave: float array
+    """
+    crval1, cdelt1, crpix1, flg_log = wcs_param(hdr)
+    wave = crval1 + cdelt1 * (np.asarray(pix) + 1. - crpix1)
+    if flg_log:
+        wave = 10.**wave
+    return wave
 
+class LazySpectrum(object):
+    """ Memory-mapped spectrum that reads pixels on request
+
+    Only the headers are parsed on initialization.  Flux, error and
+    wavelengths are read (or computed from the WCS) for the requested
+    pixel ranges.
+
+    Parameters:
+      specfil: str
+        FITS file
+      efil: str (None)
+        Error file for the old school format (one file per flux, error)
+      flux_tags, sig_tags: list of str (None)
+        Tags to search for in a Binary FITS Table
+      multi_ivar: bool (False)
+        BOSS format of flux, ivar, log10(wave) in multi-extension FITS
+      registry: FormatRegistry (None)
+        Reuse layouts detected for files with the same header signature
+    """
+    def __init__(self, specfil, efil=None, flux_tags=None, sig_tags=None,
+                 multi_ivar=False, registry=None):
+        from xastropy.files import general as xfg
+
+        datfil, chk = xfg.chk_for_gz(os.path.expanduser(specfil))
+        if chk == 0:
+            raise IOError('spec.readwrite: File does not exist {:s}'.format(specfil))
+        self.filename = specfil
+        self.hdulist = fits.open(datfil, memmap=True)
+        self.head = self.hdulist[0].header
+        if registry is None:
+            self.layout = detect_layout(self.hdulist, flux_tags=flux_tags,
+                                        sig_tags=sig_tags, multi_ivar=multi_ivar)
+        else:
+            self.layout = registry.layout(self.hdulist, flux_tags=flux_tags,
+                                          sig_tags=sig_tags, multi_ivar=multi_ivar)
+
+        # Old school error file
+        self.ehdulist = None
+        if (self.layout['type'] == 'image') and (self.layout['sig'] is None):
+            if efil is None:
+                ipos = max(datfil.find('F.fits'), datfil.find('f.fits'))
+                if ipos > 0:
+                    ekey = 'E.fits' if datfil.find('F.fits') > 0 else 'e.fits'
+                    efil, chk = xfg.chk_for_gz(datfil[0:ipos]+ekey)
+                    if chk == 0:
+                        efil = None
+            if efil is not None:
+                self.ehdulist = fits.open(os.path.expanduser(efil), memmap=True)
+                self.layout['sig'] = (0, None)
+
+        self.npix = len(self._array(self.layout['flux']))
+
+    def _array(self, loc, err=False):
+        # Memory-mapped 1D array (no data read)
+        iext, tag = loc
+        hdulist = self.ehdulist if (err and self.ehdulist is not None) else self.hdulist
+        if tag is None:
+            arr = hdulist[iext].data
+        else:
+            arr = hdulist[iext].data.field(tag)
+        if arr.ndim > 1:
+            arr = arr[0] if arr.shape[0] == 1 else arr.ravel()
+        return arr
+
+    def wave_pix(self, i0=0, i1=None):
+        """ Wavelengths of a pixel range
+
+        Parameters:
+          i0, i1: int
+            Pixel range [i0, i1)
+
+        Returns:
+          wave: Quantity array (Angstroms)
+        """
+        if i1 is None:
+            i1 = self.npix
+        if self.layout['wave'] is None:
+            wave = wcs_wave(self.head, np.arange(i0, i1))
+        else:
+            wave = np.array(self._array(self.layout['wave'])[i0:i1], dtype=np.float64)
+            if self.layout['logwave']:
+                wave = 10.**wave
+        return wave * u.AA
+
+    def pix_range(self, wvmin, wvmax):
+        """ Pixel range covering a wavelength interval
+
+        Parameters:
+          wvmin, wvmax: Quantity or float (Angstroms)
+
+        Returns:
+          i0, i1: int
+            Pixel range [i0, i1) with wvmin <= wave < wvmax
+        """
+        wvlim = np.array([u.Quantity(wvmin, u.AA).value, u.Quantity(wvmax, u.AA).value])
+        if self.layout['wave'] is None:
+            # Invert the WCS
+            crval1, cdelt1, crpix1, flg_log = wcs_param(self.head)
+            if flg_log:
+                wvlim = np.log10(wvlim)
+            pix = (wvlim - crval1) / cdelt1 + crpix1 - 1.
+            i0, i1 = np.ceil(pix - 1e-8).astype(int)
+        else:
+            wave = self._array(self.layout['wave'])
+            if self.layout['logwave']:
+                wvlim = np.log10(wvlim)
+            # Binary search only touches a few pages of the file
+            i0, i1 = np.searchsorted(wave, wvlim)
+        return max(int(i0), 0), min(int(i1), self.npix)
+
+    def read(self, i0=0, i1=None):
+        """ Read a pixel range
+
+        Parameters:
+          i0, i1: int
+            Pixel range [i0, i1)
+
+        Returns:
+          wave: Quantity array (Angstroms)
+          flux: float array
+          sig: float array or None
+        """
+        if i1 is None:
+            i1 = self.npix
+        flux = np.array(self._array(self.layout['flux'])[i0:i1], dtype=np.float64)
+        sig = None
+        if self.layout['sig'] is not None:
+            sig = np.array(self._array(self.layout['sig'], err=True)[i0:i1], dtype=np.float64)
+            if self.layout['ivar']:
+                ivar = sig
+                sig = np.zeros(len(ivar))
+                gdi = np.where(ivar > 0.)[0]
+                sig[gdi] = np.sqrt(1./ivar[gdi])
+        return self.wave_pix(i0, i1), flux, sig
+
+    def window(self, wvmin, wvmax):
+        """ XSpectrum1D of the pixels in a wavelength interval
+
+        Parameters:
+          wvmin, wvmax: Quantity or float (Angstroms)
+
+        Returns:
+          XSpectrum1D
+        """
+        i0, i1 = self.pix_range(wvmin, wvmax)
+        return self._xspectrum(i0, i1)
+
+    def velocity_window(self, wrest, zabs, vmin, vmax):
+        """ XSpectrum1D of the pixels in a velocity window about a transition
+
+        Parameters:
+          wrest: Quantity or float (Angstroms)
+          zabs: float
+          vmin, vmax: Quantity or float (km/s)
+
+        Returns:
+          XSpectrum1D
+        """
+        from astropy import constants as const
+        ckms = const.c.to('km/s').value
+        wobs = u.Quantity(wrest, u.AA).value * (1+zabs)
+        vlim = u.Quantity([vmin, vmax], u.km/u.s).value
+        return self.window(wobs*(1+vlim[0]/ckms), wobs*(1+vlim[1]/ckms))
+
+    def to_xspectrum(self):
+        """ Materialize the full XSpectrum1D
+        """
+        return self._xspectrum(0, self.npix)
+
+    def _xspectrum(self, i0, i1):
+        wave, flux, sig = self.read(i0, i1)
+        if sig is None:
+            xspec1d = XSpectrum1D.from_array(wave, u.Quantity(flux))
+        else:
+            xspec1d = XSpectrum1D.from_array(wave, u.Quantity(flux),
+                                             uncertainty=StdDevUncertainty(sig))
+        xspec1d.filename = self.filename
+        xspec1d.head = self.head
+        return xspec1d
+
+    def close(self):
+        """ Close the FITS file(s)
+        """
+        self.hdulist.close()
+        if self.ehdulist is not None:
+            self.ehdulist.close()
+
+    # Output
+    def __repr__(self):
+        return ('[LazySpectrum: {:s}, type={:s}, npix={:d}]'.format(
+                self.filename, self.layout['type'], self.npix))
+
+
+#### ###############################
+#### ###############################
+#  Batch ingestion
+class FormatRegistry(object):
+    """ Cache of detected layouts keyed by a header signature
+
+    The signature is the instrument (TELESCOP, INSTRUME), the set of
+    primary header keywords, the number of extensions and the column
+    names of a Binary FITS Table.  Files from one instrument and
+    pipeline then share one detection.
+    """
+    def __init__(self):
+        import threading
+        self.layouts = {}
+        self.nhit = 0
+        self.nmiss = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature(hdulist):
+        head0 = hdulist[0].header
+        cols = ()
+        if (head0['NAXIS'] == 0) and (len(hdulist) > 1):
+            if isinstance(hdulist[1], BinTableHDU):
+                cols = tuple(hdulist[1].columns.names)
+            else:
+                cols = tuple(hdulist[1].dtype.names)
+        return (head0.get('TELESCOP', ''), head0.get('INSTRUME', ''),
+                tuple(sorted(set(head0.keys()))), len(hdulist), cols)
+
+    def layout(self, hdulist, flux_tags=None, sig_tags=None, multi_ivar=False):
+        """ Layout of a file; detected once per signature and tag lists
+
+        Returns:
+          layout: dict (a copy; see detect_layout)
+        """
+        key = (self.signature(hdulist),
+               None if flux_tags is None else tuple(flux_tags),
+               None if sig_tags is None else tuple(sig_tags), multi_ivar)
+        with self._lock:
+            if key in self.layouts:
+                self.nhit += 1
+                return dict(self.layouts[key])
+        layout = detect_layout(hdulist, flux_tags=flux_tags, sig_tags=sig_tags,
+                               multi_ivar=multi_ivar)
+        with self._lock:
+            self.nmiss += 1
+            self.layouts[key] = layout
+        return dict(layout)
+
+    def __repr__(self):
+        return ('[{:s}: nlayout={:d}, nhit={:d}, nmiss={:d}]'.format(
+                self.__class__.__name__, len(self.layouts), self.nhit, self.nmiss))
+
+# Registry of this process (each worker process has its own)
+format_registry = FormatRegistry()
+
+def _read_one(args):
+    """ Read one file for batch_readspec; errors are returned, not raised
+    """
+    ifile, specfil, wvmnx, kwargs = args
+    try:
+        lspec = LazySpectrum(specfil, registry=format_registry, **kwargs)
+        if wvmnx is None:
+            data = lspec.read()
+        else:
+            data = lspec.read(*lspec.pix_range(wvmnx[0], wvmnx[1]))
+        lspec.close()
+        return ifile, (data[0].value, data[1], data[2]), None
+    except Exception as err:
+        return ifile, None, '{:s}: {:s}'.format(err.__class__.__name__, str(err))
+
+def batch_readspec(files, nproc=1, use_threads=False, wvmnx=None,
+                   as_xspec=True, chunksize=16, **kwargs):
+    """ Read many spectra, optionally in parallel
+
+    Layouts are detected once per header signature (FormatRegistry).
+    The output order matches the input order and failures are reported
+    per file instead of stopping the batch.
+
+    Parameters:
+      files: list of str
+      nproc: int (1)
+        Number of workers; 1 reads serially
+      use_threads: bool (False)
+        Use threads instead of processes (I/O-bound reads, shared registry)
+      wvmnx: tuple (None)
+        Only read this wavelength range (Angstroms)
+      as_xspec: bool (True)
+        Return XSpectrum1D objects, else (wave, flux, sig) tuples
+      chunksize: int (16)
+        Files per task sent to a worker process
+      **kwargs: passed to LazySpectrum (e.g. flux_tags)
+
+    Returns:
+      spectra: list
+        One entry per file; None for failures
+      errors: list of (str, str)
+        File and error message of each failure
+    """
+    tasks = [(ii, specfil, wvmnx, kwargs) for ii, specfil in enumerate(files)]
+    if nproc == 1:
+        results = [_read_one(task) for task in tasks]
+    else:
+        if use_threads:
+            from multiprocessing.pool import ThreadPool as Pool
+        else:
+            from multiprocessing import Pool
+        pool = Pool(nproc)
+        try:
+            results = pool.map(_read_one, tasks, chunksize=chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+    spectra = [None]*len(files)
+    errors = []
+    for ifile, data, err in results:
+        if err is not None:
+            errors.append((files[ifile], err))
+            continue
+        if as_xspec:
+            wave, flux, sig = data
+            if sig is None:
+                spectra[ifile] = XSpectrum1D.from_array(wave*u.AA, u.Quantity(flux))
+            else:
+                spectra[ifile] = XSpectrum1D.from_array(wave*u.AA, u.Quantity(flux),
+                                                        uncertainty=StdDevUncertainty(sig))
+            spectra[ifile].filename = files[ifile]
+        else:
+            spectra[ifile] = data
+    return spectra, errors
 
 
 #### ###############################
@@ -281,6 +732,8 @@ if __name__ == '__main__':
     flg_test = 0
     flg_test += 1 # MagE
     flg_test += 2**1 # LRIS LowRedux
+    #flg_test += 2**2 # Lazy read of a window
+    #flg_test += 2**3 # Batch read of a directory
 
     # Standard log-linear read (MagE)
     if (flg_test % 2**1) >= 2**0:
@@ -298,3 +751,20 @@ if __name__ == '__main__':
         myspec = readspec(fil)
         xdb.xplot(myspec.dispersion, myspec.flux, myspec.uncertainty.array)
         #xdb.set_trace()
+
+    # Lazy read
+    if (flg_test % 2**3) >= 2**2:
+        fil = '~/PROGETTI/LLSZ3/data/normalize/UM669_nF.fits'
+        lspec = LazySpectrum(fil)
+        print(lspec)
+        # CIV 1548 at z=2.9
+        subspec = lspec.velocity_window(1548.195*u.AA, 2.9, -300., 300.)
+        xdb.xplot(subspec.dispersion, subspec.flux, subspec.sig)
+
+    # Batch read
+    if (flg_test % 2**4) >= 2**3:
+        import glob
+        files = glob.glob(os.path.expanduser('~/PROGETTI/LLSZ3/data/normalize/*F.fits*'))
+        spectra, errors = batch_readspec(files, nproc=4)
+        print('Read {:d} spectra with {:d} errors'.format(len(files)-len(errors), len(errors)))
+        print(format_registry)
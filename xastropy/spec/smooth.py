@@ -0,0 +1,265 @@
+"""
+#;+
+#; NAME:
+#; smooth
+#;    Version 1.0
+#;
+#; PURPOSE:
+#;    Module for smoothing spectra with a line-spread function (LSF)
+#;-
+#;------------------------------------------------------------------------------
+"""
+from __future__ import print_function, absolute_import, division, unicode_literals
+
+import numpy as np
+
+from xastropy.xutils import xdebug as xdb
+
+# def gauss_kernel -- Gaussian kernel sampled on pixels
+# def box_kernel -- Box (top-hat) kernel integrated over pixels
+# def lsf_kernel -- Kernel from an LSF description
+# def convolve_lsf -- Convolve spectra with an LSF
+# def convolve_varlsf -- Convolve spectra with a wavelength-dependent LSF
+
+# Kernels are cached by (kind, width)
+_kernel_cache = {}
+nmax_cache = 256
+
+def gauss_kernel(fwhm, nsig=4.):
+    """ Normalized Gaussian kernel sampled on pixels
+
+    Parameters:
+      fwhm: float
+        FWHM of the Gaussian (pixels)
+      nsig: float (4.)
+        Half-width of the kernel in units of sigma
+
+    Returns:
+      kernel: float array
+        Odd-length kernel that sums to unity
+    """
+    sig = fwhm / (2*np.sqrt(2*np.log(2.)))
+    nhalf = max(int(np.ceil(nsig*sig)), 1)
+    xval = np.arange(-nhalf, nhalf+1)
+    kernel = np.exp(-0.5*(xval/sig)**2)
+    return kernel / np.sum(kernel)
+
+def box_kernel(width):
+    """ Normalized box kernel integrated over the pixels
+    Matches astropy's Box1DKernel, e.g. width=4 gives
+    [1/8, 1/4, 1/4, 1/4, 1/8]
+
+    Parameters:
+      width: float
+        Full width of the box (pixels)
+
+    Returns:
+      kernel: float array
+        Odd-length kernel that sums to unity
+    """
+    nhalf = int(np.ceil(width/2. - 0.5))
+    xval = np.arange(-nhalf, nhalf+1)
+    kernel = np.clip(np.minimum(xval+0.5, width/2.) - np.maximum(xval-0.5, -width/2.), 0., None)
+    return kernel / np.sum(kernel)
+
+def lsf_kernel(lsf):
+    """ Kernel from an LSF description
+
+    Parameters:
+      lsf: float, tuple or array
+        float -- FWHM of a Gaussian LSF (pixels)
+        ('gauss', fwhm) or ('box', width) -- in pixels
+        array -- Tabulated LSF sampled on the pixels (odd length, centered)
+
+    Returns:
+      kernel: float array
+        Odd-length kernel that sums to unity
+    """
+    if np.isscalar(lsf):
+        lsf = ('gauss', lsf)
+    if isinstance(lsf, tuple):
+        key = (lsf[0], round(float(lsf[1]), 6))
+        if key not in _kernel_cache:
+            if lsf[0] == 'gauss':
+                kernel = gauss_kernel(key[1])
+            elif lsf[0] == 'box':
+                kernel = box_kernel(key[1])
+            else:
+                raise ValueError('smooth.lsf_kernel: Not ready for kernel {:s}'.format(lsf[0]))
+            if len(_kernel_cache) >= nmax_cache:
+                _kernel_cache.clear()
+            _kernel_cache[key] = kernel
+        return _kernel_cache[key]
+    kernel = np.asarray(lsf, dtype=np.float64)
+    if (kernel.ndim != 1) or (len(kernel) % 2 == 0):
+        raise ValueError('smooth.lsf_kernel: Tabulated LSF must be 1D with odd length')
+    return kernel / np.sum(kernel)
+
+def _pad(flux, nhalf, boundary):
+    # Extend the spectra along the pixels
+    if boundary == 'edge':
+        return np.pad(flux, ((0,0),(nhalf,nhalf)), mode='edge')
+    elif boundary == 'fill':
+        return np.pad(flux, ((0,0),(nhalf,nhalf)), mode='constant')
+    else:
+        raise ValueError('smooth: Not ready for boundary={:s}'.format(boundary))
+
+def overlap_add(flux, kernel, nblock=None):
+    """ Full convolution of spectra with a kernel by overlap-add
+    Memory and FFT size are set by the block, not the spectrum length
+
+    Parameters:
+      flux: 2D float array [nspec, npix]
+      kernel: float array
+      nblock: int (None)
+        Pixels per block; default is ~8 times the kernel length
+
+    Returns:
+      conv: 2D float array [nspec, npix+len(kernel)-1]
+    """
+    nk = len(kernel)
+    if nblock is None:
+        nblock = max(8*nk, 256)
+    nfft = 1 << int(np.ceil(np.log2(nblock + nk - 1)))
+    nblock = nfft - nk + 1
+    fkern = np.fft.rfft(kernel, nfft)
+    nspec, npix = flux.shape
+    conv = np.zeros((nspec, npix+nk-1))
+    for i0 in range(0, npix, nblock):
+        block = flux[:, i0:i0+nblock]
+        cblk = np.fft.irfft(np.fft.rfft(block, nfft, axis=1) * fkern[None,:], nfft, axis=1)
+        nout = min(block.shape[1]+nk-1, conv.shape[1]-i0)
+        conv[:, i0:i0+nout] += cblk[:, :nout]
+    return conv
+
+def convolve_lsf(flux, lsf, boundary='edge', method='auto', wave=None):
+    """ Convolve one or more spectra with an LSF
+
+    Parameters:
+      flux: float array
+        Spectrum or 2D array of spectra [nspec, npix] on a common pixel grid
+      lsf: float, tuple or array
+        LSF description (see lsf_kernel).  A per-pixel width
+        (('gauss', fwhm_array) or ('box', width_array)) or a constant
+        resolving power (('R', R) or ('R', R, kind); requires wave) is
+        passed to convolve_varlsf
+      boundary: str ('edge')
+        'edge' -- extend each spectrum with its edge values
+        'fill' -- extend with zeros
+      method: str ('auto')
+        'direct', 'fft' or 'oa' (overlap-add).  'auto' uses direct sums
+        for short kernels, overlap-add for long spectra and FFT otherwise
+      wave: float array (None)
+        Wavelengths; only for ('R', R)
+
+    Returns:
+      sflux: float array
+        Smoothed flux with the shape of the input
+    """
+    from scipy.signal import fftconvolve
+
+    # Wavelength-dependent LSF?
+    if isinstance(lsf, tuple) and ((lsf[0] == 'R') or (not np.isscalar(lsf[1]))):
+        return convolve_varlsf(flux, lsf, wave=wave, boundary=boundary)
+
+    kernel = lsf_kernel(lsf)
+    nk = len(kernel)
+    nhalf = nk // 2
+    flux = np.asarray(flux, dtype=np.float64)
+    flg_1D = (flux.ndim == 1)
+    flux = np.atleast_2d(flux)
+    npix = flux.shape[1]
+
+    # Pad and convolve along the pixels
+    pad = _pad(flux, nhalf, boundary)
+    if method == 'auto':
+        if nk <= 15:
+            method = 'direct'
+        elif npix > 2**15:
+            method = 'oa'
+        else:
+            method = 'fft'
+    if method == 'direct':
+        sflux = np.zeros_like(flux)
+        for jj, kval in enumerate(kernel[::-1]):
+            sflux += kval * pad[:, jj:jj+npix]
+    elif method == 'fft':
+        sflux = fftconvolve(pad, kernel[None,:], mode='valid')
+    elif method == 'oa':
+        sflux = overlap_add(pad, kernel)[:, nk-1:nk-1+npix]
+    else:
+        raise ValueError('smooth.convolve_lsf: Not ready for method={:s}'.format(method))
+
+    if flg_1D:
+        return sflux[0]
+    return sflux
+
+def convolve_varlsf(flux, lsf, wave=None, boundary='edge', nchunk=4096, nsig=4.):
+    """ Convolve spectra with an LSF whose width varies along the spectrum
+    The kernel is evaluated at each output pixel and normalized there
+
+    Parameters:
+      flux: float array
+        Spectrum or 2D array of spectra [nspec, npix] on a common pixel grid
+      lsf: tuple
+        ('gauss', fwhm) or ('box', width) with per-pixel widths [npix] (pixels)
+        ('R', R) or ('R', R, kind) -- constant resolving power
+          lambda/FWHM; kind is 'gauss' (default) or 'box'
+      wave: float array (None)
+        Wavelengths [npix]; required for ('R', R)
+      boundary: str ('edge')
+        See convolve_lsf
+      nchunk: int (4096)
+        Pixels per chunk (bounds the memory of the kernel matrix)
+      nsig: float (4.)
+        Half-width of Gaussian kernels in units of sigma
+
+    Returns:
+      sflux: float array
+        Smoothed flux with the shape of the input
+    """
+    flux = np.asarray(flux, dtype=np.float64)
+    flg_1D = (flux.ndim == 1)
+    flux = np.atleast_2d(flux)
+    npix = flux.shape[1]
+
+    # Per-pixel widths
+    if lsf[0] == 'R':
+        if wave is None:
+            raise ValueError('smooth.convolve_varlsf: Need wave for constant R')
+        kind = lsf[2] if len(lsf) > 2 else 'gauss'
+        wave = np.asarray(getattr(wave, 'value', wave), dtype=np.float64)
+        dwave = np.gradient(wave)
+        width = wave / (lsf[1] * dwave)
+    else:
+        kind = lsf[0]
+        width = np.asarray(lsf[1], dtype=np.float64) * np.ones(npix)
+    if kind not in ['gauss', 'box']:
+        raise ValueError('smooth.convolve_varlsf: Not ready for kernel {:s}'.format(kind))
+
+    # Kernel half-width
+    if kind == 'gauss':
+        sig = width / (2*np.sqrt(2*np.log(2.)))
+        nhalf = max(int(np.ceil(nsig*np.max(sig))), 1)
+    else:
+        nhalf = int(np.ceil(np.max(width)/2. - 0.5))
+    xval = np.arange(-nhalf, nhalf+1)
+    pad = _pad(flux, nhalf, boundary)
+
+    sflux = np.zeros_like(flux)
+    for i0 in range(0, npix, nchunk):
+        i1 = min(i0+nchunk, npix)
+        # Kernel matrix [nchunk, nk]
+        if kind == 'gauss':
+            kmat = np.exp(-0.5*(xval[None,:]/sig[i0:i1,None])**2)
+        else:
+            hw = width[i0:i1,None] / 2.
+            kmat = np.clip(np.minimum(xval[None,:]+0.5, hw) - np.maximum(xval[None,:]-0.5, -hw), 0., None)
+        kmat /= np.sum(kmat, axis=1)[:,None]
+        # Sum over the kernel (symmetric about each output pixel)
+        for jj in range(len(xval)):
+            sflux[:, i0:i1] += kmat[None,:,jj] * pad[:, i0+jj:i1+jj]
+
+    if flg_1D:
+        return sflux[0]
+    return sflux
@@ -0,0 +1,97 @@
+# Module to run tests on the atomic line database
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import os, pdb
+import pytest
+from astropy import units as u
+from astropy.table import Table
+
+from xastropy.spec import abs_line as xsab
+from xastropy.xutils import files as xxf
+
+
+def brute_force(tab, wrest, tol=1e-3):
+    # Previous lookup: one linear scan per wavelength
+    mt = np.where(np.fabs(tab['wrest']-wrest) < tol)[0]
+    return mt
+
+def test_lookup():
+    adb = xsab.atomic_db()
+    tab = Table.read(adb.datfil)
+    # Every line with a unique match, offset within the tolerance
+    wrest = np.asarray(tab['wrest'])
+    nmt = np.array([len(brute_force(tab, iw)) for iw in wrest])
+    gdw = wrest[nmt == 1] + 4e-4
+    adict = xsab.abs_line_data(gdw, ret_flg=2)
+    for ii, iw in enumerate(gdw):
+        row = tab[brute_force(tab, iw)[0]]
+        assert adict['wrest'][ii] == row['wrest']
+        assert adict['fval'][ii] == row['fval']
+    # Scalar, Quantity and list input
+    civ = xsab.abs_line_data(1548.195*u.AA)
+    assert civ['fval'] == adict['fval'][np.argmin(np.abs(gdw-1548.195))]
+    assert len(xsab.abs_line_data([1548.195, 1550.77])) == 2
+    # ret_flg=2 matches ret_flg=0
+    adicts = xsab.abs_line_data([1548.195, 1550.77, 1215.6701], ret_flg=0)
+    arrays = xsab.abs_line_data([1548.195, 1550.77, 1215.6701], ret_flg=2)
+    for ii, idict in enumerate(adicts):
+        for key in idict:
+            assert arrays[key][ii] == idict[key]
+
+def test_lookup_errors():
+    adb = xsab.atomic_db()
+    # Missing
+    with pytest.raises(ValueError):
+        xsab.abs_line_data(1234.5678)
+    with pytest.raises(ValueError):
+        xsab.abs_line_data([1548.195, 1234.5678])
+    # Duplicate (two lines within the tolerance)
+    wrest = np.sort(adb.wrest)
+    idup = np.where(np.diff(wrest) < 1e-3)[0]
+    if len(idup) > 0:
+        with pytest.raises(ValueError):
+            xsab.abs_line_data(0.5*(wrest[idup[0]]+wrest[idup[0]+1]))
+    # Larger tolerance
+    with pytest.raises(ValueError):
+        xsab.abs_line_data(1548.195, tol=5.*u.AA)
+
+def test_zion():
+    adb = xsab.atomic_db()
+    civ = adb.zion(6, 4)
+    assert np.all(civ['Z'] == 6) and np.all(civ['ion'] == 4)
+    assert np.all(np.diff(civ['wrest']) > 0.)
+    assert 1548.195 in civ['wrest'] and 1550.77 in civ['wrest']
+    assert len(adb.zion(6, 4, columns=['fval'])['fval']) == len(civ['wrest'])
+    # No such ion
+    assert len(adb.zion(99, 1)['wrest']) == 0
+
+def write_llist(path, wrest):
+    with open(path, 'w') as f:
+        f.write('wrest name\n')
+        for iw in wrest:
+            f.write('{:g} HI\n'.format(iw))
+
+def test_cached_llist(tmpdir, monkeypatch):
+    monkeypatch.setenv('XASTROPY_CACHE', str(tmpdir.join('cache')))
+    cdir = xxf.cache_dir('spec_lines')
+    # Two line lists with the same name
+    fil1 = str(tmpdir.mkdir('a').join('lines.lst'))
+    fil2 = str(tmpdir.mkdir('b').join('lines.lst'))
+    write_llist(fil1, [1215.67, 1025.72])
+    write_llist(fil2, [1548.195])
+    assert len(xsab.cached_llist(fil1, 2)) == 2
+    assert len(xsab.cached_llist(fil2, 2)) == 1
+    assert len(os.listdir(cdir)) == 2
+    # Cached (memory-mapped) read
+    data = xsab.cached_llist(fil1, 2)
+    np.testing.assert_allclose(data['wrest'], [1215.67, 1025.72])
+    # New source -> rebuilt; the stale file of fil1 is removed
+    write_llist(fil1, [972.537])
+    stat = os.stat(fil1)
+    os.utime(fil1, (stat.st_atime, stat.st_mtime+10.))
+    data = xsab.cached_llist(fil1, 2)
+    np.testing.assert_allclose(data['wrest'], [972.537])
+    assert len(os.listdir(cdir)) == 2
+    assert len(xsab.cached_llist(fil2, 2)) == 1
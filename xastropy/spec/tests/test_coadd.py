@@ -0,0 +1,54 @@
+# Module to run tests on coadding spectra
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import os, pdb
+import pytest
+from astropy import units as u
+
+from xastropy.spec import coadd as xsc
+
+
+def fake_spectra(nspec, rstate):
+    for ii in range(nspec):
+        wave = np.linspace(3990., 5010., 1800) + rstate.uniform(-0.2, 0.2)
+        sig = 0.1 * np.ones_like(wave)
+        flux = 1. + sig * rstate.normal(size=len(wave))
+        if ii % 50 == 10:  # Cosmic ray
+            flux[900] += 30.
+        yield wave, flux, sig
+
+def test_coadd_clip():
+    new_wv = np.linspace(4000., 5000., 2001)
+    scoadd = xsc.SpecCoadd(new_wv, clip=5., median=True)
+    scoadd.coadd(fake_spectra(200, np.random.RandomState(1)))
+    assert scoadd.nspec == 200
+    assert np.sum(scoadd.nclip) > 0
+    for mode in ['mean', 'median']:
+        flux, sig = scoadd.result(mode=mode)
+        assert np.abs(np.mean(flux) - 1.) < 1e-3
+        assert np.max(np.abs(flux - 1.)) < 0.05
+
+def test_coadd_grid():
+    # Spectra on the coadd grid: exact inverse-variance mean
+    wave = np.linspace(4000., 5000., 101)
+    scoadd = xsc.SpecCoadd(wave)
+    scoadd.add(wave, np.ones((2,101)) * np.array([[1.],[2.]]),
+               np.array([[1.],[2.]]) * np.ones((2,101)))
+    flux, sig = scoadd.result()
+    np.testing.assert_allclose(flux, (1. + 2./4) / (1. + 1./4))
+    np.testing.assert_allclose(sig, 1./np.sqrt(1.25))
+
+def test_coadd_edge():
+    # Second spectrum ends part-way into a coadd pixel (edge at 4005.7)
+    new_wv = np.arange(4000., 4010., 1.)
+    scoadd = xsc.SpecCoadd(new_wv)
+    scoadd.add(new_wv, np.ones(10), 0.1*np.ones(10))
+    wave = np.arange(3990.2, 4005.3, 1.)
+    scoadd.add(wave, np.ones(len(wave)), 0.1*np.ones(len(wave)))
+    flux, sig = scoadd.result()
+    np.testing.assert_allclose(flux, 1.)
+    # Only the fully covered pixels gain weight from the second spectrum
+    assert np.all(sig[new_wv <= 4005.] < 0.1)
+    np.testing.assert_allclose(sig[new_wv >= 4006.], 0.1)
@@ -0,0 +1,55 @@
+# Module to run tests on spectral collections
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import os, pdb
+import pytest
+
+from xastropy.spec import collection as xscoll
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_collection(tmpdir, compress):
+    rstate = np.random.RandomState(0)
+    spectra = []
+    for ii in range(25):
+        wave = np.linspace(4000., 5000., 100+ii)
+        spectra.append((wave, rstate.normal(size=len(wave)), np.ones(len(wave))))
+    meta = [dict(zem=float(ii)) for ii in range(25)]
+    scoll = xscoll.write_collection(str(tmpdir), spectra, meta=meta, nchunk=10,
+                                    compress=compress, dtype='float64')
+    assert len(scoll) == 25
+    assert scoll.index['zem'][7] == 7.
+    # Random access
+    wave, flux, sig = scoll.get_arrays(17)
+    np.testing.assert_allclose(flux, spectra[17][1])
+    # Wavelength range
+    wave, flux, sig = scoll.get_arrays('spec3', 4500., 4600.)
+    gdp = (spectra[3][0] >= 4500.) & (spectra[3][0] < 4600.)
+    np.testing.assert_allclose(flux, spectra[3][1][gdp])
+    # Bulk read
+    assert sum([len(rows) for rows, _, _, _ in scoll.iter_chunks()]) == 25
+
+def test_collection_many_chunks(tmpdir):
+    resource = pytest.importorskip('resource')
+    spectra = [(np.linspace(4000., 5000., 50), ii*np.ones(50), np.ones(50))
+               for ii in range(100)]
+    scoll = xscoll.write_collection(str(tmpdir), spectra, nchunk=1)
+    # More chunks (x3 files) than allowed open files
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(128, hard), hard))
+    try:
+        for rows, wave, flux, sig in scoll.iter_chunks():
+            assert flux[0,0] == rows['ROW'][0] + rows['CHUNK'][0]
+        for ii in range(100):
+            assert scoll.get_arrays(ii)[1][0] == ii
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    assert len(scoll._cache) <= xscoll.nmax_open
+
+def test_collection_overwrite(tmpdir):
+    wave = np.linspace(4000., 5000., 50)
+    xscoll.write_collection(str(tmpdir), [(wave, np.zeros(50), np.ones(50))], compress=True)
+    scoll = xscoll.write_collection(str(tmpdir), [(wave, 5*np.ones(50), np.ones(50))])
+    np.testing.assert_allclose(scoll.get_arrays(0)[1], 5.)
@@ -0,0 +1,95 @@
+# Module to run tests on the lazy spectrum reader
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import os, pdb
+import pytest
+from astropy import units as u
+from astropy.io import fits
+from astropy.table import Table
+
+from xastropy.spec import readwrite as xsr
+
+
+def test_lazy_table(tmpdir):
+    wave = np.linspace(3800., 9200., 4000)
+    rstate = np.random.RandomState(1)
+    flux = rstate.uniform(0., 1., 4000)
+    sig = rstate.uniform(0.1, 1., 4000)
+    tab = Table([wave[None,:], flux[None,:], (1./sig**2)[None,:]],
+                names=(str('WAVE'), str('FLUX'), str('IVAR')))
+    outfil = str(tmpdir.join('tab.fits'))
+    fits.HDUList([fits.PrimaryHDU(), fits.BinTableHDU(tab)]).writeto(outfil)
+    # Read a window
+    lspec = xsr.LazySpectrum(outfil)
+    assert lspec.layout['ivar']
+    i0, i1 = lspec.pix_range(5000.*u.AA, 5100.*u.AA)
+    gdp = np.where((wave >= 5000.) & (wave < 5100.))[0]
+    assert (i0, i1) == (gdp[0], gdp[-1]+1)
+    wv, fx, sg = lspec.read(i0, i1)
+    np.testing.assert_allclose(wv.value, wave[gdp])
+    np.testing.assert_allclose(sg, sig[gdp])
+    lspec.close()
+
+def test_lazy_wcs(tmpdir):
+    # Log-linear WCS with an error extension
+    npix = 4000
+    flux = np.ones(npix)
+    hdu = fits.PrimaryHDU(flux)
+    hdu.header['CRVAL1'] = np.log10(3800.)
+    hdu.header['CDELT1'] = 1e-4
+    hdu.header['CRPIX1'] = 1
+    outfil = str(tmpdir.join('img.fits'))
+    fits.HDUList([hdu, fits.ImageHDU(0.1*flux)]).writeto(outfil)
+    lspec = xsr.LazySpectrum(outfil)
+    wave = 10.**(np.log10(3800.) + 1e-4*np.arange(npix))
+    i0, i1 = lspec.pix_range(5000., 5100.)
+    gdp = np.where((wave >= 5000.) & (wave < 5100.))[0]
+    assert (i0, i1) == (gdp[0], gdp[-1]+1)
+    np.testing.assert_allclose(lspec.wave_pix(i0, i1).value, wave[gdp])
+    lspec.close()
+
+def write_tables(tmpdir, nfile, names=('WAVE', 'FLUX', 'IVAR')):
+    wave = np.linspace(3800., 9200., 500)
+    files = []
+    for ii in range(nfile):
+        tab = Table([wave[None,:], ii*np.ones((1,500)), np.ones((1,500))],
+                    names=tuple(str(name) for name in names))
+        outfil = str(tmpdir.join('tab{:d}_{:s}.fits'.format(ii, names[1])))
+        fits.HDUList([fits.PrimaryHDU(), fits.BinTableHDU(tab)]).writeto(outfil)
+        files.append(outfil)
+    return files
+
+def test_format_registry(tmpdir):
+    files = write_tables(tmpdir, 3)
+    registry = xsr.FormatRegistry()
+    for ii, specfil in enumerate(files):
+        lspec = xsr.LazySpectrum(specfil, registry=registry)
+        np.testing.assert_allclose(lspec.read()[1], ii)
+        lspec.close()
+    # One detection, reused for the same signature
+    assert (registry.nmiss, registry.nhit) == (1, 2)
+    # New columns -> new signature
+    lspec = xsr.LazySpectrum(write_tables(tmpdir, 1, names=('WAVE', 'FX', 'IVAR'))[0],
+                             registry=registry, flux_tags=['FX'])
+    lspec.close()
+    assert (registry.nmiss, len(registry.layouts)) == (2, 2)
+
+@pytest.mark.parametrize('use_threads', [False, True])
+def test_batch_readspec(tmpdir, use_threads):
+    files = write_tables(tmpdir, 7)
+    # Bad files
+    badfil = str(tmpdir.join('bad.fits'))
+    with open(badfil, 'w') as f:
+        f.write('not a FITS file')
+    files = files[:3] + [badfil] + files[3:] + [str(tmpdir.join('missing.fits'))]
+    spectra, errors = xsr.batch_readspec(files, nproc=3, use_threads=use_threads,
+                                         as_xspec=False, chunksize=2, wvmnx=(5000., 6000.))
+    assert len(spectra) == len(files)
+    assert spectra[3] is None and spectra[-1] is None
+    assert [item[0] for item in errors] == [badfil, files[-1]]
+    good = [spec for spec in spectra if spec is not None]
+    for ii, (wave, flux, sig) in enumerate(good):
+        assert wave[0] >= 5000. and wave[-1] < 6000.
+        np.testing.assert_allclose(flux, ii)
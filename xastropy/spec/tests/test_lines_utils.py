@@ -0,0 +1,96 @@
+# Module to run tests on absorption-line measurements
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import os, pdb
+import pytest
+from astropy import units as u
+from astropy.nddata import StdDevUncertainty
+
+from xastropy.spec import lines_utils as xslu
+from xastropy.spec.utils import XSpectrum1D
+
+
+def mk_spec(seed=1):
+    # CIV doublet at z=2; 1550 is saturated
+    rstate = np.random.RandomState(seed)
+    wave = np.exp(np.linspace(np.log(4000.), np.log(5000.), 20000))
+    flux = (1. - 0.9*np.exp(-0.5*((wave-4644.6)/0.3)**2)
+            - 0.999*np.exp(-0.5*((wave-4652.3)/0.3)**2))
+    sig = 0.02*np.ones(len(wave))
+    flux = flux + sig*rstate.normal(size=len(wave))
+    return XSpectrum1D.from_array(wave*u.AA, u.Quantity(flux),
+                                  uncertainty=StdDevUncertainty(sig))
+
+def mk_line(spec, wrest=1548.195*u.AA):
+    aline = xslu.AbsLine(wrest)
+    aline.analy['z'] = 2.
+    aline.analy['VLIM'] = [-100., 100.]*u.km/u.s
+    aline.analy['WVMNX'] = [4643., 4646.]*u.AA
+    aline.spec = spec
+    return aline
+
+def test_aodm_mc():
+    aline = mk_line(mk_spec())
+    N, sigN = aline.aodm()
+    N, sigN, N_mc = aline.aodm(nmc=2000, seed=1)
+    assert np.abs(N_mc[1]-N) < sigN
+    assert N_mc[0] < N_mc[1] < N_mc[2]
+    # Reproducible
+    np.testing.assert_allclose(aline.aodm(nmc=2000, seed=1)[2].value, N_mc.value)
+    np.testing.assert_allclose(aline.attrib['N_mc'].value, N_mc.value)
+
+def test_ew_mc():
+    aline = mk_line(mk_spec())
+    EW, sigEW, EW_mc = aline.ew(nmc=2000, seed=2)
+    assert np.abs(EW_mc[1]-EW) < sigEW
+    np.testing.assert_allclose(aline.ew(nmc=2000, seed=2)[2].value, EW_mc.value)
+    # Rest frame
+    rEW, rsigEW, rEW_mc = aline.restew(nmc=2000, seed=2)
+    np.testing.assert_allclose(rEW_mc.value, EW_mc.value/3.)
+    np.testing.assert_allclose(rEW.value, EW.value/3.)
+
+def test_arrays():
+    # Realizations along the last axis, one row per realization
+    fx = np.array([[0.5, 0.2, 0.01], [0.9, 0.8, 0.7]])
+    sig = np.array([0.02, 0.02, 0.02])
+    N, sigN, nsat = xslu.aodm_arrays(np.ones(3), fx, sig, 1.)
+    np.testing.assert_allclose(N, [np.log(2.)+np.log(5.)+np.log(20.), -np.log(0.9*0.8*0.7)])
+    np.testing.assert_array_equal(nsat, [1, 0])
+    EW, sigEW = xslu.ew_arrays(np.ones(3), fx, sig)
+    np.testing.assert_allclose(EW, [2.29, 0.6])
+    np.testing.assert_allclose(sigEW, np.sqrt(3)*0.02)
+    # Realizations
+    fx_mc = xslu.mc_realizations(fx[1], sig, 5, seed=4)
+    assert fx_mc.shape == (5, 3)
+    np.testing.assert_allclose(fx_mc, xslu.mc_realizations(fx[1], sig, 5, seed=4))
+
+@pytest.mark.parametrize('rest', [False, True])
+def test_batch_measure(rest):
+    spec, spec2 = mk_spec(1), mk_spec(2)
+    conti = 1. + 0.01*np.sin(np.arange(len(spec.flux))/500.)
+    lines = [mk_line(spec), mk_line(spec, 1550.77*u.AA), mk_line(spec2)]
+    lines[1].analy['WVMNX'] = [4651., 4654.]*u.AA
+    reqs = [dict(spec=spec, zabs=2., wrest=1548.195*u.AA, vlim=[-100., 100.]*u.km/u.s,
+                 wvmnx=[4643., 4646.]*u.AA, conti=conti),
+            dict(spec=spec, zabs=2., wrest=1550.77*u.AA, vlim=[-100., 100.]*u.km/u.s,
+                 wvmnx=[4651., 4654.]*u.AA, conti=conti),
+            (spec2, 2., 1548.195*u.AA, [-100., 100.]*u.km/u.s, [4643., 4646.]*u.AA)]
+    tab = xslu.batch_measure(reqs, rest=rest)
+    assert len(tab) == 3
+    assert tab['flg_sat'][1] > 0   # Saturated pixels
+    for ii, aline in enumerate(lines):
+        kwargs = dict(conti=conti) if ii < 2 else {}
+        N, sigN = aline.aodm(**kwargs)
+        if rest:
+            EW, sigEW = aline.restew(**kwargs)
+        else:
+            EW, sigEW = aline.ew(**kwargs)
+        np.testing.assert_allclose(tab['N'][ii], N.value, rtol=1e-10)
+        np.testing.assert_allclose(tab['sigN'][ii], sigN.value, rtol=1e-10)
+        np.testing.assert_allclose(tab['EW'][ii], EW.value, rtol=1e-10)
+        np.testing.assert_allclose(tab['sigEW'][ii], sigEW.value, rtol=1e-10)
+    # Default EW window is vlim
+    tab2 = xslu.batch_measure([reqs[2][:4]])
+    assert tab2['EW'][0] > 0.
@@ -0,0 +1,41 @@
+# Module to run tests on rebinning spectra
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import os, pdb
+import pytest
+from astropy import units as u
+
+from xastropy.spec import utils as xsu
+
+
+def overlap_matrix(wave, new_wv):
+    # Brute-force fractional overlap of old pixels with new pixels
+    edges = xsu.pix_edges(wave)
+    nedges = xsu.pix_edges(new_wv)
+    lo = np.maximum(edges[None,:-1], nedges[:-1,None])
+    hi = np.minimum(edges[None,1:], nedges[1:,None])
+    return np.clip(hi-lo, 0., None) / (nedges[1:]-nedges[:-1])[:,None]
+
+def test_rebin_arrays():
+    rstate = np.random.RandomState(1)
+    wave = 1000. + np.cumsum(rstate.uniform(0.5, 1.5, 200))
+    flux = rstate.normal(1., 0.1, (5,200))
+    var = rstate.uniform(0.01, 0.04, (5,200))
+    # Extends beyond the original grid
+    new_wv = np.linspace(900., 1400., 300)
+    new_fx, new_var = xsu.rebin_arrays(wave, flux, new_wv, var=var)
+    wmat = overlap_matrix(wave, new_wv)
+    np.testing.assert_allclose(new_fx, np.dot(flux, wmat.T), atol=1e-12)
+    np.testing.assert_allclose(new_var, np.dot(var, (wmat**2).T), atol=1e-14)
+    # 1D
+    fx1, var1 = xsu.rebin_arrays(wave, flux[2], new_wv, var=var[2])
+    np.testing.assert_allclose(fx1, new_fx[2])
+    # Fractional coverage
+    cover = xsu.rebin_arrays(wave, flux[2], new_wv, coverage=True)[2]
+    np.testing.assert_allclose(cover, wmat.sum(axis=1), atol=1e-12)
+    # Batch with chunks
+    bfx, bvar = xsu.batch_rebin(flux, new_wv, wave=wave, var=var, nchunk=2)
+    np.testing.assert_allclose(bfx, new_fx)
+    np.testing.assert_allclose(bvar, new_var)
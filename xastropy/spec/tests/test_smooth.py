@@ -0,0 +1,35 @@
+# Module to run tests on smoothing spectra
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import os, pdb
+import pytest
+
+from xastropy.spec import smooth as xsm
+
+
+def test_box_kernel():
+    # Matches astropy Box1DKernel
+    np.testing.assert_allclose(xsm.box_kernel(4), [0.125, 0.25, 0.25, 0.25, 0.125])
+    np.testing.assert_allclose(xsm.box_kernel(3), np.ones(3)/3.)
+
+def test_convolve_methods():
+    rstate = np.random.RandomState(0)
+    flux = rstate.normal(size=(3, 5000))
+    sflux = xsm.convolve_lsf(flux, ('gauss', 6.), method='fft')
+    for method in ['direct', 'oa']:
+        np.testing.assert_allclose(xsm.convolve_lsf(flux, ('gauss', 6.), method=method),
+                                   sflux, atol=1e-12)
+    # Per-pixel FWHM reduces to the constant kernel
+    np.testing.assert_allclose(xsm.convolve_lsf(flux, ('gauss', 6.*np.ones(5000))),
+                               sflux, atol=1e-12)
+
+def test_constant_R():
+    # Flat spectrum is preserved; a line is broadened more at larger wavelength
+    wave = np.linspace(4000., 6000., 4001)
+    flux = np.ones_like(wave)
+    np.testing.assert_allclose(xsm.convolve_lsf(flux, ('R', 2000.), wave=wave), 1.)
+    flux[[1000, 3000]] = 0.
+    sflux = xsm.convolve_lsf(flux, ('R', 2000.), wave=wave)
+    assert sflux[3000] > sflux[1000]
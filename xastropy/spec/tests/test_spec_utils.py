@@ -0,0 +1,85 @@
+# Module to run tests on the XSpectrum1D pixel lookups
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import os, pdb
+import pytest
+from astropy import units as u
+
+from xastropy.spec.utils import XSpectrum1D
+
+
+def mk_spec(npix=3000, seed=1):
+    # Non-uniform grid
+    rstate = np.random.RandomState(seed)
+    wave = 4000. + np.cumsum(rstate.uniform(0.05, 1.5, npix))
+    return XSpectrum1D.from_array(wave*u.AA, u.Quantity(np.ones(npix)))
+
+def test_nearest_pix():
+    spec = mk_spec()
+    wave = spec.dispersion.value
+    rstate = np.random.RandomState(2)
+    # Includes values off both ends
+    wv = rstate.uniform(wave[0]-50., wave[-1]+50., 500)
+    pix = spec.nearest_pix(wv*u.AA)
+    np.testing.assert_array_equal(pix, np.argmin(np.abs(wave[None,:]-wv[:,None]), axis=1))
+    assert spec.nearest_pix(wave[0]-10.) == 0
+    assert spec.nearest_pix(wave[-1]+10.) == len(wave)-1
+    # Other units
+    assert spec.nearest_pix(wave[100]*u.AA.to(u.nm)*u.nm) == 100
+
+def test_pix_windows():
+    spec = mk_spec()
+    wave = spec.dispersion.value
+    zabs = np.array([2., 2.1, 2.2])
+    wrest = 1548.195*u.AA
+    vmin, vmax = [-300., -100., -50.]*u.km/u.s, [300., 50., 500.]*u.km/u.s
+    pixmnx, velo = spec.pix_windows(zabs, wrest, vmin, vmax)
+    ckms = 299792.458
+    for ii, z in enumerate(zabs):
+        wobs = (1+z)*wrest.value
+        wvmn, wvmx = wobs*(1+vmin[ii].value/ckms), wobs*(1+vmax[ii].value/ckms)
+        pmn = np.argmin(np.abs(wave-wvmn))
+        pmx = np.argmin(np.abs(wave-wvmx))
+        assert tuple(pixmnx[ii]) == (pmn, pmx)
+        gdp = np.where((np.arange(len(wave)) >= pmn) & (np.arange(len(wave)) <= pmx))[0]
+        np.testing.assert_allclose(velo[ii].value, (wave[gdp]-wobs)/wobs*ckms)
+        # relative_vel for a subset of pixels
+        np.testing.assert_allclose(spec.relative_vel(wobs*u.AA, pix=gdp).value,
+                                   spec.relative_vel(wobs*u.AA)[gdp].value)
+
+def test_pix_index_cache():
+    spec = mk_spec()
+    pindex = spec.pix_index()
+    assert spec.pix_index() is pindex
+    # New WCS
+    wave = spec.dispersion.value + 100.
+    spec.wcs = XSpectrum1D.from_array(wave*u.AA, spec.flux).wcs
+    assert spec.pix_index() is not pindex
+    assert spec.nearest_pix(wave[10]) == 10
+    # Edited in place: the ends are part of the key
+    pindex = spec.pix_index()
+    spec.wcs.lookup_table[-1] += 1.
+    assert spec.pix_index() is not pindex
+    # Interior edits need an explicit invalidation
+    pindex = spec.pix_index()
+    spec.wcs.lookup_table[1:-1] = np.linspace(wave[0], wave[-1], len(wave))[1:-1]
+    assert spec.pix_index() is pindex
+    spec.invalidate_pix_index()
+    np.testing.assert_allclose(spec.pix_index()['wave'][1:-1], spec.wcs.lookup_table[1:-1])
+
+def test_box_smooth_edges():
+    from astropy.convolution import convolve, Box1DKernel
+    from astropy.nddata import StdDevUncertainty
+    rstate = np.random.RandomState(3)
+    wave = np.linspace(4000., 5000., 200)
+    flux, sig = rstate.uniform(0.5, 1.5, 200), rstate.uniform(0.1, 0.2, 200)
+    spec = XSpectrum1D.from_array(wave*u.AA, u.Quantity(flux),
+                                  uncertainty=StdDevUncertainty(sig))
+    for nbox in [4, 5]:
+        sspec = spec.box_smooth(nbox, preserve=True)
+        np.testing.assert_allclose(np.asarray(sspec.flux),
+            convolve(flux, Box1DKernel(nbox), boundary='fill'), atol=1e-12)
+        np.testing.assert_allclose(sspec.sig,
+            convolve(sig, Box1DKernel(nbox), boundary='fill'), atol=1e-12)
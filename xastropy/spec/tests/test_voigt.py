@@ -0,0 +1,76 @@
+# Module to run tests on Voigt profiles
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import os, pdb
+import pytest
+from astropy import units as u
+
+from xastropy.spec import voigt as xsv
+
+
+def test_voigtking_array_a():
+    # One damping parameter per row
+    uval = np.linspace(-20., 20., 401)
+    avals = np.array([1e-4, 1e-2])
+    H2 = xsv.voigtking(np.outer(np.ones(2), uval), avals[:,None])
+    for ii, aval in enumerate(avals):
+        np.testing.assert_allclose(H2[ii], xsv.voigtking(uval, aval))
+    # Input is not modified
+    assert np.min(uval) < 0.
+
+def test_voigt_tau_center():
+    # Lya; tau0 = 1.497e-15 N f lambda / b
+    wave = np.linspace(1270., 1280., 20001)
+    tau = xsv.voigt_tau(wave, 13., 0.05, 20., 1215.6701, 0.4164, 6.265e8)
+    np.testing.assert_allclose(np.max(tau), 1.497e-15*1e13*0.4164*1215.6701/20., rtol=1e-3)
+
+def test_voigt_tau_batch():
+    # Batched lines match the sum of single lines
+    wave = np.linspace(1270., 1280., 5000)
+    NHI = np.array([12.5, 13.0, 14.2])
+    zabs = np.array([0.046, 0.05, 0.051])
+    tau = xsv.voigt_tau(wave, NHI, zabs, 25., 1215.6701*u.AA, 0.4164, 6.265e8, nmax_pix=6000)
+    tau1 = np.zeros(wave.size)
+    for iN, iz in zip(NHI, zabs):
+        tau1 += xsv.voigt_tau(wave, iN, iz, 25., 1215.6701, 0.4164, 6.265e8)
+    np.testing.assert_allclose(tau, tau1)
+
+def test_voigt_backends():
+    # Humlicek and King against the Faddeeva function
+    uval = np.linspace(-30., 30., 3001)
+    for aval in [1e-4, 1e-2, 0.5]:
+        ref = xsv.voigt_function(uval, aval, method='wofz')
+        H = xsv.voigt_function(uval, aval, method='humlicek')
+        assert np.max(np.fabs(H-ref)/ref) < 1e-3
+    H = xsv.voigt_function(uval, 1e-3, method='king')
+    ref = xsv.voigt_wofz(uval, 1e-3)
+    assert np.max(np.fabs(H-ref)/ref) < 1e-2
+    with pytest.raises(ValueError):
+        xsv.voigt_function(uval, 1e-3, method='bogus')
+
+def test_voigt_tau_window():
+    # Windowed evaluation matches the full calculation
+    wave = np.linspace(3000., 3400., 40000)
+    NHI = np.array([13.0, 14.5, 19.5])
+    zabs = np.array([1.5, 1.6, 1.7])
+    bval = np.array([5., 25., 30.])
+    tau = xsv.voigt_tau(wave, NHI, zabs, bval, 1215.6701, 0.4164, 6.265e8)
+    tau_win = xsv.voigt_tau(wave, NHI, zabs, bval, 1215.6701, 0.4164, 6.265e8,
+                            tau_min=1e-6)
+    np.testing.assert_allclose(tau_win, tau, atol=1e-5)
+
+def test_voigt_oversample():
+    # Narrow line on 10 km/s pixels against a brute-force sub-sampling
+    wave = np.exp(np.arange(np.log(1266.), np.log(1268.), 10./3e5))
+    par = (13.5, 0.05, 2., 1206.5, 1.669, 2.5e9)
+    flux, nsub = xsv.voigt_flux_oversample(wave, *par)
+    assert np.max(nsub) > 1
+    edges = np.zeros(wave.size+1)
+    edges[1:-1] = 0.5*(wave[1:]+wave[:-1])
+    edges[0] = wave[0] - (edges[1]-wave[0])
+    edges[-1] = wave[-1] + (wave[-1]-edges[-2])
+    fine = edges[:-1,None] + (np.arange(200)+0.5)[None,:]/200. * np.diff(edges)[:,None]
+    tau = xsv.voigt_tau(fine.flatten(), *par).reshape(fine.shape)
+    np.testing.assert_allclose(flux, np.mean(np.exp(-tau), 1), atol=1e-4)
@@ -0,0 +1,43 @@
+# Module to run tests on Voigt profile fitting
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import os, pdb
+import pytest
+
+from xastropy.spec.voigt_fit import VoigtFit
+
+def mk_fit():
+    # Two SiII components in two windows
+    ckms = 299792.458
+    zabs = 2.5
+    vfit = VoigtFit()
+    iion = vfit.add_ion('SiII', [1260.4221, 1526.7070], [1.18, 0.133], [2.95e9, 1.13e9])
+    for wrest in vfit.ions[iion]['wrest']:
+        wave = wrest*(1+zabs) * (1 + np.arange(-150., 200., 2.)/ckms)
+        vfit.add_window(wave, np.ones(len(wave)), 0.02*np.ones(len(wave)), lsf=3.)
+    vfit.add_component(iion, 13.2, zabs, 8.)
+    vfit.add_component(iion, 12.8, zabs+40./ckms*(1+zabs), 15.)
+    return vfit
+
+def test_jacobian():
+    vfit = mk_fit()
+    param = vfit.param()
+    resid, jac = vfit.residuals(param, jac=True)
+    for ii in range(len(param)):
+        dp = np.zeros(len(param))
+        dp[ii] = 1e-8 if (ii % 3) == 1 else 1e-5
+        num = (vfit.residuals(param+dp) - vfit.residuals(param-dp)) / (2*dp[ii])
+        np.testing.assert_allclose(jac[:,ii], num, rtol=1e-4, atol=1e-3*np.max(np.fabs(num)))
+
+def test_fit():
+    vfit = mk_fit()
+    truth = vfit.param()
+    for win in vfit.windows:
+        win['flux'] = vfit.window_model(win, truth)
+    # Perturb and fit
+    vfit.comps[0]['logN'] = 13.6
+    vfit.comps[1]['b'] = 25.
+    vfit.fit()
+    np.testing.assert_allclose(vfit.param(), truth, rtol=1e-4)
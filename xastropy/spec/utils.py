@@ -101,9 +101,8 @@ class XSpectrum1D(Spectrum1D):
             wvmnx = (args[0]+1) * (args[1] + (args[1] * args[2] / const.c.to('km/s')) )
             wvmnx.to(u.AA)
 
-        # Locate the values
-        pixmin = np.argmin( np.fabs( self.dispersion-wvmnx[0] ) )
-        pixmax = np.argmin( np.fabs( self.dispersion-wvmnx[1] ) )
+        # Locate the values (nearest pixels)
+        pixmin, pixmax = self.nearest_pix(wvmnx)
 
         gdpix = np.arange(pixmin,pixmax+1)
 
@@ -111,6 +110,100 @@ class XSpectrum1D(Spectrum1D):
         self.sub_pix = gdpix
         return gdpix, wvmnx, (pixmin, pixmax)
 
+    #### ###############################
+    #  Cached index of the dispersion
+    def pix_index(self):
+        """ Cached raw wavelengths and pixel midpoints for searchsorted
+        Keyed on the WCS object, the number of pixels and the end
+        wavelengths, so it is rebuilt when the WCS is replaced.
+        Call invalidate_pix_index() after editing the WCS in place.
+
+        Returns
+        -------
+        pindex: dict
+          'wave': float array of the dispersion
+          'mid': float array of the midpoints between pixels
+          'unit': Unit of the dispersion
+        """
+        npix = len(self.flux)
+        ends = self.wcs(np.array([0, npix-1]))
+        key = (id(self.wcs), npix, tuple(np.atleast_1d(getattr(ends, 'value', ends))),
+               str(getattr(ends, 'unit', None)))
+        pindex = getattr(self, '_pix_index', None)
+        if (pindex is None) or (pindex['key'] != key):
+            disp = self.dispersion
+            wave = np.ascontiguousarray(getattr(disp, 'value', disp), dtype=np.float64)
+            if (len(wave) > 1) and (wave[-1] < wave[0]):
+                raise ValueError('pix_index: Dispersion must be increasing')
+            pindex = dict(key=key, wave=wave, mid=0.5*(wave[1:]+wave[:-1]),
+                          unit=getattr(disp, 'unit', None))
+            self._pix_index = pindex
+        return pindex
+
+    def invalidate_pix_index(self):
+        """ Drop the cached index (e.g. after editing the WCS in place)
+        """
+        self._pix_index = None
+
+    def nearest_pix(self, wv):
+        """ Pixel(s) nearest to the input wavelength(s)
+        Same as argmin(|dispersion-wv|), with a binary search per value
+
+        Parameters
+        ----------
+        wv: Quantity or float or array
+
+        Returns
+        -------
+        pix: int or int array
+        """
+        pindex = self.pix_index()
+        wv = u.Quantity(wv)  # Also handles tuples of Quantity
+        if (wv.unit != u.dimensionless_unscaled) and (pindex['unit'] is not None):
+            wv = wv.to(pindex['unit'])
+        return np.searchsorted(pindex['mid'], wv.value)
+
+    def pix_windows(self, zabs, wrest, vmin, vmax):
+        """ Pixels and velocities for many windows in one call
+
+        Parameters
+        ----------
+        zabs: float or array
+          Absorption redshifts
+        wrest: Quantity or float array
+          Rest wavelengths (units of the dispersion for floats)
+        vmin, vmax: Quantity or float arrays
+          Velocity limits (km/s for floats)
+
+        Returns
+        -------
+        pixmnx: int array [nwin, 2]
+          Nearest pixels to the window edges (inclusive)
+        velo: list of Quantity arrays (km/s)
+          Velocities of the pixels relative to (1+zabs)*wrest
+        """
+        pindex = self.pix_index()
+        ckms = const.c.to('km/s').value
+        wrest = u.Quantity(wrest)
+        if (wrest.unit != u.dimensionless_unscaled) and (pindex['unit'] is not None):
+            wrest = wrest.to(pindex['unit'])
+        wrest = wrest.value
+        vmin = u.Quantity(vmin, u.km/u.s).value
+        vmax = u.Quantity(vmax, u.km/u.s).value
+        zabs, wrest, vmin, vmax = np.broadcast_arrays(np.atleast_1d(zabs),
+            np.atleast_1d(wrest), np.atleast_1d(vmin), np.atleast_1d(vmax))
+
+        # Window edges
+        wobs = (1+zabs) * wrest
+        pixmnx = np.zeros((len(wobs), 2), dtype=int)
+        pixmnx[:,0] = self.nearest_pix(wobs * (1+vmin/ckms))
+        pixmnx[:,1] = self.nearest_pix(wobs * (1+vmax/ckms))
+
+        # Velocity sub-arrays
+        velo = [((pindex['wave'][pmn:pmx+1]-wv)/wv*ckms)*u.km/u.s
+                for pmn, pmx, wv in zip(pixmnx[:,0], pixmnx[:,1], wobs)]
+        return pixmnx, velo
+
     #### ###############################
     #  Box car smooth
     def box_smooth(self, nbox, preserve=False):
@@ -128,9 +221,10 @@ class XSpectrum1D(Spectrum1D):
         """
         from xastropy.xutils import arrays as xxa
         if preserve:
-            from astropy.convolution import convolve, Box1DKernel
-            new_fx = convolve(self.flux, Box1DKernel(nbox))
-            new_sig = convolve(self.sig, Box1DKernel(nbox))
+            from xastropy.spec import smooth as xsm
+            # Zero fill beyond the ends, as astropy convolve
+            new_fx = xsm.convolve_lsf(np.asarray(self.flux), ('box', nbox), boundary='fill')
+            new_sig = xsm.convolve_lsf(np.asarray(self.sig), ('box', nbox), boundary='fill')
             new_wv = self.dispersion
         else:
             # Truncate arrays as need be
@@ -155,7 +249,8 @@ class XSpectrum1D(Spectrum1D):
     def rebin(self, new_wv):
         """ Rebin the existing spectrum to a new wavelength array
         Uses simple linear interpolation.  The default (and only) option 
-        conserves counts (and flambda).
+        conserves counts (and flambda).  The error array (if any) is
+        propagated.
         
         WARNING: Do not trust either edge pixel of the new array
 
@@ -168,46 +263,29 @@ class XSpectrum1D(Spectrum1D):
         ----------
           XSpectrum1D of the rebinned spectrum
         """
-        from scipy.interpolate import interp1d
-
-        # Endpoints of original pixels
-        npix = len(self.dispersion)
-        wvh = (self.dispersion + np.roll(self.dispersion, -1))/2.
-        wvh[npix-1] = self.dispersion[npix-1] + (self.dispersion[npix-1] - self.dispersion[npix-2])/2.
-        dwv = wvh - np.roll(wvh,1)
-        dwv[0] = 2*(wvh[0]-self.dispersion[0])
-
-        # Cumulative Sum
-        cumsum = np.cumsum(self.flux * dwv)
-
-        # Interpolate
-        fcum = interp1d(wvh, cumsum, fill_value=0., bounds_error=False)
-
-        # Endpoints of new pixels
-        nnew = len(new_wv)
-        nwvh = (new_wv + np.roll(new_wv, -1))/2.
-        nwvh[nnew-1] = new_wv[nnew-1] + (new_wv[nnew-1] - new_wv[nnew-2])/2.
-        # Pad starting point
-        bwv = np.zeros(nnew+1) * new_wv.unit
-        #xdb.set_trace()
-        bwv[0] = new_wv[0] - (new_wv[1] - new_wv[0])/2.
-        bwv[1:] = nwvh
-
-        # Evaluate
-        newcum = fcum(bwv)
-        # Endpoint
-        if (bwv[-1] > wvh[-1]):
-            newcum[-1] = cumsum[-1]
-
-        # Rebinned flux
-        new_fx = (np.roll(newcum,-1)-newcum)[:-1]
-
-        # Normalize (preserve counts and flambda)
-        new_dwv = bwv - np.roll(bwv,1)
-        new_fx = new_fx / new_dwv[1:]
+        # Raw arrays in the units of the dispersion
+        wv_unit = self.dispersion.unit
+        wave = self.dispersion.value
+        if wv_unit is not None:
+            new_val = u.Quantity(new_wv).to(wv_unit).value
+        else:
+            new_val = np.asarray(new_wv)
+
+        # Variance
+        if self.sig is not None:
+            var = np.asarray(self.sig)**2
+        else:
+            var = None
+
+        # Rebin
+        new_fx, new_var = rebin_arrays(wave, np.asarray(self.flux), new_val, var=var)
 
         # Return new spectrum
-        return XSpectrum1D.from_array(new_wv, new_fx)
+        if new_var is None:
+            return XSpectrum1D.from_array(new_wv, new_fx)
+        else:
+            return XSpectrum1D.from_array(new_wv, new_fx,
+                    uncertainty=apy.nddata.StdDevUncertainty(np.sqrt(new_var)))
 
     # Quick plot
     def plot(self):
@@ -221,7 +299,7 @@ class XSpectrum1D(Spectrum1D):
             xdb.xplot(self.dispersion, self.flux)
 
     # Velo array
-    def relative_vel(self, wv_obs):
+    def relative_vel(self, wv_obs, pix=None):
         ''' Return a velocity array relative to an input wavelength
         Should consider adding a velocity array to this Class, 
         i.e. self.velo
@@ -231,12 +309,20 @@ class XSpectrum1D(Spectrum1D):
         wv_obs : float
           Wavelength to set the zero of the velocity array.
           Often (1+z)*wrest
+        pix : int array (None)
+          Only return the velocities of these pixels
 
         Returns:
         ---------
         velo: Quantity array (km/s)
         '''
-        return  (self.dispersion-wv_obs) * const.c.to('km/s')/wv_obs
+        if pix is None:
+            return  (self.dispersion-wv_obs) * const.c.to('km/s')/wv_obs
+        pindex = self.pix_index()
+        wave = pindex['wave'][pix]
+        if pindex['unit'] is not None:
+            wave = wave * pindex['unit']
+        return  (wave-wv_obs) * const.c.to('km/s')/wv_obs
 
     # Write to fits
     def write_to_fits(self, outfil, clobber=True, add_wave=False):
@@ -314,19 +400,214 @@ class XSpectrum1D(Spectrum1D):
         print('Wrote spectrum to {:s}'.format(outfil))
 
 
+#### ###############################
+#  Pixel edges
+def pix_edges(wave):
+    """ Edges of the pixels of a wavelength array (midpoints between pixels)
+
+    Parameters
+    ----------
+    wave: float array
+      Wavelengths [npix] or [nspec, npix]; increasing
+
+    Returns
+    -------
+    edges: float array
+      [npix+1] or [nspec, npix+1]
+    """
+    wave = np.asarray(wave, dtype=np.float64)
+    edges = np.zeros(wave.shape[:-1] + (wave.shape[-1]+1,))
+    edges[...,1:-1] = 0.5*(wave[...,1:] + wave[...,:-1])
+    edges[...,0] = wave[...,0] - (edges[...,1]-wave[...,0])
+    edges[...,-1] = wave[...,-1] + (wave[...,-1]-edges[...,-2])
+    return edges
+
+#### ###############################
+#  Flux-conserving rebin of raw arrays
+def rebin_arrays(wave, flux, new_wv, var=None, coverage=False):
+    """ Rebin one or more spectra on a common grid to a new grid
+    Conserves counts (and flambda) by interpolating the cumulative sum,
+    as in XSpectrum1D.rebin.  The variance is propagated exactly using
+    the overlap of each old pixel with each new pixel.
+    New pixels outside the old grid have zero flux and variance.
+
+    Parameters
+    ----------
+    wave: float array
+      Wavelengths [npix] (increasing)
+    flux: float array
+      Flux [npix] or [nspec, npix]
+    new_wv: float array
+      New wavelengths [nnew] (increasing, same units as wave)
+    var: float array (None)
+      Variance with the shape of flux
+    coverage: bool (False)
+      Also return the fraction of each new pixel covered by the old grid
+
+    Returns
+    -------
+    new_fx, new_var: float arrays
+      [nnew] or [nspec, nnew]; new_var is None if var is None
+    cover: float array
+      [nnew], only if coverage=True
+    """
+    flux = np.asarray(flux, dtype=np.float64)
+    flg_1D = (flux.ndim == 1)
+    flux = np.atleast_2d(flux)
+    npix = flux.shape[1]
+
+    # Old pixels
+    edges = pix_edges(wave)
+    dwv = edges[1:] - edges[:-1]
+
+    # New pixels (clipped to the old grid)
+    nedges = pix_edges(new_wv)
+    new_dwv = nedges[1:] - nedges[:-1]
+    cedges = np.minimum(np.maximum(nedges, edges[0]), edges[-1])
+    ipix = np.minimum(np.searchsorted(edges, cedges, side='right') - 1, npix-1)
+    frac = cedges - edges[ipix]  # Offset into the old pixel containing each new edge
+
+    # Cumulative counts at each new edge
+    cum = np.zeros((flux.shape[0], npix+1))
+    cum[:,1:] = np.cumsum(flux * dwv, axis=1)
+    ncum = cum[:,ipix] + frac * flux[:,ipix]
+    new_fx = (ncum[:,1:] - ncum[:,:-1]) / new_dwv
+
+    # Variance: sum over old pixels of (overlap * sig)^2
+    new_var = None
+    if var is not None:
+        var = np.atleast_2d(np.asarray(var, dtype=np.float64))
+        iL, iR = ipix[:-1], ipix[1:]
+        wL = np.where(iL == iR, cedges[1:]-cedges[:-1], edges[iL+1]-cedges[:-1])
+        wR = np.where(iL == iR, 0., cedges[1:]-edges[iR])
+        cum2 = np.zeros((var.shape[0], npix+1))
+        cum2[:,1:] = np.cumsum(var * dwv**2, axis=1)
+        inner = np.where(iR > iL+1, cum2[:,iR] - cum2[:,np.minimum(iL+1, iR)], 0.)
+        new_var = (wL**2 * var[:,iL] + wR**2 * var[:,iR] + inner) / new_dwv**2
+
+    if flg_1D:
+        new_fx = new_fx[0]
+        if new_var is not None:
+            new_var = new_var[0]
+    if coverage:
+        return new_fx, new_var, (cedges[1:]-cedges[:-1]) / new_dwv
+    return new_fx, new_var
+
+#### ###############################
+#  Rebin many spectra
+def iter_rebin(spectra, new_wv, wave=None, var=None, nchunk=1024):
+    """ Rebin a set of spectra to a common grid, one chunk at a time
+    Keeps the memory bounded by the chunk size
+
+    Parameters
+    ----------
+    spectra: 2D float array or list
+      Flux stack [nspec, npix] on the grid wave, or a list of
+      XSpectrum1D or (wave, flux, sig) tuples with their own grids
+    new_wv: float array or Quantity
+      New wavelengths
+    wave: float array (None)
+      Wavelengths of the flux stack [npix] or [nspec, npix]
+    var: 2D float array (None)
+      Variance of the flux stack
+    nchunk: int (1024)
+      Number of spectra per chunk
+
+    Returns
+    -------
+    Generator of (i0, new_fx, new_var) with i0 the index of the first
+    spectrum of the chunk
+    """
+    if isinstance(spectra, np.ndarray):
+        if wave is None:
+            raise ValueError('iter_rebin: Need wave for a flux stack')
+        new_val = u.Quantity(new_wv).value
+        wave = u.Quantity(wave).value
+        nspec = spectra.shape[0]
+        for i0 in range(0, nspec, nchunk):
+            chunk = slice(i0, min(i0+nchunk, nspec))
+            cvar = None if var is None else var[chunk]
+            if wave.ndim == 1:  # Common grid
+                new_fx, new_var = rebin_arrays(wave, spectra[chunk], new_val, var=cvar)
+            else:
+                rslt = [rebin_arrays(wave[ii], spectra[ii], new_val,
+                                     var=(None if var is None else var[ii]))
+                        for ii in range(chunk.start, chunk.stop)]
+                new_fx = np.array([item[0] for item in rslt])
+                new_var = None if var is None else np.array([item[1] for item in rslt])
+            yield i0, new_fx, new_var
+    else:
+        nspec = len(spectra)
+        for i0 in range(0, nspec, nchunk):
+            new_fx, new_var = [], []
+            for spec in spectra[i0:i0+nchunk]:
+                if isinstance(spec, tuple):
+                    swv, sfx, ssig = spec
+                else:
+                    swv, sfx, ssig = spec.dispersion, spec.flux, spec.sig
+                if isinstance(swv, u.Quantity):
+                    new_val = u.Quantity(new_wv).to(swv.unit).value
+                    swv = swv.value
+                else:
+                    new_val = u.Quantity(new_wv).value
+                svar = None if ssig is None else np.asarray(ssig)**2
+                fx, vr = rebin_arrays(swv, np.asarray(sfx), new_val, var=svar)
+                new_fx.append(fx)
+                new_var.append(np.zeros(len(fx)) if vr is None else vr)
+            yield i0, np.array(new_fx), np.array(new_var)
+
+def batch_rebin(spectra, new_wv, wave=None, var=None, nchunk=1024):
+    """ Rebin a set of spectra to a common grid and stack the result
+    See iter_rebin for the parameters
+
+    Returns
+    -------
+    new_fx, new_var: 2D float arrays
+      [nspec, nnew]; new_var is None for a flux stack without var
+    """
+    nspec = len(spectra)
+    new_fx = np.zeros((nspec, len(new_wv)))
+    new_var = None
+    for i0, fx, vr in iter_rebin(spectra, new_wv, wave=wave, var=var, nchunk=nchunk):
+        new_fx[i0:i0+fx.shape[0]] = fx
+        if vr is not None:
+            if new_var is None:
+                new_var = np.zeros((nspec, len(new_wv)))
+            new_var[i0:i0+fx.shape[0]] = vr
+    return new_fx, new_var
+
 # Quick plot
-def bspline_stack(spectra):
-    ''' "Stack" a set of spectra with a bspline algorithm
-    Might be useful for coadding
+def bspline_stack(spectra, new_wv=None, mode='mean', **kwargs):
+    ''' "Stack" a set of spectra
+    Might be useful for coadding.  There is no bspline fit (yet); the
+    spectra are combined with the streaming coadder in spec.coadd,
+    which keeps only one spectrum in memory at a time.
 
     Parameters:
     -----------
-    spectra: List of Spectrum1D
+    spectra: iterator of XSpectrum1D (or (wave, flux, sig) tuples)
+    new_wv: Quantity array (None)
+      Wavelength grid; defaults to that of the first spectrum
+    mode: str ('mean')
+      'mean' (inverse-variance weighted) or 'median' (approximate)
+    **kwargs: passed to coadd.SpecCoadd (e.g. clip)
 
     Returns:
     -------
-    bspline
+    XSpectrum1D of the stack
     '''
+    from xastropy.spec import coadd as xsc
+    import itertools
+
+    spectra = iter(spectra)
+    if new_wv is None:
+        first = next(spectra)
+        if isinstance(first, tuple):
+            new_wv = first[0]
+        else:
+            new_wv = first.dispersion
+        spectra = itertools.chain([first], spectra)
+    return xsc.coadd_spectra(spectra, new_wv, mode=mode, **kwargs)
 
 # ################
 if __name__ == "__main__":
@@ -24,6 +24,7 @@ from astropy import constants as const
 from xastropy.xutils import xdebug as xdb
 
 from xastropy.spec import abs_line
+from xastropy.spec import smooth as xsm
 
 # The standard King model
 def voigtking(vin,a):
@@ -33,24 +34,30 @@ def voigtking(vin,a):
 	h2 = np.array([ 1.0e0, 0.9925156067854728234166954e0, 0.9702488370741846925024279e0, 0.9337524315196362275518164e0, 0.8839262840201373526840738e0, 0.8219864299617913128547470e0, 0.7494235719224071131328299e0, 0.6679529582323300874171809e0, 0.5794577764970237101503160e0, 0.4859284571458759498915146e0, 0.3894003915357024341225852e0, 0.2918925528622829754342991e0, 0.1953493712998886960185562e0, 0.1015879694206602794774387e0, 0.1225252788368832137977160e-1, -0.7122285309136537622082871e-1, -0.1476418787320535960282345e0, -0.2160639183435653507962620e0, -0.2758120010582235033784961e0, -0.3264713765759730440736642e0, -0.3678794411714423215955238e0, -0.4001081341403160736400280e0, -0.4234401367904400766628734e0, -0.4383403499032471637408907e0, -0.4454241863223889026399290e0, -0.4454241976960828728637340e0, -0.4391564671033144569589568e0, -0.4274880540708223266513326e0, -0.4113065890894513887520768e0, -0.3914928958756679769706131e0, -0.3688972859665251787412620e0, -0.3443199355303629399446828e0, -0.3184955306263949534807185e0, -0.2920821644962502188874669e0, -0.2656542962828890681640534e0, -0.2396994397177897912204020e0, -0.2146181451424491640939456e0, -0.1907267687784773058932939e0, -0.1682624875086995569546816e0, -0.1473900121018631148986771e0, -0.1282094722211392620560261e0, -0.1107649874577763082733483e0, -0.9505349453993480902150559e-1, -0.8103346641770551054241192e-1, -0.6863322916783106348475741e-1, -0.5775865327580743751389419e-1, -0.4830006328783957980109026e-1, -0.4013827136320013258889535e-1, -0.3314969401563551466825700e-1, -0.2721055620979549646261829e-1, -0.2220022256661865628545539e-1, -0.1800372189840480267502263e-1, -0.1451354925728548119815172e-1, -0.1163084007733763911929080e-1, -0.9266014956431594449373699e-2, -0.7338992385437093554928018e-2, -0.5779061516816548137194317e-2, -0.4524499030007499171731476e-2, -0.3522004336456824141111923e-2, -0.2726016661692386541868837e-2, -0.2097966669473552341459824e-2, -0.1605504811757694087682580e-2, -0.1221738898797218035679319e-2, -0.9245047462622340271825711e-3, -0.6956863110190540254524861e-3, -0.5205955169809141905659767e-3, -0.3874169656489197360292113e-3, -0.2867188376814953929994613e-3, -0.2110284027525126746959732e-3, -0.1544685271976339753833504e-3, -0.1124502587150317136058296e-3, -0.8141583451940456365639560e-4, -0.5862617398424354123250055e-4, -0.4198696356554642675724513e-4, -0.2990772192017133390000897e-4, -0.2118866502002593128272052e-4, -0.1493070967418717996705171e-4, -0.1046450930688891587354327e-4, -0.7294971485088477169986746e-5, -0.5058237141326785665552064e-5, -0.3488590416297032549927031e-5, -0.2393206427093938070506012e-5, -0.1633028318374209170743394e-5, -0.1108394815502115127316820e-5, -0.7483179321690142728739359e-6, -0.5025418723896900527555212e-6, -0.3357037469306895805115546e-6, -0.2230700306981556484079346e-6, -0.1474451577404705893471723e-6, -0.9694537142843821183145493e-7, -0.6340650817983165854183039e-7, -0.4125281597997292543454039e-7, -0.2669863608647444234432417e-7, -0.1718869397329539903528673e-7, -0.1100823095953252158935162e-7, -0.7013187829205346730804204e-8, -0.4444665113656971914920979e-8, -0.2802144497835918309456751e-8, -0.1757406038399392007880848e-8, -0.1096442676719878283524089e-8, -0.6805092493832370091384262e-9, -0.4201635819811978308984480e-9, -0.2580720549398903308510481e-9, -0.1576898051707325645824557e-9, -0.9585353270320148521118371e-10, -0.5796372027032496381736661e-10, -0.3486981951439767325186431e-10, -0.2086844614201629359434107e-10, -0.1242450483517188985330601e-10, -0.7358989436838238028175315e-11, -0.4336195837012716989509190e-11, -0.2541866144559293225048769e-11, -0.1482350707216456169596291e-11, -0.8600132295160969048704279e-12, -0.4963825648030345884941720e-12, -0.2850272799994640993351100e-12, -0.1628231410435433343915847e-12, -0.9253517530796568988711767e-13, -0.5231904387078439423734991e-13, -0.2942904274907536637035087e-13, -0.1646861209472934265701707e-13, -0.9168609972068950589419375e-14, -0.5078280768842531755862938e-14, -0.2798321959684086361623925e-14, -0.1534077985990025530178263e-14, -0.8366946223931157801875458e-15, -0.4540014839572489640421670e-15, -0.2450864324006565520585709e-15, -0.1316297011679965318337360e-15, -0.7033347094398993022030766e-16, -0.3738906588834781501200156e-16, -0.1977436055729519304364136e-16, -0.1040486355537857239908506e-16, -0.5446873085247993592442947e-17, -0.2836846572016980047452363e-17, -0.1469951297806504842876013e-17, -0.7577907726628295065637298e-18, -0.3886652327556223671914838e-18, -0.1983274447591697794634031e-18, -0.1006865346010664339728430e-18, -0.5085599093462560019056651e-19, -0.2555616473221360979839205e-19, -0.1277711291477349028381922e-19, -0.6355561617974547678564100e-20, -0.3145284379748115775839534e-20, -0.1548642984144385532194339e-20, -0.7586277364385535380007560e-21, -0.3697368508385495481212434e-21, -0.1792850002167444277197814e-21, -0.8649339487208141711410640e-22, -0.4151549880751819128657313e-22, -0.1982560526365887292005855e-22, -0.9419591402219956768405243e-23, -0.4452742857507067242031201e-23, -0.2094178149147388017585982e-23, -0.9799199383965174477667876e-24, -0.4562039303075778937781093e-24, -0.2113096807073358619927786e-24, -0.9738054125666016460529380e-25, -0.4464962955517461045769742e-25, -0.2036839830996770073279630e-25, -0.9244633325579509781433326e-26, -0.4174617922924968276183391e-26, -0.1875592296561359766067593e-26, -0.8384076547424474404764890e-27, -0.3728786627489159285725893e-27, -0.1649968834419055881014869e-27, -0.7264074023243377877657008e-28, -0.3181863066343386789136187e-28, -0.1386691329625598948075213e-28, -0.6012783734099460236172624e-29, -0.2593995437123362612886143e-29, -0.1113425178718492778355866e-29, -0.4755009983792073461050496e-30, -0.2020415749389589696795519e-30, -0.8541405110545145479519840e-31, -0.3592671419230207088768861e-31, -0.1503507555679300913224246e-31, -0.6260283436716785719346509e-32, -0.2593480377514370417261009e-32, -0.1068988029132498238513063e-32, -0.4383933266292682172809914e-33, -0.1788778436796033153181937e-33, -0.7261912176216306101089190e-34, -0.2933239704874698217172402e-34, -0.1178817380216022663848294e-34, -0.4713550938665925243747415e-35, -0.1875222736937308593811831e-35, -0.7422680608185535408905020e-36, -0.2923292133270549875473422e-36, -0.1145479868926911875642964e-36, -0.4465877102072613609496200e-37, -0.1732329082290364039482100e-37, -0.6685880402092324407358875e-38, -0.2567388790315000103954881e-38, -0.9809113395522088573556313e-39, -0.3728835208268407801110216e-39, -0.1410334685901388337197457e-39, -0.5307340860010760817486761e-40, -0.1987182729569070557023125e-40, -0.7402951192281463566289795e-41, -0.2743964271316156357722060e-41 ], dtype=np.float64)
 	h3 = np.array([ -0.7522527780636750492641059e0, -0.7447490315497708463240858e0, -0.7224619689626252165385118e0, -0.6860552061846493969863268e0, -0.6366054955061156295204758e0, -0.5755603365344096850483262e0, -0.5046815829547811446478382e0, -0.4259777864640005624125117e0, -0.3416285184773921405216660e0, -0.2539042236274465364534081e0, -0.1650852727968867264939651e0, -0.7738379667939842709258988e-1, 0.7128394424195324853014844e-2, 0.8658293927736663174097951e-1, 0.1593668102410841966827594e0, 0.2241613263920280449352809e0, 0.2799673824845877680517527e0, 0.3261167006652041288605015e0, 0.3622695948610319801705815e0, 0.3884003473857446343896496e0, 0.4047718038942624860766923e0, 0.4119011753186058824533937e0, 0.4105192820995319949018743e0, 0.4015255845130582620257648e0, 0.3859413195031716183649201e0, 0.3648629230000597762360636e0, 0.3394176769351978836202936e0, 0.3107232057693364099667621e0, 0.2798520840662402744643034e0, 0.2478024303401173430156194e0, 0.2154749773684402246897790e0, 0.1836567467116494732079552e0, 0.1530111326375332319918793e0, 0.1240739307148443832620940e0, 0.9725463688468146271051371e-1, 0.7284219701173870412977577e-1, 0.5101430368585303674221369e-1, 0.3184931174142700893159512e-1, 0.1533986919450959655382290e-1, 0.1407426811309193306581366e-2, -0.1008311291608286074413380e-1, -0.1930922840812282398312132e-1, -0.2647758532035030682089135e-1, -0.3181217775839225922486926e-1, -0.3554404023046894464526427e-1, -0.3790265208183702749516685e-1, -0.3910905737306063850349279e-1, -0.3937064210715186736633504e-1, -0.3887744829978686271653342e-1, -0.3779986028416367095012508e-1, -0.3628747152011772566083547e-1, -0.3446892799961155950489723e-1, -0.3245254463375208029954651e-1, -0.3032750110251363953076864e-1, -0.2816544089164076874994184e-1, -0.2602231914851994604543481e-1, -0.2394036936359898584929537e-1, -0.2195008388641825247433045e-1, -0.2007212746338689903391700e-1, -0.1831912527214265469865516e-1, -0.1669728661861120572688442e-1, -0.1520784216814043766189564e-1, -0.1384828617477219420839203e-1, -0.1261342573197174928239427e-1, -0.1149624682246302216128454e-1, -0.1048861222035593117850278e-1, -0.9581809474549548274726564e-2, -0.8766968673914992518412266e-2, -0.8035369845963356580758239e-2, -0.7378659024311709843220737e-2, -0.6788990545369120409265684e-2, -0.6259111260511144290061333e-2, -0.5782400284632080908741386e-2, -0.5352875804464578036313191e-2, -0.4965178455311671875710459e-2, -0.4614538919616485527188256e-2, -0.4296735750484013517713710e-2, -0.4008047998562558651176877e-2, -0.3745206023826233664801882e-2, -0.3505342894046476979204381e-2, -0.3285947990022833548498951e-2, -0.3084823830238963251792028e-2, -0.2900046668982056656687612e-2, -0.2729931086807768375811907e-2, -0.2572998556853316466871207e-2, -0.2427949813646523181953355e-2, -0.2293640754330915732383722e-2, -0.2169061550185197106672818e-2, -0.2053318626361484792588433e-2, -0.1945619169898585865047079e-2, -0.1845257842557062274985012e-2, -0.1751605400071271234291063e-2, -0.1664098948801722796139379e-2, -0.1582233601544145935191528e-2, -0.1505555324435757496173641e-2, -0.1433654795260900326865144e-2, -0.1366162119305863305428748e-2, -0.1302742271937752484738341e-2, -0.1243091157235637593921277e-2, -0.1186932189400779713774489e-2, -0.1134013318531012910469058e-2, -0.1084104434925714219487149e-2, -0.1036995096671516116549004e-2, -0.9924925341187004927105684e-3, -0.9504198922493585737226438e-3, -0.9106146780909950790852145e-3, -0.8729273854455090856168734e-3, -0.8372202734577421999252958e-3, -0.8033662790881490171689315e-3, -0.7712480465049772662387464e-3, -0.7407570588761368843162862e-3, -0.7117928601052224681383490e-3, -0.6842623557902678206459998e-3, -0.6580791841453911032352388e-3, -0.6331631488616646148452257e-3, -0.6094397069328185150662371e-3, -0.5868395053652243037188589e-3, -0.5652979614557357816469240e-3, -0.5447548819764808379193485e-3, -0.5251541171699206704315699e-3, -0.5064432459446979814905582e-3, -0.4885732890847829717111949e-3, -0.4714984476509869340551945e-3, -0.4551758640732029088500233e-3, -0.4395654037105695480727411e-3, -0.4246294549008608587718018e-3, -0.4103327457346023732872108e-3, -0.3966421759777806984761265e-3, -0.3835266627330082944382909e-3, -0.3709569985755748701109446e-3, -0.3589057210304776810509891e-3, -0.3473469923714317173865229e-3, -0.3362564888248703524021643e-3, -0.3256112983526542094353014e-3, -0.3153898262679901745636708e-3, -0.3055717080111181576022737e-3, -0.2961377284756872027881530e-3, -0.2870697473343167903391904e-3, -0.2783506298634098374691914e-3, -0.2699641828135376810549337e-3, -0.2618950949132550960609061e-3, -0.2541288816315519571599965e-3, -0.2466518338577700959600751e-3, -0.2394509701881161861915701e-3, -0.2325139925352426415436720e-3, -0.2258292448020649292499711e-3, -0.2193856743833149971866920e-3, -0.2131727962785441468085678e-3, -0.2071806596186039850962257e-3, -0.2013998164242456949121338e-3, -0.1958212924305587453675523e-3, -0.1904365598246742268269672e-3, -0.1852375117566223449189077e-3, -0.1802164384945805472907308e-3, -0.1753660051060874920343825e-3, -0.1706792305562262391906103e-3, -0.1661494681223850440721571e-3, -0.1617703870330642541013594e-3, -0.1575359552453832883093564e-3, -0.1534404232825155716084045e-3, -0.1494783090582982775062280e-3, -0.1456443836217787948749789e-3, -0.1419336577595168918308957e-3, -0.1383413693981019940302776e-3, -0.1348629717536061671270311e-3, -0.1314941221786090162018978e-3, -0.1282306716610312631043834e-3, -0.1250686549323268134999138e-3, -0.1220042811456336331711188e-3, -0.1190339250872943430156140e-3, -0.1161541188877486230913414e-3, -0.1133615442001899065679247e-3, -0.1106530248175853517419676e-3, -0.1080255197006960803598953e-3, -0.1054761163916181391183883e-3, -0.1030020247891063146774180e-3, -0.1006005712635544029343839e-3, -0.9826919309099737327798045e-4, -0.9600543318688272806740460e-4, -0.9380693512163903486436983e-4, -0.9167143840125715403094134e-4, -0.8959677399720145006388879e-4, -0.8758086011099098595144745e-4, -0.8562169815974051700802759e-4, -0.8371736896983366064768422e-4, -0.8186602916672109476829247e-4, -0.8006590774959976520266573e-4, -0.7831530284043921555152064e-4, -0.7661257859748228262605498e-4, -0.7495616228396319961002592e-4, -0.7334454148335998246272097e-4, -0.7177626145303295708079228e-4, -0.7024992260860025649833230e-4, -0.6876417813186671874001603e-4, -0.6731773169555726054493046e-4, -0.6590933529851172806481185e-4, -0.6453778720537748581672358e-4, -0.6320192998519050404738797e-4, -0.6190064864356719221383246e-4, -0.6063286884353932444622322e-4, -0.5939755521035460581086281e-4, -0.5819370971583712468698264e-4 ], dtype=np.float64)
 
-	v=vin
-	# Voigt function is symmetric, so -v = v
-	if len(np.argwhere(v<0.0)) != 0: v[np.argwhere(v<0.0)] *= -1.0
+	# Voigt function is symmetric, so -v = v  (and do not modify the input)
+	v = np.fabs(np.asarray(vin, dtype=np.float64))
+	shape = v.shape
+	v = v.flatten()
+	a = np.asarray(a, dtype=np.float64)
 	# if a is exactly zero go to 3 for exact expression
-	if (a == 0.0):
+	if (a.size == 1) and (a == 0.0):
 		voigt_prof = np.exp(-(v*v))
-		return voigt_prof
+		return voigt_prof.reshape(shape)
+	# Allow one damping parameter per element (e.g. one per line)
+	a = (a * np.ones(shape)).flatten()
 	# Scale up v for ease with lookup tables
 	v0 = v*10.0
 	n=np.array(v0,dtype=np.int_)
-	voigt_prof = np.zeros(np.size(vin))
-	nl=np.argwhere(n<100)
-	nh=np.argwhere(n>=100)
+	voigt_prof = np.zeros(v.size)
+	nl=np.where(n<100)[0]
+	nh=np.where(n>=100)[0]
 	if len(nh) != 0:
 		r=1.0/v[nh]**2
-		voigt_prof[nh] = a*r*oneonsqrtpi*(1.0 + r*(1.5 + r*(3.75 + r*(13.125 + 59.0625*r))) - a*a*r*(1.0 + r*(5.0 +26.25*r)))
+		ah = a[nh]
+		voigt_prof[nh] = ah*r*oneonsqrtpi*(1.0 + r*(1.5 + r*(3.75 + r*(13.125 + 59.0625*r))) - ah*ah*r*(1.0 + r*(5.0 +26.25*r)))
 	if len(nl) != 0:
 		v0[nl] = 2*v[nl]*10.0
+		al = a[nl]
 		p=np.int_(v0[nl])
 		p1=p+1
 		p2=p+2
@@ -58,25 +65,472 @@ def voigtking(vin,a):
 		y=x+0.5
 		z=x+1.0
 		v1 = v0[nl] * 0.5
-		voigt_prof[nl] = 2.0*((v1-y)*(v1-z)*(h0[p]+a*(h1[p]+a*(h2[p]+a*h3[p]))) - (v1-x)*(v1-z)*2.0*(h0[p1] + a*(h1[p1]+a*(h2[p1]+a*h3[p1]))) + (v1-x)*(v1-y)*(h0[p2] + a*(h1[p2]+a*(h2[p2]+a*h3[p2]))))
+		voigt_prof[nl] = 2.0*((v1-y)*(v1-z)*(h0[p]+al*(h1[p]+al*(h2[p]+al*h3[p]))) - (v1-x)*(v1-z)*2.0*(h0[p1] + al*(h1[p1]+al*(h2[p1]+al*h3[p1]))) + (v1-x)*(v1-y)*(h0[p2] + al*(h1[p2]+al*(h2[p2]+al*h3[p2]))))
 	del nl, nh
-	return voigt_prof
+	return voigt_prof.reshape(shape)
 
 
+# Faddeeva function (scipy)
+def voigt_wofz(vin,a):
+    """ Voigt-Hjerting function H(a,u) = Re[w(u + i a)]
+    Uses the Faddeeva function from scipy.  Accurate to machine precision
+    for any a, but the slowest of the backends
+
+    Parameters:
+    ------------
+      vin: float or array
+        u values (frequency offset in Doppler units)
+      a: float or array
+        Damping parameter (broadcast against vin)
+    """
+    from scipy.special import wofz
+    return wofz(np.asarray(vin, dtype=np.float64) + 1j*np.asarray(a, dtype=np.float64)).real
+
+# Humlicek rational approximation
+def voigt_humlicek(vin,a):
+    """ Voigt-Hjerting function H(a,u) from the Humlicek (1982, JQSRT, 27, 437)
+    W4 rational approximation to the Faddeeva function.
+    Relative accuracy ~1e-4 for all a
+
+    Parameters:
+    ------------
+      vin: float or array
+        u values (frequency offset in Doppler units)
+      a: float or array
+        Damping parameter (broadcast against vin)
+    """
+    x = np.asarray(vin, dtype=np.float64)
+    y = np.asarray(a, dtype=np.float64)
+    x, y = np.broadcast_arrays(x, y)
+    shape = x.shape
+    x = x.flatten()
+    y = y.flatten()
+    t = y - 1j*x
+    s = np.fabs(x) + y
+    w = np.zeros(x.size, dtype=np.complex128)
+
+    # Region I
+    r1 = s >= 15.
+    tt = t[r1]
+    w[r1] = tt*0.5641896/(0.5+tt*tt)
+    # Region II
+    r2 = (s < 15.) & (s >= 5.5)
+    tt = t[r2]
+    uu = tt*tt
+    w[r2] = tt*(1.410474+uu*0.5641896)/(0.75+uu*(3.+uu))
+    # Region III
+    r3 = (s < 5.5) & (y >= 0.195*np.fabs(x)-0.176)
+    tt = t[r3]
+    w[r3] = ((16.4955+tt*(20.20933+tt*(11.96482+tt*(3.778987+tt*0.5642236)))) /
+             (16.4955+tt*(38.82363+tt*(39.27121+tt*(21.69274+tt*(6.699398+tt))))))
+    # Region IV
+    r4 = ~(r1 | r2 | r3)
+    tt = t[r4]
+    uu = tt*tt
+    w[r4] = np.exp(uu) - tt*(36183.31-uu*(3321.9905-uu*(1540.787-uu*(219.0313-uu*(
+        35.76683-uu*(1.320522-uu*0.56419)))))) / (32066.6-uu*(24322.84-uu*(
+        9022.228-uu*(2186.181-uu*(364.2191-uu*(61.57037-uu*(1.841439-uu)))))))
+
+    return w.real.reshape(shape)
+
+# Available Voigt-function backends
+voigt_backends = {'king': voigtking, 'humlicek': voigt_humlicek, 'wofz': voigt_wofz}
+
+def voigt_function(vin, a, method='king'):
+    """ Voigt-Hjerting function H(a,u) with a selectable backend
+
+    Parameters:
+    ------------
+      vin: float or array
+        u values (frequency offset in Doppler units)
+      a: float or array
+        Damping parameter
+      method: str ('king')
+        'king' -- King table interpolation (fast; degrades for large a)
+        'humlicek' -- Humlicek W4 rational approximation (~1e-4)
+        'wofz' -- scipy Faddeeva function (exact; slowest)
+    """
+    try:
+        vfunc = voigt_backends[method]
+    except KeyError:
+        raise ValueError('voigt: Unknown Voigt backend {:s}'.format(method))
+    return vfunc(vin, a)
+
+def benchmark_voigt(uval=None, aval=None, methods=None, nrep=3):
+    """ Accuracy and speed of the Voigt backends on a grid of (u,a)
+    Accuracy is measured against the 'wofz' backend
+
+    Parameters:
+    ------------
+      uval: float array (None)
+        u values; defaults to 20001 values spanning -50 to 50
+      aval: float array (None)
+        Damping parameters; defaults to 1e-5 to 1 (logarithmic)
+      methods: list (None)
+        Backends to test; defaults to all
+      nrep: int (3)
+        Number of repeats for the timing (best is reported)
+
+    Returns:
+      bench: Table
+        One row per (method, a) with the maximum relative error and
+        the time per 10^6 evaluations (s)
+    """
+    import time
+    from astropy.table import Table
+
+    if uval is None:
+        uval = np.linspace(-50., 50., 20001)
+    if aval is None:
+        aval = 10.**np.arange(-5., 0.1, 1.)
+    if methods is None:
+        methods = sorted(voigt_backends.keys())
+    uval = np.asarray(uval, dtype=np.float64)
+
+    rows = []
+    for method in methods:
+        for ia in aval:
+            ref = voigt_wofz(uval, ia)
+            best = None
+            for ii in range(nrep):
+                t0 = time.time()
+                H = voigt_function(uval, ia, method=method)
+                dt = time.time() - t0
+                if (best is None) or (dt < best):
+                    best = dt
+            relerr = np.max(np.fabs(H-ref)/ref)
+            rows.append((str(method), ia, relerr, best * 1e6 / uval.size))
+
+    bench = Table(rows=rows, names=(str('method'), str('a'), str('max_rel_err'), str('time')))
+    return bench
+
+# Units assumed for bare values in a parameter list [N, z, b, wrest, fval, gamma]
+_par_units = (None, None, u.km/u.s, u.AA, None, 1/u.s)
+
+def _strip_unit(val, unit):
+    """ Return the value of a Quantity in unit (or the input if no unit)"""
+    if (unit is not None) and isinstance(val, u.Quantity):
+        return val.to(unit).value
+    return val
+
+def _abs_line_par(line):
+    """ Voigt parameters [N, z, b, wrest, fval, gamma] for one AbsLine
+    Works with xastropy and linetools absorption lines
+    """
+    # Redshift
+    try:
+        zabs = line.z
+    except AttributeError:
+        try:
+            zabs = line.attrib['z']
+        except KeyError:
+            zabs = line.analy['z']
+    # Atomic data
+    try:
+        atomic = line.atomic
+    except AttributeError:
+        atomic = line.data
+    # Column (log10 cm^-2)
+    NHI = line.attrib['N']
+    if isinstance(NHI, u.Quantity):
+        NHI = np.log10(NHI.to(u.cm**-2).value)
+    par = [NHI, zabs, line.attrib['b'], line.wrest, atomic['fval'], atomic['gamma']]
+    return [_strip_unit(item, unit) for item, unit in zip(par, _par_units)]
+
+def line_params(line):
+    """ Parse line input into float arrays of Voigt parameters
+
+    Parameters:
+    ------------
+      line: AbsLine, List of AbsLine, or list of parameters
+        [N, z, b, wrest, fval, gamma] with N in log10 cm^-2, b in km/s,
+        wrest in Ang and gamma in s^-1 (Quantities are converted).
+        Each parameter may be an array, one entry per line.
+
+    Returns:
+      N, z, b, wrest, fval, gamma : float arrays (one entry per line)
+    """
+    if hasattr(line, 'wrest'):  # Single line as a Class
+        par = _abs_line_par(line)
+    elif isinstance(line, (list, tuple, np.ndarray)) and len(line) > 0:
+        if hasattr(line[0], 'wrest'):  # List of lines
+            par = [list(item) for item in zip(*[_abs_line_par(iline) for iline in line])]
+        elif len(line) == 6:  # Parameter vector (scalars or arrays)
+            par = [_strip_unit(item, unit) for item, unit in zip(line, _par_units)]
+        else:
+            raise ValueError('voigt: Parameter list must be [N, z, b, wrest, fval, gamma]')
+    else:
+        raise ValueError('voigt: Unknown type for voigt line')
+
+    par = np.broadcast_arrays(*[np.asarray(item, dtype=np.float64) for item in par])
+    return [np.atleast_1d(item).flatten() for item in par]
+
+def line_constants(N, z, b, wrest, fval, gamma):
+    """ Per-line constants for the optical depth
+    tau = tau0 * H(a, u) with u = vscl * (wobs/wave - 1)
+
+    Parameters:
+      N, z, b, wrest, fval, gamma: float or array
+        See voigt_tau
+
+    Returns:
+      tau0, avoigt, wobs, vscl: float arrays
+    """
+    N, z, b, wrest, fval, gamma = line_params([N, z, b, wrest, fval, gamma])
+    dnu = (b * 1e5) / (wrest * 1e-8)  # Doppler frequency (Hz)
+    avoigt = gamma / (4 * np.pi * dnu)
+    tau0 = 0.014971475 * 10.**N * fval / dnu
+    wobs = wrest * (1+z)
+    vscl = const.c.to('km/s').value / b
+    return tau0, avoigt, wobs, vscl
+
+def line_windows(wave, tau0, avoigt, wobs, vscl, tau_min):
+    """ Pixel window of each line where its optical depth exceeds tau_min
+    Covers the Gaussian core and (when they matter) the damping wings
+
+    Parameters:
+      wave: float array
+        Sorted wavelengths (Ang)
+      tau0, avoigt, wobs, vscl: float arrays
+        Line constants (see line_constants)
+      tau_min: float
+        Optical depth threshold
+
+    Returns:
+      i0, nwin: int arrays
+        First pixel and number of pixels of each window (0 if the
+        line never exceeds tau_min)
+    """
+    # Half-width of each window (Doppler units)
+    #   Core: tau0 exp(-u^2) = tau_min;  Wings: tau0 a/(sqrt(pi) u^2) = tau_min
+    ratio = tau0 / tau_min
+    ucore = np.sqrt(np.log(np.maximum(ratio, 1.)))
+    uwing = np.sqrt(ratio * avoigt / np.sqrt(np.pi))
+    umax = np.maximum(ucore, uwing) + 1.  # Pad by one Doppler width
+
+    # Pixel windows
+    dv = umax / vscl  # v/c
+    wvmin = wobs / (1. + dv)
+    wvmax = np.where(dv < 1., wobs / np.maximum(1.-dv, 1e-10), np.inf)
+    i0 = np.searchsorted(wave, wvmin, side='left')
+    i1 = np.searchsorted(wave, wvmax, side='right')
+    nwin = np.where(ratio > 1., i1-i0, 0)
+    return i0, nwin
+
+def voigt_tau(wave, N, z, b, wrest, fval, gamma, nmax_pix=2**22, method='king',
+              tau_min=None):
+    """ Optical depth of a set of lines on a wavelength array
+    All of the lines are evaluated in one vectorized pass
+    (in blocks of lines to bound the memory) on plain float arrays.
+    With tau_min set, each line is only evaluated over the pixels where
+    its optical depth exceeds tau_min (see voigt_tau_window)
+
+    Parameters:
+    ------------
+      wave: float array
+        Wavelengths (Ang)
+      N, z, b, wrest, fval, gamma: float or array
+        log10 column density (cm^-2), redshift, Doppler parameter (km/s),
+        rest wavelength (Ang), oscillator strength, damping constant (s^-1)
+      nmax_pix: int (2**22)
+        Maximum number of line x pixel evaluations per block
+      method: str ('king')
+        Voigt-function backend (see voigt_function)
+      tau_min: float (None)
+        Optical depth threshold for the windowed evaluation
+
+    Returns:
+      tau: float array
+        Optical depth summed over the lines
+    """
+    wave = np.atleast_1d(np.asarray(wave, dtype=np.float64))
+    tau0, avoigt, wobs, vscl = line_constants(N, z, b, wrest, fval, gamma)
+
+    # Windowed?
+    if tau_min is not None:
+        return voigt_tau_window(wave, tau0, avoigt, wobs, vscl, tau_min,
+                                nmax_pix=nmax_pix, method=method)
+
+    # Loop on blocks of lines
+    tau = np.zeros(wave.size)
+    nblk = max(1, nmax_pix // max(wave.size, 1))
+    for i0 in range(0, len(tau0), nblk):
+        blk = slice(i0, i0+nblk)
+        uvoigt = vscl[blk,None] * (wobs[blk,None] / wave[None,:] - 1.)
+        tau += np.sum(tau0[blk,None] * voigt_function(uvoigt, avoigt[blk,None],
+                                                      method=method), axis=0)
+
+    return tau
+
+def voigt_tau_window(wave, tau0, avoigt, wobs, vscl, tau_min, nmax_pix=2**22,
+                     method='king'):
+    """ Optical depth of a set of lines evaluated only within their windows
+    Each line is computed only where its optical depth exceeds tau_min,
+    i.e. over the Gaussian core and (when they matter) the damping wings.
+    The windows are located with a sorted wavelength index and the
+    results are accumulated into the shared tau array.  Usually called
+    from voigt_tau
+
+    Parameters:
+    ------------
+      wave: float array
+        Wavelengths (Ang)
+      tau0: float array
+        Optical depth scale of each line, tau = tau0 * H(a,u)
+      avoigt: float array
+        Damping parameter of each line
+      wobs: float array
+        Observed wavelength of each line (Ang)
+      vscl: float array
+        c/b for each line (u = vscl * (wobs/wave - 1))
+      tau_min: float
+        Optical depth below which a line is ignored
+      nmax_pix: int (2**22)
+        Maximum number of pixel evaluations per block of lines
+      method: str ('king')
+        Voigt-function backend (see voigt_function)
+
+    Returns:
+      tau: float array
+        Optical depth summed over the lines
+    """
+    # Sorted wavelength index
+    srt = None
+    if np.any(np.diff(wave) < 0.):
+        srt = np.argsort(wave)
+        wave = wave[srt]
+    npix = wave.size
+    nline = len(tau0)
+
+    # Pixel windows
+    i0, nwin = line_windows(wave, tau0, avoigt, wobs, vscl, tau_min)
+
+    # Loop on blocks of lines covering at most nmax_pix pixels
+    tau = np.zeros(npix)
+    cumwin = np.cumsum(nwin)
+    istart = 0
+    while istart < nline:
+        base = cumwin[istart-1] if istart > 0 else 0
+        iend = max(np.searchsorted(cumwin, base+nmax_pix, side='right'), istart+1)
+        nblk = nwin[istart:iend]
+        ntot = np.sum(nblk)
+        if ntot > 0:
+            # Flattened (line, pixel) pairs for the block
+            iline = np.repeat(np.arange(istart, iend), nblk)
+            offs = np.cumsum(nblk) - nblk
+            pix = np.arange(ntot) - np.repeat(offs, nblk) + np.repeat(i0[istart:iend], nblk)
+            uvoigt = vscl[iline] * (wobs[iline] / wave[pix] - 1.)
+            vals = tau0[iline] * voigt_function(uvoigt, avoigt[iline], method=method)
+            tau += np.bincount(pix, weights=vals, minlength=npix)
+        istart = iend
+
+    # Return in the input order
+    if srt is not None:
+        otau = np.zeros(npix)
+        otau[srt] = tau
+        tau = otau
+    return tau
+
+def voigt_flux_oversample(wave, N, z, b, wrest, fval, gamma, nsamp=3., tau_win=1e-4,
+                          nmax_sub=64, **kwargs):
+    """ Pixel-averaged flux with adaptive sub-pixel oversampling
+    Only pixels within the window of a line that is unresolved at the
+    native pixel scale (pixel width > b/nsamp) are split into sub-pixels;
+    exp(-tau) is then averaged back onto the input pixels.
+
+    Parameters:
+    ------------
+      wave: float array
+        Wavelengths (Ang), increasing
+      N, z, b, wrest, fval, gamma: float or array
+        See voigt_tau
+      nsamp: float (3.)
+        Minimum number of samples per Doppler parameter b
+      tau_win: float (1e-4)
+        Optical depth defining the window of a line (see line_windows)
+      nmax_sub: int (64)
+        Maximum number of sub-pixels per pixel
+      **kwargs:
+        Passed to voigt_tau (e.g. method, tau_min, nmax_pix)
+
+    Returns:
+      flux: float array
+        Pixel-averaged flux
+      nsub: int array
+        Number of sub-pixels used for each pixel
+    """
+    wave = np.atleast_1d(np.asarray(wave, dtype=np.float64))
+    if np.any(np.diff(wave) <= 0.):
+        raise ValueError('voigt_flux_oversample: Wavelengths must be increasing')
+    npix = wave.size
+
+    # Pixel edges and widths (km/s)
+    edges = np.zeros(npix+1)
+    edges[1:-1] = 0.5*(wave[1:] + wave[:-1])
+    edges[0] = wave[0] - (edges[1]-wave[0])
+    edges[-1] = wave[-1] + (wave[-1]-edges[-2])
+    ckms = const.c.to('km/s').value
+    dvpix = ckms * (edges[1:]-edges[:-1]) / wave
+
+    # Sub-pixels required around each line
+    tau0, avoigt, wobs, vscl = line_constants(N, z, b, wrest, fval, gamma)
+    bval = ckms / vscl
+    i0, nwin = line_windows(wave, tau0, avoigt, wobs, vscl, tau_win)
+    nsub = np.ones(npix, dtype=np.int_)
+    for ii in np.where(nwin > 0)[0]:
+        win = slice(i0[ii], i0[ii]+nwin[ii])
+        need = np.ceil(nsamp * dvpix[win] / bval[ii]).astype(np.int_)
+        nsub[win] = np.maximum(nsub[win], need)
+    nsub = np.minimum(nsub, nmax_sub)
+
+    # Sub-pixel grid (pixel centers where no oversampling is needed)
+    ipix = np.repeat(np.arange(npix), nsub)
+    jsub = np.arange(ipix.size) - np.repeat(np.cumsum(nsub)-nsub, nsub)
+    wfine = edges[ipix] + (jsub+0.5) * (edges[ipix+1]-edges[ipix]) / nsub[ipix]
+    single = nsub[ipix] == 1
+    wfine[single] = wave[ipix[single]]
+
+    # Evaluate and average
+    tau_fine = voigt_tau(wfine, N, z, b, wrest, fval, gamma, **kwargs)
+    flux = np.bincount(ipix, weights=np.exp(-tau_fine), minlength=npix) / nsub
+    return flux, nsub
+
 # The primary call
-def voigt_model(spec, line, Npix=None, flg_ret=1):
+def voigt_model(spec, line, Npix=None, flg_ret=1, nmax_pix=2**22, method='king',
+                tau_min=None, oversample=False, nsamp=3., lsf=None):
     """Generates a Voigt model from a line or list of lines
 
     Parameters:
     ------------
         spec: wave array or Spectrum
         line: Abs_Line, List of Abs_line, or array of parameters
+          Parameters are [N, z, b, wrest, fval, gamma]; each may be an
+          array to generate many lines in a single batched pass
         flg_ret : int (1)  Byte-wise Flag for return
           1: vmodel
           2: tau
-
-    ToDo:
-        1.  May need to more finely sample the wavelength array
+        nmax_pix: int (2**22)
+          Maximum number of line x pixel evaluations per block (see voigt_tau)
+        method: str ('king')
+          Voigt-function backend, e.g. 'humlicek' or 'wofz' for large
+          damping parameters (see voigt_function)
+        tau_min: float (None)
+          If set, evaluate each line only where its optical depth
+          exceeds tau_min, e.g. 1e-4 for long spectra with many lines
+        oversample: bool (False)
+          Oversample the pixels around lines that are unresolved at the
+          native pixel scale and average the flux back onto the pixels
+          (see voigt_flux_oversample).  tau is then the effective
+          optical depth of each pixel, -ln(flux)
+        nsamp: float (3.)
+          Minimum number of samples per Doppler parameter when oversampling
+        Npix: float (None)
+          FWHM (pixels) of a Gaussian to smooth the model flux with
+        lsf: float, tuple or array (None)
+          Line-spread function to convolve the model flux with, applied
+          on the pixel grid.  FWHM (pixels) of a Gaussian, a tabulated
+          kernel, or a wavelength-dependent LSF such as ('R', 5000.)
+          (see smooth.convolve_lsf)
 
     JXP 01 Nov 2014
     """
@@ -84,7 +538,7 @@ def voigt_model(spec, line, Npix=None, flg_ret=1):
     import copy
     from linetools.spectra.utils import XSpectrum1D
     from astropy.nddata import StdDevUncertainty
-    from xastropy.spec.lines_utils import AbsLine
+    from specutils import Spectrum1D
 
     # Spectrum input
     if isinstance(spec,np.ndarray):  # Standard wavelength array
@@ -94,73 +548,41 @@ def voigt_model(spec, line, Npix=None, flg_ret=1):
         vmodel = copy.deepcopy(spec)
     else:
         raise ValueError('voigt_model: Unknown input')
-    #xdb.set_trace()
-        
+
     # Line input
-    if isinstance(line,AbsLine):  # Single line as a Abs_Line Class
-        par = [0*i for i in range(6)] # Dummy list
-        par[0] = line.attrib['N']
-        par[1] = line.z
-        par[2] = line.attrib['b']
-        par[3] = line.wrest
-        par[4] = line.atomic['fval']
-        par[5] = line.atomic['gamma']
-    elif isinstance(line,list):
-        if isinstance(line[0],AbsLine):  # List of Abs_Line
-            tau = np.zeros(len(vmodel.flux))
-            for iline in line:
-                tau += voigt_model(vmodel.dispersion, iline, Npix=None, flg_ret=2) 
-        else:
-            par = line  # Single line as a vector
-    else: 
-        raise ValueError('voigt: Unknown type for voigt line')
+    par = line_params(line)
+
+    # tau (units only at the edges)
+    wave = vmodel.dispersion
+    if isinstance(wave, u.Quantity):
+        wave = wave.to(u.AA).value
+    if oversample:
+        fx, nsub = voigt_flux_oversample(wave, *par, nsamp=nsamp, nmax_pix=nmax_pix,
+                                         method=method, tau_min=tau_min)
+        tau = -1.0*np.log(np.maximum(fx, 1e-300))
+    else:
+        tau = voigt_tau(wave, *par, nmax_pix=nmax_pix, method=method, tau_min=tau_min)
+        fx = np.exp(-1.0*tau)
+    tau = tau * u.dimensionless_unscaled
 
-    # tau
-    if 'tau' not in locals():
-        #xdb.set_trace()
-        cold = 10.0**par[0] / u.cm / u.cm
-        zp1=par[1]+1.0
-
-        wv=par[3].to(u.cm) #*1.0e-8
-        nujk = (const.c / wv).to(u.Hz)
-        dnu = ((par[2]*u.km/u.s) / wv).to('Hz')
-        avoigt = ((par[5]/u.s)/( 4 * np.pi * dnu)).to(u.dimensionless_unscaled)
-
-        uvoigt = ( ((const.c / (vmodel.dispersion/zp1)) - nujk) / dnu).to(u.dimensionless_unscaled)
-        '''
-        wv=par[3].to(u.cm) #*1.0e-8
-        bl=((par[2]*u.km/u.s)*wv/const.c).to(u.cm) # 2.99792458E5
-        a= ((par[5]/u.s)*wv*wv/( 4 * np.pi * const.c.to('cm/s') * bl)).to(u.dimensionless_unscaled)
-        cns=wv*wv*par[4]/(bl*2.002134602291006E12) * u.cm
-
-        # Converting to Voigt units
-        cne=cold*cns
-        ww=(vmodel.dispersion.to('cm'))/zp1
-        v=wv*ww*((1.0/ww)-(1.0/wv))/bl
-        '''
-
-        # Voigt
-        cne = 0.01497 * cold * par[4] * u.cm * u.cm * u.Hz
-        tau = cne * voigtking(uvoigt,avoigt) / (np.sqrt(np.pi) * dnu)
+    # LSF
+    if lsf is not None:
+        fx = xsm.convolve_lsf(fx, lsf, wave=wave)
+
+    # Convolve (Gaussian FWHM in pixels)
+    if Npix is not None:
+        fx = xsm.convolve_lsf(fx, Npix)
 
     # Flux
     if vmodel.unit is None:
-        try:
-            vmodel.flux = (np.exp(-1.0*tau)).value
-        except AttributeError:
-            vmodel.flux = np.exp(-1.0*tau)
+        vmodel.flux = fx
     else:
-        vmodel.flux = np.exp(-1.0*tau).to(vmodel.unit)
+        vmodel.flux = (fx * u.dimensionless_unscaled).to(vmodel.unit)
 
-    # Convolve
-    if Npix is not None:
-        vmodel.gauss_smooth(npix=Npix)
-    
     # Return
     ret_val = []
     if flg_ret % 2 == 1: ret_val.append(vmodel)
     if flg_ret % 4 >= 2: ret_val.append(tau)
-    #xdb.set_trace()
     if len(ret_val) == 1: ret_val = ret_val[0]
     return ret_val
 
@@ -190,6 +612,9 @@ if __name__ == '__main__':
     flg_test += 2**3
     flg_test += 2**4
     flg_test += 2**5
+    #flg_test += 2**6
+    #flg_test += 2**7
+    #flg_test += 2**8
 
     wave = np.linspace(1260.0,1285.0,10000)
     wave = wave * u.AA
@@ -268,4 +693,32 @@ if __name__ == '__main__':
         print('voigt: Spec input test')
         vmodel.qck_plot()
 
+    # Batched parameter arrays (Lyman series of an LLS)
+    if flg_test % 128 >= 64:
+        from xastropy.igm import tau_eff as xit
+        from xastropy.spec import abs_line as xsab
+        wrest = xit.tau_eff_llist()
+        adata = xsab.abs_line_data(wrest.value, ret_flg=2)
+        fval, gamma = adata['fval'], adata['gamma']
+        zlls = 2.5
+        lwave = np.linspace(3150., 3300., 20000) * u.AA
+        lines = [17.5*np.ones(len(wrest)), zlls, 20., wrest, fval, gamma]
+        vmodel = voigt_model(lwave, lines, Npix=None)
+        print('voigt: Batched Lyman series test')
+        xdb.xplot(vmodel.dispersion, vmodel.flux)
+
+    # Voigt backends
+    if flg_test % 256 >= 128:
+        print('voigt: Backend benchmark')
+        print(benchmark_voigt())
+
+    # Oversampling + LSF for a narrow metal line
+    if flg_test % 512 >= 256:
+        cwave = np.linspace(1266., 1267., 100) * u.AA
+        line = [13.5, zabs, 2., 1206.5*u.AA, 1.669, 2.5E9]
+        vmodel = voigt_model(cwave, line)
+        vmodel2 = voigt_model(cwave, line, oversample=True, lsf=3.)
+        print('voigt: Oversample + LSF test')
+        xdb.xplot(cwave, vmodel.flux, vmodel2.flux)
+
     print('voigt: All done testing..')
@@ -0,0 +1,362 @@
+"""
+#;+
+#; NAME:
+#; voigt_fit
+#;    Version 1.0
+#;
+#; PURPOSE:
+#;    Module for multi-component Voigt profile fitting
+#;      (N, b, z) are tied across the transitions of an ion and the
+#;      least-squares fit uses analytic derivatives of tau
+#;-
+#;------------------------------------------------------------------------------
+"""
+from __future__ import print_function, absolute_import, division, unicode_literals
+
+import numpy as np
+
+from astropy import units as u
+from astropy import constants as const
+
+from xastropy.spec import voigt as xsv
+from xastropy.spec import smooth as xsm
+from xastropy.xutils import xdebug as xdb
+
+# Parameters of each component, in the order of the parameter vector
+par_names = ('logN', 'z', 'b')
+
+class VoigtFit(object):
+    """ Multi-component, multi-ion Voigt profile fit
+
+    Attributes:
+       windows: list of dict
+          Spectral windows (wave, flux, sig, lsf) that are fit together
+       ions: list of dict
+          Ions with the atomic data of their transitions
+       comps: list of dict
+          Components (ion index, logN, z, b, fix) with (logN, z, b)
+          shared by every transition of the ion
+    """
+
+    # Generate from a list of absorption lines
+    @classmethod
+    def from_abslines(cls, lines, spec=None, zabs=None, vlim=None, logN=13.5, bval=10.):
+        """ Setup a fit from absorption lines, e.g. AbslineSystem.lines
+        One window per line and one component per ion
+
+        Parameters:
+        -----------
+        lines: list of AbsLine
+        spec: Spectrum1D (None)
+          Spectrum to fit; otherwise taken from line.analy['spec']
+        zabs: float (None)
+          Redshift of the components; otherwise taken from the lines
+        vlim: Quantity array (None)
+          Velocity interval of the windows; otherwise line.analy['vlim']
+        logN, bval: float (13.5, 10.)
+          Initial guesses for the components
+
+        Returns:
+          VoigtFit
+        """
+        vfit = cls()
+        for line in lines:
+            # Atomic data and ion
+            ion, wrest, fval, gamma = _line_atomic(line)
+            iion = vfit.add_ion(ion, wrest, fval, gamma)
+            # Redshift
+            if zabs is None:
+                lz = float(_line_z(line))
+            else:
+                lz = zabs
+            # Window
+            if vlim is None:
+                try:
+                    ivlim = line.analy['vlim']
+                except KeyError:
+                    ivlim = line.analy['VLIM']
+            else:
+                ivlim = vlim
+            ivlim = xsv._strip_unit(ivlim, u.km/u.s)
+            if spec is None:
+                ispec = line.analy['spec']
+            else:
+                ispec = spec
+            pix = ispec.pix_minmax(lz, wrest*u.AA, np.array(ivlim)*u.km/u.s)[0]
+            wave = ispec.dispersion[pix]
+            if isinstance(wave, u.Quantity):
+                wave = wave.to(u.AA).value
+            vfit.add_window(wave, np.asarray(ispec.flux[pix]), np.asarray(ispec.sig[pix]))
+            # Component (one per ion)
+            if len([comp for comp in vfit.comps if comp['ion'] == iion]) == 0:
+                vfit.add_component(iion, logN, lz, bval)
+        return vfit
+
+    # Initialize
+    def __init__(self):
+        self.windows = []
+        self.ions = []
+        self.comps = []
+        self.result = None
+
+    def add_window(self, wave, flux, sig, lsf=None):
+        """ Add a spectral window to the fit
+
+        Parameters:
+          wave: float array
+            Wavelengths (Ang)
+          flux, sig: float arrays
+            Normalized flux and its error
+          lsf: float or array (None)
+            LSF of the window (see smooth.convolve_lsf)
+        """
+        wave = xsv._strip_unit(wave, u.AA)
+        self.windows.append(dict(wave=np.asarray(wave, dtype=np.float64),
+                                 flux=np.asarray(flux, dtype=np.float64),
+                                 sig=np.asarray(sig, dtype=np.float64), lsf=lsf))
+
+    def add_ion(self, ion, wrest, fval, gamma):
+        """ Add an ion (or a transition to an existing ion)
+
+        Parameters:
+          ion: str or tuple
+            Label of the ion, e.g. 'SiII' or (14,2)
+          wrest, fval, gamma: float or array
+            Rest wavelength (Ang), oscillator strength and damping constant (s^-1)
+
+        Returns:
+          iion: int
+            Index of the ion
+        """
+        wrest = np.atleast_1d(xsv._strip_unit(wrest, u.AA)).astype(np.float64)
+        fval = np.atleast_1d(fval).astype(np.float64) * np.ones(len(wrest))
+        gamma = np.atleast_1d(xsv._strip_unit(gamma, 1/u.s)).astype(np.float64) * np.ones(len(wrest))
+        for iion, iondict in enumerate(self.ions):
+            if iondict['ion'] == ion:
+                new = np.array([np.min(np.fabs(iondict['wrest']-iw)) > 1e-3 for iw in wrest])
+                for key, val in zip(['wrest', 'fval', 'gamma'], [wrest, fval, gamma]):
+                    iondict[key] = np.concatenate([iondict[key], val[new]])
+                return iion
+        self.ions.append(dict(ion=ion, wrest=wrest, fval=fval, gamma=gamma))
+        return len(self.ions)-1
+
+    def add_component(self, iion, logN, z, b, fix=(False, False, False), dvmax=300.):
+        """ Add a component of an ion
+
+        Parameters:
+          iion: int
+            Index of the ion (see add_ion)
+          logN, z, b: float
+            Initial guesses (log cm^-2, redshift, km/s)
+          fix: tuple of bool
+            Hold (logN, z, b) fixed
+          dvmax: float (300.)
+            The redshift may move by at most dvmax (km/s)
+        """
+        self.comps.append(dict(ion=iion, logN=logN, z=z, b=b, fix=tuple(fix), dvmax=dvmax,
+                               sig_logN=0., sig_z=0., sig_b=0.))
+
+    def param(self):
+        """ Parameter vector [logN, z, b] * ncomp """
+        return np.array([[comp[key] for key in par_names] for comp in self.comps],
+                        dtype=np.float64).flatten()
+
+    def bounds(self):
+        """ Lower and upper bounds of the parameter vector """
+        ckms = const.c.to('km/s').value
+        lo, hi = [], []
+        for comp in self.comps:
+            dz = (1+comp['z']) * comp['dvmax'] / ckms
+            lo += [5., comp['z']-dz, 0.5]
+            hi += [23., comp['z']+dz, 300.]
+        return np.array(lo), np.array(hi)
+
+    def _terms(self):
+        """ One term per (component, transition) """
+        tcomp, wrest, fval, gamma = [], [], [], []
+        for kk, comp in enumerate(self.comps):
+            iondict = self.ions[comp['ion']]
+            ntrans = len(iondict['wrest'])
+            tcomp += [kk]*ntrans
+            wrest.append(iondict['wrest'])
+            fval.append(iondict['fval'])
+            gamma.append(iondict['gamma'])
+        return (np.array(tcomp, dtype=np.int_), np.concatenate(wrest),
+                np.concatenate(fval), np.concatenate(gamma))
+
+    def window_model(self, win, param, jac=False):
+        """ Model flux (and its Jacobian) for one window
+
+        Parameters:
+          win: dict
+            Window (see add_window)
+          param: float array
+            Parameter vector (see param)
+          jac: bool (False)
+            Also return the derivatives of the flux
+
+        Returns:
+          flux: float array [npix]
+          dflux: float array [3*ncomp, npix], only if jac=True
+        """
+        from scipy.special import wofz
+
+        wave = win['wave']
+        ncomp = len(self.comps)
+        logN, zval, bval = param.reshape(ncomp, 3).T
+        tcomp, wrest, fval, gamma = self._terms()
+
+        # tau = tau0 H(a,u) for each term
+        tau0, avoigt, wobs, vscl = xsv.line_constants(logN[tcomp], zval[tcomp], bval[tcomp],
+                                                      wrest, fval, gamma)
+        uval = vscl[:,None] * (wobs[:,None]/wave[None,:] - 1.)
+        wz = wofz(uval + 1j*avoigt[:,None])
+        ttau = tau0[:,None] * wz.real
+        flux = np.exp(-1.*np.sum(ttau, 0))
+        if not jac:
+            if win['lsf'] is not None:
+                flux = xsm.convolve_lsf(flux, win['lsf'])
+            return flux
+
+        # Derivatives of H from w'(zeta) = -2 zeta w + 2i/sqrt(pi)
+        dw = -2.*(uval + 1j*avoigt[:,None])*wz + 2j/np.sqrt(np.pi)
+        dHdu = dw.real
+        dHda = -1.*dw.imag
+        dtau = np.zeros((3, len(tcomp), len(wave)))
+        dtau[0] = np.log(10.) * ttau
+        dtau[1] = tau0[:,None] * dHdu * vscl[:,None] * wrest[:,None] / wave[None,:]
+        dtau[2] = -1.*(ttau + tau0[:,None]*(dHdu*uval + dHda*avoigt[:,None])) / bval[tcomp][:,None]
+
+        # Sum the terms of each component
+        dflux = np.zeros((ncomp, 3, len(wave)))
+        for ip in range(3):
+            np.add.at(dflux[:,ip,:], tcomp, dtau[ip])
+        dflux = -1. * flux[None,:] * dflux.reshape(3*ncomp, len(wave))
+
+        # LSF (a linear operator)
+        if win['lsf'] is not None:
+            flux = xsm.convolve_lsf(flux, win['lsf'])
+            dflux = xsm.convolve_lsf(dflux, win['lsf'])
+        return flux, dflux
+
+    def residuals(self, param, jac=False):
+        """ Normalized residuals over all windows (and their Jacobian) """
+        resid, rjac = [], []
+        for win in self.windows:
+            gd = win['sig'] > 0.
+            if jac:
+                flux, dflux = self.window_model(win, param, jac=True)
+                rjac.append((dflux[:,gd] / win['sig'][gd]).T)
+            else:
+                flux = self.window_model(win, param)
+            resid.append((flux[gd]-win['flux'][gd]) / win['sig'][gd])
+        if jac:
+            return np.concatenate(resid), np.concatenate(rjac, 0)
+        return np.concatenate(resid)
+
+    def fit(self, **kwargs):
+        """ Least-squares fit with analytic Jacobians
+        Updates the components with the best values and their errors
+
+        Parameters:
+          **kwargs:
+            Passed to scipy.optimize.least_squares
+
+        Returns:
+          result: OptimizeResult
+        """
+        from scipy.optimize import least_squares
+
+        p0 = self.param()
+        free = ~np.array([comp['fix'] for comp in self.comps]).flatten()
+        lo, hi = self.bounds()
+        x0 = np.minimum(np.maximum(p0[free], lo[free]), hi[free])
+
+        def fill(pfree):
+            pall = p0.copy()
+            pall[free] = pfree
+            return pall
+        def resid(pfree):
+            return self.residuals(fill(pfree))
+        def jacob(pfree):
+            return self.residuals(fill(pfree), jac=True)[1][:,free]
+
+        result = least_squares(resid, x0, jac=jacob, bounds=(lo[free], hi[free]),
+                               x_scale='jac', **kwargs)
+
+        # Covariance from the Jacobian
+        cov = np.linalg.pinv(np.dot(result.jac.T, result.jac))
+        sig = np.zeros(len(p0))
+        sig[free] = np.sqrt(np.maximum(np.diag(cov), 0.))
+        best = fill(result.x)
+        for kk, comp in enumerate(self.comps):
+            for jj, key in enumerate(par_names):
+                comp[key] = best[3*kk+jj]
+                comp['sig_'+key] = sig[3*kk+jj]
+        self.result = result
+        return result
+
+    def table(self):
+        """ Components as an astropy Table """
+        from astropy.table import Table
+        names = [str(key) for key in ['ion', 'logN', 'sig_logN', 'z', 'sig_z', 'b', 'sig_b']]
+        rows = [[str(self.ions[comp['ion']]['ion'])] + [comp[key] for key in names[1:]]
+                for comp in self.comps]
+        return Table(rows=rows, names=names)
+
+    # Output
+    def __repr__(self):
+        return ('[{:s}: nwin={:d}, nion={:d}, ncomp={:d}]'.format(
+                self.__class__.__name__, len(self.windows), len(self.ions), len(self.comps)))
+
+# Atomic data of a line (xastropy or linetools)
+def _line_atomic(line):
+    try:
+        atomic = line.data
+    except AttributeError:
+        atomic = line.atomic
+    try:
+        ion = (atomic['Z'], atomic['ion'])
+    except KeyError:
+        ion = atomic['name'].split(' ')[0]
+    wrest = xsv._strip_unit(line.wrest, u.AA)
+    return ion, wrest, atomic['fval'], xsv._strip_unit(atomic['gamma'], 1/u.s)
+
+# Redshift of a line (xastropy or linetools)
+def _line_z(line):
+    try:
+        return line.attrib['z']
+    except KeyError:
+        return line.analy['z']
+
+
+## #################################
+## #################################
+## TESTING
+## #################################
+if __name__ == '__main__':
+
+    flg_test = 0
+    flg_test += 2**0  # Synthetic SiII
+
+    # Two components of SiII fit across two windows
+    if (flg_test % 2**1) >= 2**0:
+        ckms = const.c.to('km/s').value
+        zabs = 2.5
+        ions = dict(wrest=np.array([1260.4221, 1526.7070]), fval=np.array([1.18, 0.133]),
+                    gamma=np.array([2.95e9, 1.13e9]))
+        truth = np.array([13.2, zabs, 8., 12.8, zabs+40./ckms*(1+zabs), 15.])
+        vfit = VoigtFit()
+        iion = vfit.add_ion('SiII', ions['wrest'], ions['fval'], ions['gamma'])
+        for wrest in ions['wrest']:
+            wave = wrest*(1+zabs) * (1 + np.arange(-150., 200., 2.)/ckms)
+            vfit.add_window(wave, np.ones(len(wave)), 0.02*np.ones(len(wave)), lsf=3.)
+        vfit.add_component(iion, 13.2, zabs, 8.)
+        vfit.add_component(iion, 12.8, truth[4], 15.)
+        for win in vfit.windows:
+            win['flux'] = vfit.window_model(win, truth) + 0.02*np.random.normal(size=len(win['wave']))
+        # Perturb and fit
+        vfit.comps[0]['logN'] = 13.6
+        vfit.comps[1]['b'] = 25.
+        vfit.fit()
+        print(vfit.table())
@@ -28,3 +28,43 @@ def ensure_dir(fil):  # Stolen from the Web
     d = os.path.dirname(fil)
     if not os.path.exists(d):
         os.mkdir(d)
+
+def cache_dir(subdir):
+    ''' Cache directory: $XASTROPY_CACHE/subdir (default ~/.xastropy/cache)
+
+    Parameters:
+      subdir: str
+    '''
+    cdir = os.getenv('XASTROPY_CACHE')
+    if cdir is None:
+        cdir = os.path.join(os.path.expanduser('~'), '.xastropy', 'cache')
+    return os.path.join(cdir, subdir)
+
+def atomic_save(outfil, writer, *args, **kwargs):
+    ''' Write a cache file atomically: to a temporary file in the same
+    directory, then renamed, so readers never see a partial file.
+    The directory is created as needed.  Errors are ignored (the cache
+    is optional).
+
+    Parameters:
+      outfil: str
+      writer: function
+        Called as writer(f, *args, **kwargs) with f the open (binary)
+        file, e.g. np.save or np.savez
+
+    Returns:
+      True if the file was written
+    '''
+    tmpfil = outfil+'.{:d}.tmp'.format(os.getpid())
+    try:
+        d = os.path.dirname(outfil)
+        if (len(d) > 0) and (not os.path.isdir(d)):
+            os.makedirs(d)
+        with open(tmpfil, 'wb') as f:
+            writer(f, *args, **kwargs)
+        os.rename(tmpfil, outfil)
+    except (IOError, OSError):
+        if os.path.isfile(tmpfil):
+            os.remove(tmpfil)
+        return False
+    return True